@@ -0,0 +1,290 @@
+"""
+ai.py
+
+Computer opponent that shoots where ships are most likely to be.
+
+DensityAI keeps, for every ship still afloat, which of its legal placements
+(placement.legal_placements) are still possible, and a heatmap of how many
+possible placements cover each cell. The heatmap is only ever updated
+incrementally:
+  - miss: placements covering that cell are removed (and subtracted)
+  - sink: the sunk ship's placements are removed, as are other ships'
+          placements overlapping its cells
+  - hit:  nothing to remove; the cell joins the set of open (unsunk) hits
+Hunt mode fires at the unshot cell with the highest count. With open hits,
+target mode scores only the placements that pass through them, which is a
+handful per hit.
+
+AIConnection wraps a DensityAI in the connection interface of
+protocol.TextConnection, so server.run_two_player_game_online can use it as
+player 2 (house bot). ai_turn() plays one move in a local TwoPlayerGame.
+
+Run `python ai.py` for shots-to-win and per-move cost, against a bot that
+rebuilds the heatmap every turn.
+"""
+
+import random
+from collections import deque
+
+from battleship import SHIPS, format_coordinate
+from placement import legal_placements, mask_cells, random_fleet
+
+_tables = {}
+
+
+def _placement_table(size, ship_size):
+    """
+    (cells, cover) for one ship length: cells[p] is the tuple of flat cell
+    indices of placement p, cover[cell] the placements covering that cell.
+    Cached per (size, ship_size).
+    """
+    key = (size, ship_size)
+    table = _tables.get(key)
+    if table is None:
+        cells = [tuple(r * size + c for r, c in mask_cells(size, mask))
+                 for mask, _ in legal_placements(size, ship_size)]
+        cover = [[] for _ in range(size * size)]
+        for p, placement in enumerate(cells):
+            for cell in placement:
+                cover[cell].append(p)
+        table = _tables[key] = (cells, cover)
+    return table
+
+
+class DensityAI:
+    """
+    Probability-density shooter for one game against a board of `size` with
+    fleet `ships`. choose() picks the next (row, col); record() feeds back the
+    result as returned by Board.fire_at.
+    """
+
+    def __init__(self, size=10, ships=SHIPS, rng=None):
+        self.size = size
+        self.ships = list(ships)
+        self.rng = rng or random.Random()
+        self._tables = [_placement_table(size, ship_size) for _, ship_size in self.ships]
+        self._alive = [bytearray(b'\x01') * len(cells) for cells, _ in self._tables]
+        self._afloat = list(range(len(self.ships)))
+        self._index = {name: i for i, (name, _) in enumerate(self.ships)}
+        self.counts = [0] * (size * size)
+        for _, cover in self._tables:
+            for cell, placements in enumerate(cover):
+                self.counts[cell] += len(placements)
+        self.shot = bytearray(size * size)
+        self.open_hits = set()
+
+    def choose(self):
+        cell = self._target() if self.open_hits else None
+        if cell is None:
+            cell = self._hunt()
+        return divmod(cell, self.size)
+
+    def record(self, row, col, result, sunk=None):
+        cell = row * self.size + col
+        if result == 'already_shot' or self.shot[cell]:
+            return
+        self.shot[cell] = 1
+        if result == 'miss':
+            self._remove_covering(cell)
+            return
+        self.open_hits.add(cell)
+        if sunk is not None:
+            self._sink(cell, self._index[sunk])
+
+    def _hunt(self):
+        counts, shot = self.counts, self.shot
+        best, choices = -1, []
+        for cell in range(len(counts)):
+            if shot[cell]:
+                continue
+            count = counts[cell]
+            if count > best:
+                best, choices = count, [cell]
+            elif count == best:
+                choices.append(cell)
+        return self.rng.choice(choices)
+
+    def _target(self):
+        """Score unshot cells by the possible placements through the open hits."""
+        scores = {}
+        seen = set()
+        open_hits, shot = self.open_hits, self.shot
+        for hit in open_hits:
+            for s in self._afloat:
+                cells, cover = self._tables[s]
+                alive = self._alive[s]
+                for p in cover[hit]:
+                    if not alive[p] or (s, p) in seen:
+                        continue
+                    seen.add((s, p))
+                    placement = cells[p]
+                    weight = sum(1 for c in placement if c in open_hits)
+                    for c in placement:
+                        if not shot[c]:
+                            scores[c] = scores.get(c, 0) + weight
+        if not scores:
+            return None
+        best = max(scores.values())
+        return self.rng.choice([c for c, score in scores.items() if score == best])
+
+    def _remove_covering(self, cell, ships=None):
+        counts = self.counts
+        for s in self._afloat if ships is None else ships:
+            cells, cover = self._tables[s]
+            alive = self._alive[s]
+            for p in cover[cell]:
+                if alive[p]:
+                    alive[p] = 0
+                    for c in cells[p]:
+                        counts[c] -= 1
+
+    def _sink(self, cell, s):
+        """Ship s was sunk by the shot at cell: work out which cells it was on and retire it."""
+        cells, cover = self._tables[s]
+        alive = self._alive[s]
+        hull = (cell,)
+        for p in cover[cell]:
+            if alive[p] and all(c in self.open_hits for c in cells[p]):
+                hull = cells[p]
+                break
+
+        counts = self.counts
+        for p, placement in enumerate(cells):
+            if alive[p]:
+                alive[p] = 0
+                for c in placement:
+                    counts[c] -= 1
+        self._afloat.remove(s)
+        for c in hull:
+            self.open_hits.discard(c)
+            self._remove_covering(c)  # no other ship can overlap the wreck
+
+
+class AIConnection:
+    """
+    House bot with the connection interface of protocol.TextConnection. It
+    answers the server's prompts through recv(): a random fleet, placed with
+    one FLEET command, and shots from a DensityAI that learns from send_result().
+    """
+    binary = False
+    conn = None
+
+    def __init__(self, size=10, ships=SHIPS, rng=None):
+        self.size = size
+        self.ships = ships
+        self.rng = rng or random.Random()
+        self.ai = None
+        self._fleet = []
+        self._replies = deque()
+        self._last_shot = None
+
+    def new_match(self):
+        self.ai = DensityAI(self.size, self.ships, self.rng)
+        self._fleet = random_fleet(self.size, self.ships, self.rng)
+
+    def send(self, msg):
+        if msg.startswith("Enter starting coordinate"):
+            self._replies.append("FLEET " + " ".join(f"{format_coordinate(row, col)} {'HV'[orientation]}"
+                                                     for row, col, orientation in self._fleet))
+        elif msg.startswith("Your turn!"):
+            self._last_shot = self.ai.choose()
+            self._replies.append(format_coordinate(*self._last_shot))
+
+    def send_board(self, grid, own=False, origin=None):
+        pass
+
+    def send_target_board(self, grid, origin=None):
+        pass
+
+    def send_cells(self, cells, own=False):
+        pass
+
+    def send_result(self, result, sunk, game_over, message):
+        if self._last_shot is not None and result in ('hit', 'miss', 'already_shot'):
+            self.ai.record(*self._last_shot, result, sunk)
+        self._last_shot = None
+
+    def cork(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def uncork(self):
+        pass
+
+    def interrupt(self):
+        pass  # never idle
+
+    def recv(self):
+        """The answer to the last prompt; None (treated as a disconnect) if there was no prompt."""
+        return self._replies.popleft() if self._replies else None
+
+    def close(self):
+        pass
+
+
+def ai_turn(game, ai):
+    """
+    Let ai play the current turn of a local TwoPlayerGame.
+    Returns TwoPlayerGame.fire's (result, sunk, game_over, message).
+    """
+    row, col = ai.choose()
+    outcome = game.fire(format_coordinate(row, col))
+    ai.record(row, col, outcome[0], outcome[1])
+    return outcome
+
+
+def _naive_choose(size, ships, afloat, shot, misses, open_hits, rng):
+    """Baseline: rebuild the whole heatmap from every placement on every turn."""
+    counts = [0] * (size * size)
+    blocked = misses
+    for name, ship_size in ships:
+        if name not in afloat:
+            continue
+        cells, _ = _placement_table(size, ship_size)
+        for placement in cells:
+            if any(c in blocked for c in placement):
+                continue
+            weight = 1 + 20 * sum(1 for c in placement if c in open_hits)
+            for c in placement:
+                counts[c] += weight
+    best = max(counts[c] for c in range(size * size) if not shot[c])
+    return rng.choice([c for c in range(size * size) if not shot[c] and counts[c] == best])
+
+
+def _benchmark(games=300):
+    import time
+    from battleship import Board
+
+    rng = random.Random(7)
+    board = Board(10)
+    for label in ("incremental", "naive"):
+        total_shots = 0
+        elapsed = 0.0
+        for _ in range(games):
+            board.reset()  # one board, reused game after game
+            board.place_ships_randomly(SHIPS)
+            ai = DensityAI(rng=rng)
+            afloat = {name for name, _ in SHIPS}
+            misses = set()
+            while not board.all_ships_sunk():
+                start = time.perf_counter()
+                if label == "incremental":
+                    row, col = ai.choose()
+                else:
+                    row, col = divmod(_naive_choose(10, SHIPS, afloat, ai.shot, misses, ai.open_hits, rng), 10)
+                result, sunk = board.fire_at(row, col)
+                ai.record(row, col, result, sunk)
+                elapsed += time.perf_counter() - start
+                total_shots += 1
+                if result == 'miss':
+                    misses.add(row * 10 + col)
+                if sunk:
+                    afloat.discard(sunk)
+        print(f"{label:>11}: {total_shots / games:5.1f} shots/game  "
+              f"{elapsed / total_shots * 1e6:7.1f} us/move (choose + record)")
+
+
+if __name__ == "__main__":
+    _benchmark()
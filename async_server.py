@@ -0,0 +1,296 @@
+"""
+async_server.py
+
+asyncio-based server engine. Instead of one thread per connection (plus one per
+match and two per placement phase), every client is a coroutine on a
+StreamReader/StreamWriter pair, so a single thread can hold many thousands of
+idle connections.
+
+The lobby, ship placement and turn loop mirror run_two_player_game_online in
+server.py and send exactly the same text messages, so client.py works unchanged.
+
+Run with `python server.py --async` or `python async_server.py`.
+"""
+
+import asyncio
+from battleship import SHIPS, parse_coordinate, render_grid
+from gamepool import GamePool
+from logs import log, setup as setup_logging
+from matchmaking import Matchmaker, AsyncTicket
+from protocol import HIGH_WATER, WRITE_DEADLINE
+from config import HOST, PORT, TEST_MODE, LOG_LEVEL, HELLO_WAIT, raise_fd_limit
+
+matchmaker = Matchmaker(AsyncTicket)
+game_pool = GamePool()
+
+
+async def drain(writer):
+    """
+    writer.drain(), which only waits while more than HIGH_WATER bytes are
+    buffered; a client that stays over it for WRITE_DEADLINE seconds is cut off
+    rather than stalling its match (as protocol.Output does for the threaded server).
+    """
+    try:
+        await asyncio.wait_for(writer.drain(), WRITE_DEADLINE)
+    except asyncio.TimeoutError:
+        log.info("Cutting off a client that stopped reading")
+        writer.transport.abort()
+        raise ConnectionError("client stopped reading")
+
+
+async def send(writer, msg):
+    writer.write((msg + '\n').encode())
+    await drain(writer)
+
+
+async def send_board(writer, board_grid):
+    writer.write(render_grid(board_grid).encode())
+    await drain(writer)
+
+
+async def send_player_board(writer, board):
+    writer.write(("Your current board:\n" + render_grid(board.hidden_grid)).encode())
+    await drain(writer)
+
+
+async def recv(reader):
+    """
+    Read one line from the client. Raises ConnectionError on EOF so callers
+    don't spin on empty reads the way a bare readline() loop would.
+    """
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("client disconnected")
+    return line.decode().strip()
+
+
+async def prompt_placement(game, player_index, reader, writer, ships):
+    """
+    Coroutine version of the per-player placement dialogue.
+    Both players' dialogues run concurrently via asyncio.gather.
+    """
+    await send(writer, f"Welcome Player {player_index + 1}! Let's place your ships.")
+    board = game.player_boards[player_index]
+
+    await send(writer, "Your board is empty. Here's what it looks like now:")
+    await send_player_board(writer, board)
+    await send(writer, "Or place them all in one line: FLEET, then a coordinate and H or V for each ship in the order "
+                       "they are asked for (FLEET A1 H C3 V ...), or FLEET RANDOM.")
+
+    for ship_index, (ship_name, ship_size) in enumerate(ships):
+        if game.ships_placed[player_index]:
+            break
+        while True:
+            await send(writer, f"Place your {ship_name} (size {ship_size})")
+            await send(writer, "Enter starting coordinate (e.g. A1):")
+            coord = await recv(reader)
+
+            words = coord.split()
+            if words and words[0].upper() == "FLEET":
+                placed, result = game.place_fleet(player_index, words[1:], ships[ship_index:])
+                if not placed:
+                    await send(writer, f"Fleet not placed ({len(result)} problem{'s' if len(result) > 1 else ''}):")
+                    for error in result:
+                        await send(writer, f"  {error}")
+                    continue
+                await send(writer, f"{len(result)} ships placed.")
+                await send_player_board(writer, board)
+                break
+
+            await send(writer, "Enter orientation (H for horizontal, V for vertical):")
+            orient = (await recv(reader)).upper()
+
+            try:
+                row, col = parse_coordinate(coord)
+            except (ValueError, IndexError) as e:
+                await send(writer, f"Error: {e}. Try again.")
+                continue
+
+            if orient == 'H':
+                orientation = 0
+            elif orient == 'V':
+                orientation = 1
+            else:
+                await send(writer, "Invalid orientation. Please enter H or V.")
+                continue
+
+            if row >= board.size or col >= board.size:
+                await send(writer, f"Error: {coord.strip()} is off the board. Try again.")
+                continue
+
+            if not board.can_place_ship(row, col, ship_size, orientation):
+                await send(writer, f"Cannot place {ship_name} at {coord} with orientation {orient}. Try again.")
+                continue
+
+            board.add_ship(ship_name, row, col, ship_size, orientation)
+            await send(writer, f"{ship_name} placed successfully.")
+            await send_player_board(writer, board)
+            break
+
+    game.ships_placed[player_index] = True
+    await send(writer, "All ships placed successfully. Waiting for opponent...\n")
+
+
+async def run_two_player_game_async(reader1, writer1, reader2, writer2):
+    """
+    Coroutine equivalent of server.run_two_player_game_online.
+    Connection errors from either side end the match; they never propagate to
+    the caller, so the surviving player can return to the lobby.
+    """
+    test_ships = [("TestShip", 1)] if TEST_MODE else SHIPS
+
+    game = game_pool.acquire()
+    readers = [reader1, reader2]
+    writers = [writer1, writer2]
+
+    # Step 1: placement for both players concurrently
+    results = await asyncio.gather(
+        *(prompt_placement(game, i, readers[i], writers[i], test_ships) for i in [0, 1]),
+        return_exceptions=True
+    )
+
+    try:
+        if not all(game.ships_placed):
+            for i, result in enumerate(results):
+                if isinstance(result, Exception):
+                    log.info("Player %d left during placement: %s", i + 1, result)
+            for w in writers:
+                if not w.is_closing():
+                    await send(w, "Game could not start due to ship placement error.")
+            game_pool.release(game)
+            return
+
+        # Step 2: start game
+        for w in writers:
+            await send(w, "Both players ready! Game begins.")
+
+        while game.active:
+            current = game.get_current_player_index()
+            opponent = game.get_opponent_index()
+            r = readers[current]
+            w = writers[current]
+            opp_w = writers[opponent]
+
+            await send_board(w, game.get_visible_board_for_player(current))
+            await send(w, "Your turn! Enter coordinate to fire at (or 'quit'):")
+
+            try:
+                move = await recv(r)
+            except ConnectionError:
+                await send(opp_w, "Opponent disconnected. You win!")
+                break
+
+            if move.lower() == 'quit':
+                await send(w, "You quit. Goodbye!")
+                await send(opp_w, "Opponent quit. You win!")
+                break
+
+            result, sunk, game_over, message = game.fire(move)
+            opponent_message = message.replace(" You win!", "")
+
+            await send(w, message)
+            await send(opp_w, f"Opponent fired at {move}: {opponent_message}")
+
+            if game_over:
+                await send(w, "You win!")
+                await send(opp_w, "You lose!")
+                break
+    except (ConnectionError, OSError) as e:
+        log.info("Match ended by connection error: %s", e)
+
+    for w in writers:
+        try:
+            await send(w, "Game over. Returning to the lobby...")
+        except (ConnectionError, OSError):
+            pass
+    game_pool.release(game)
+
+
+def is_connected(reader, writer):
+    return not (reader.at_eof() or writer.is_closing())
+
+
+async def wait_in_lobby(ticket, reader):
+    """
+    Wait until the match that picked this ticket up is over. While queued we keep
+    a readline() pending so a hang-up evicts the ticket immediately; the host
+    cancels that read when it takes over the connection. Lobby input is discarded.
+    """
+    while True:
+        read = ticket.lobby_read = asyncio.ensure_future(reader.readline())
+        await asyncio.wait({read, ticket.finished}, return_when=asyncio.FIRST_COMPLETED)
+        if not read.done() or read.cancelled():
+            break  # matched: the host now owns our reader
+        if read.exception() is not None or not read.result():
+            if matchmaker.leave(ticket):
+                return
+            break  # EOF raced with the match; the game will see it
+    if not read.done():
+        read.cancel()
+    await ticket.wait_finished()
+
+
+async def lobby(reader, writer):
+    """
+    Queue this client with the matchmaker. The client that completes a pair hosts
+    the match in its own coroutine; the waiting client sleeps in wait_in_lobby.
+    Both loop back afterwards.
+    """
+    while is_connected(reader, writer):
+        await send(writer, "Waiting for another player...")
+
+        ticket = matchmaker.join((reader, writer))
+        if not ticket.is_host:
+            await wait_in_lobby(ticket, reader)
+            continue
+
+        opp_reader, opp_writer = ticket.opponent.player
+        read = ticket.opponent.lobby_read
+        if read is not None and not read.done():
+            read.cancel()
+            await asyncio.wait({read})
+
+        stats = matchmaker.stats()
+        log.info("Starting a new game (waited %.3fs, avg %.3fs, %d still waiting)",
+                 ticket.opponent.time_to_match, stats['avg_time_to_match'], stats['waiting'])
+        try:
+            await run_two_player_game_async(opp_reader, opp_writer, reader, writer)
+        finally:
+            ticket.opponent.finish()
+
+
+async def handle_client(reader, writer):
+    addr = writer.get_extra_info('peername')
+    log.info("New client from %s", addr)
+    writer.transport.set_write_buffer_limits(high=HIGH_WATER)
+    try:
+        try:
+            # The client's HELLO; no sessions here, so a RESUME is taken as one too
+            await asyncio.wait_for(reader.readline(), HELLO_WAIT)
+        except asyncio.TimeoutError:
+            pass  # an older client that doesn't send one
+        await lobby(reader, writer)
+    except (ConnectionError, OSError) as e:
+        log.info("Client %s disconnected: %s", addr, e)
+    finally:
+        writer.close()
+
+
+async def serve(host=HOST, port=PORT):
+    server = await asyncio.start_server(handle_client, host, port, backlog=1024, reuse_address=True)
+    log.info("Async server listening on %s:%d", host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    setup_logging(LOG_LEVEL)
+    raise_fd_limit()
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        log.info("Server shutting down.")
+
+
+if __name__ == "__main__":
+    main()
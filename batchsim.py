@@ -0,0 +1,251 @@
+"""
+batchsim.py
+
+Vectorized batch simulator for offline experiments (targeting strategies,
+fleet/board parameters). Requires NumPy; nothing in the game or server imports it.
+
+BatchBoards holds K boards as arrays, one row per board, cells flattened to
+row * size + col:
+  - ship_id:   int8  (K, cells)  index into `ships`, -1 for water
+  - shot:      bool  (K, cells)  cells already fired at
+  - remaining: int16 (K, ships)  not-yet-hit cells of each ship
+  - cells_left: int16 (K,)       not-yet-hit ship cells on the board
+
+fire() applies one shot to each of a set of boards in a single vectorized step
+and returns result/sunk/game-over arrays with the same meaning as
+Board.fire_at + Board.all_ships_sunk. cross_check() verifies that against the
+scalar Board on random boards and shots.
+
+Run `python batchsim.py` for the cross-check and throughput numbers.
+"""
+
+import numpy as np
+
+from battleship import Board, SHIPS
+from placement import legal_placements, mask_cells, random_fleet
+
+# fire() result codes
+MISS = 0
+HIT = 1
+ALREADY_SHOT = 2
+RESULT_NAMES = ('miss', 'hit', 'already_shot')
+
+
+_cell_tables = {}
+
+
+def _placement_cells(size, ship_size):
+    """
+    legal_placements() as an array: row i holds the flat cell indices covered
+    by placement i. Cached per (size, ship_size).
+    """
+    key = (size, ship_size)
+    cells = _cell_tables.get(key)
+    if cells is None:
+        cells = np.array([sorted(r * size + c for r, c in mask_cells(size, mask))
+                          for mask, _ in legal_placements(size, ship_size)], dtype=np.intp)
+        _cell_tables[key] = cells
+    return cells
+
+
+class BatchBoards:
+    """
+    K independent boards with the same size and fleet. Boards are filled by
+    place_random() or from_fleets(); fire() takes one shot per listed board.
+    """
+
+    def __init__(self, k, size=10, ships=SHIPS):
+        self.k = k
+        self.size = size
+        self.ships = list(ships)
+        cells = size * size
+        self.ship_id = np.full((k, cells), -1, dtype=np.int8)
+        self.shot = np.zeros((k, cells), dtype=bool)
+        self.remaining = np.zeros((k, len(self.ships)), dtype=np.int16)
+        self.cells_left = np.zeros(k, dtype=np.int16)
+
+    @classmethod
+    def from_fleets(cls, fleets, size=10, ships=SHIPS):
+        """Boards from a list of fleets as returned by placement.random_fleet."""
+        batch = cls(len(fleets), size, ships)
+        for b, fleet in enumerate(fleets):
+            for s, ((_, ship_size), (row, col, orientation)) in enumerate(zip(ships, fleet)):
+                step = 1 if orientation == 0 else size
+                start = row * size + col
+                batch.ship_id[b, start:start + step * ship_size:step] = s
+        batch._reset_counts()
+        return batch
+
+    @classmethod
+    def random(cls, k, size=10, ships=SHIPS, rng=None, max_rounds=50):
+        batch = cls(k, size, ships)
+        batch.place_random(rng, max_rounds)
+        return batch
+
+    def place_random(self, rng=None, max_rounds=50):
+        """
+        Place a random fleet on every board. Each ship draws a legal placement
+        for all boards at once; boards where it overlaps an earlier ship redraw.
+        Boards still unplaced after max_rounds fall back to placement.random_fleet.
+        The resulting distribution matches placement.random_fleet.
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        self.ship_id.fill(-1)
+        occupied = np.zeros(self.ship_id.shape, dtype=bool)
+        todo = np.arange(self.k)
+        for s, (_, ship_size) in enumerate(self.ships):
+            cells = _placement_cells(self.size, ship_size)
+            pending = todo
+            for _ in range(max_rounds):
+                if not len(pending):
+                    break
+                chosen = cells[rng.integers(len(cells), size=len(pending))]
+                clash = occupied[pending[:, None], chosen].any(axis=1)
+                ok = pending[~clash]
+                occupied[ok[:, None], chosen[~clash]] = True
+                self.ship_id[ok[:, None], chosen[~clash]] = s
+                pending = pending[clash]
+            if len(pending):
+                # Boxed out by earlier ships: redo those boards from scratch
+                seeds = rng.integers(2 ** 32, size=len(pending))
+                self._place_scalar(pending, seeds)
+                occupied[pending] = self.ship_id[pending] >= 0
+                todo = np.setdiff1d(todo, pending)
+        self._reset_counts()
+
+    def _place_scalar(self, boards, seeds):
+        import random
+        for b, seed in zip(boards, seeds):
+            fleet = random_fleet(self.size, self.ships, random.Random(int(seed)))
+            self.ship_id[b] = -1
+            for s, ((_, ship_size), (row, col, orientation)) in enumerate(zip(self.ships, fleet)):
+                step = 1 if orientation == 0 else self.size
+                start = row * self.size + col
+                self.ship_id[b, start:start + step * ship_size:step] = s
+
+    def _reset_counts(self):
+        self.shot.fill(False)
+        sizes = np.array([ship_size for _, ship_size in self.ships], dtype=np.int16)
+        self.remaining[:] = sizes
+        self.cells_left[:] = sizes.sum()
+
+    def fire(self, cells, boards=None):
+        """
+        Fire at flat cell index cells[i] on board boards[i] (all boards, in order,
+        if boards is None). Each board may appear at most once per call.
+
+        Returns (result, sunk, game_over) arrays aligned with cells:
+          - result: MISS, HIT or ALREADY_SHOT (as Board.fire_at's first element)
+          - sunk: index into `ships` of the ship this shot sank, else -1
+          - game_over: Board.all_ships_sunk() after the shot
+        """
+        boards = np.arange(self.k) if boards is None else np.asarray(boards)
+        cells = np.asarray(cells)
+        already = self.shot[boards, cells]
+        sid = self.ship_id[boards, cells].astype(np.intp)
+        self.shot[boards, cells] = True
+
+        hit = ~already & (sid >= 0)
+        hit_boards, hit_ships = boards[hit], sid[hit]
+        self.remaining[hit_boards, hit_ships] -= 1
+        self.cells_left[hit_boards] -= 1
+
+        result = np.where(already, ALREADY_SHOT, np.where(sid >= 0, HIT, MISS)).astype(np.int8)
+        sunk = np.full(len(cells), -1, dtype=np.int8)
+        sunk[hit] = np.where(self.remaining[hit_boards, hit_ships] == 0, hit_ships, -1)
+        return result, sunk, self.cells_left[boards] == 0
+
+    def fire_at(self, rows, cols, boards=None):
+        """fire() with separate row and column arrays."""
+        return self.fire(np.asarray(rows) * self.size + np.asarray(cols), boards)
+
+    def all_ships_sunk(self):
+        return self.cells_left == 0
+
+
+def play_random(batch, rng=None):
+    """
+    Play every board to the end with a uniformly random shot order (no repeats).
+    Returns the number of shots each board took to sink its fleet.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    order = rng.random(batch.shot.shape).argsort(axis=1)
+    shots_taken = np.zeros(batch.k, dtype=np.int16)
+    active = np.flatnonzero(~batch.all_ships_sunk())
+    for turn in range(order.shape[1]):
+        if not len(active):
+            break
+        _, _, game_over = batch.fire(order[active, turn], active)
+        shots_taken[active[game_over]] = turn + 1
+        active = active[~game_over]
+    return shots_taken
+
+
+def cross_check(n_boards=2000, shots_per_board=150, size=10, ships=SHIPS, seed=0):
+    """
+    Replay the same random shots (repeats included) on BatchBoards and on scalar
+    Boards and compare every (result, sunk ship, game over). Returns the number
+    of shots compared; raises AssertionError on the first mismatch.
+    """
+    import random
+    py_rng = random.Random(seed)
+    fleets = [random_fleet(size, ships, py_rng) for _ in range(n_boards)]
+    batch = BatchBoards.from_fleets(fleets, size, ships)
+    boards = []
+    for fleet in fleets:
+        board = Board(size)
+        for (name, ship_size), (row, col, orientation) in zip(ships, fleet):
+            board.add_ship(name, row, col, ship_size, orientation)
+        boards.append(board)
+
+    np_rng = np.random.default_rng(seed)
+    for _ in range(shots_per_board):
+        rows = np_rng.integers(size, size=n_boards)
+        cols = np_rng.integers(size, size=n_boards)
+        result, sunk, game_over = batch.fire_at(rows, cols)
+        for b, board in enumerate(boards):
+            expected = board.fire_at(int(rows[b]), int(cols[b]))
+            got = (RESULT_NAMES[result[b]], ships[sunk[b]][0] if sunk[b] >= 0 else None)
+            assert got == expected, f"board {b} shot {rows[b]},{cols[b]}: {got} != {expected}"
+            assert bool(game_over[b]) == board.all_ships_sunk(), f"board {b}: game over mismatch"
+    return n_boards * shots_per_board
+
+
+if __name__ == "__main__":
+    import time
+
+    compared = cross_check()
+    print(f"cross-check: {compared} shots identical to Board.fire_at")
+
+    k = 100_000
+    rng = np.random.default_rng(1)
+    start = time.perf_counter()
+    batch = BatchBoards.random(k, rng=rng)
+    print(f"placement: {k / (time.perf_counter() - start):12,.0f} fleets/s")
+
+    cells = rng.integers(100, size=k)
+    start = time.perf_counter()
+    rounds = 20
+    for _ in range(rounds):
+        batch.fire(cells)
+        cells = (cells + 37) % 100
+    print(f"fire():    {k * rounds / (time.perf_counter() - start):12,.0f} shots/s  (K={k})")
+
+    batch = BatchBoards.random(k, rng=rng)
+    start = time.perf_counter()
+    taken = play_random(batch, rng)
+    elapsed = time.perf_counter() - start
+    print(f"random-order games: {k / elapsed:10,.0f} games/s, "
+          f"{int(taken.sum()) / elapsed:12,.0f} shots/s, mean {taken.mean():.1f} shots to win")
+
+    start = time.perf_counter()
+    n = 0
+    scalar = Board(10)
+    for _ in range(200):
+        scalar.reset()
+        scalar.place_ships_randomly(SHIPS)
+        for r in range(10):
+            for c in range(10):
+                scalar.fire_at(r, c)
+                n += 1
+    print(f"scalar Board.fire_at: {n / (time.perf_counter() - start):10,.0f} shots/s")
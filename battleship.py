@@ -4,11 +4,16 @@ battleship.py
 Contains core data structures and logic for Battleship, including:
  - Board class for storing ship positions, hits, misses
  - Utility function parse_coordinate for translating e.g. 'B5' -> (row, col)
+ - Utility function render_grid for the "GRID" text block sent to clients
+ - view() for showing boards bigger than VIEWPORT a window at a time
  - A test harness run_single_player_game() to demonstrate the logic in a local, single-player mode
 
 """
 
 import random
+import re
+
+from placement import random_fleet
 
 TEST_MODE = False
 
@@ -21,6 +26,14 @@ SHIPS = [
     ("Destroyer", 2)
 ]
 
+# Orientation letters as typed by players -> 0 (horizontal) or 1 (vertical)
+ORIENTATIONS = {'H': 0, 'V': 1}
+
+# Boards bigger than this (rows and columns) are shown a VIEWPORT-square window at a time
+VIEWPORT = 20
+# Biggest board TwoPlayerGame gives dense Boards; bigger ones get a SparseBoard (sparseboard.py)
+DENSE_LIMIT = 100
+
 """
 #test Data
 BOARD_SIZE = 2
@@ -54,27 +67,30 @@ class Board:
         self.display_grid = [['.' for _ in range(size)] for _ in range(size)]
         self.placed_ships = []
 
+    def reset(self):
+        """
+        Clear ships and shots in place, leaving the empty board __init__ made
+        (the grids' lists are reused; see gamepool.py).
+        """
+        water = ['.'] * self.size
+        for row in self.hidden_grid:
+            row[:] = water
+        for row in self.display_grid:
+            row[:] = water
+        self.placed_ships.clear()
+
     def place_ships_randomly(self, ships=SHIPS):
         """
         Randomly place each ship in 'ships' on the hidden_grid, storing positions for each ship.
+        Placements are drawn from placement.random_fleet, which samples only from positions
+        that are still legal, so this never loops on crowded or small boards. Expects an empty board.
         In a networked version, you might parse explicit placements from a player's commands
         (e.g. "PLACE A1 H BATTLESHIP") or prompt the user for board coordinates and placement orientations; 
         the self.place_ships_manually() can be used as a guide.
         """
-        for ship_name, ship_size in ships:
-            placed = False
-            while not placed:
-                orientation = random.randint(0, 1)  # 0 => horizontal, 1 => vertical
-                row = random.randint(0, self.size - 1)
-                col = random.randint(0, self.size - 1)
-
-                if self.can_place_ship(row, col, ship_size, orientation):
-                    occupied_positions = self.do_place_ship(row, col, ship_size, orientation)
-                    self.placed_ships.append({
-                        'name': ship_name,
-                        'positions': occupied_positions
-                    })
-                    placed = True
+        fleet = random_fleet(self.size, ships)
+        for (ship_name, ship_size), (row, col, orientation) in zip(ships, fleet):
+            self.add_ship(ship_name, row, col, ship_size, orientation)
 
 
     def place_ships_manually(self, ships=SHIPS):
@@ -107,11 +123,7 @@ class Board:
 
                 # Check if we can place the ship
                 if self.can_place_ship(row, col, ship_size, orientation):
-                    occupied_positions = self.do_place_ship(row, col, ship_size, orientation)
-                    self.placed_ships.append({
-                        'name': ship_name,
-                        'positions': occupied_positions
-                    })
+                    self.add_ship(ship_name, row, col, ship_size, orientation)
                     break
                 else:
                     print(f"  [!] Cannot place {ship_name} at {coord_str} (orientation={orientation_str}). Try again.")
@@ -121,8 +133,11 @@ class Board:
         """
         Check if we can place a ship of length 'ship_size' at (row, col)
         with the given orientation (0 => horizontal, 1 => vertical).
-        Returns True if the space is free, False otherwise.
+        Returns True if the space is free, False otherwise (including when
+        (row, col) is off the board).
         """
+        if not (0 <= row < self.size and 0 <= col < self.size):
+            return False
         if orientation == 0:  # Horizontal
             if col + ship_size > self.size:
                 return False
@@ -152,6 +167,17 @@ class Board:
                 occupied.add((r, col))
         return occupied
 
+    def add_ship(self, ship_name, row, col, ship_size, orientation):
+        """
+        Place a ship (the caller should have checked can_place_ship() first) and record
+        it in placed_ships so fire_at() can report when it has been sunk.
+        """
+        occupied = self.do_place_ship(row, col, ship_size, orientation)
+        self.placed_ships.append({
+            'name': ship_name,
+            'positions': occupied
+        })
+
     def fire_at(self, row, col):
         """
         Fire at (row, col). Return a tuple (result, sunk_ship_name).
@@ -208,6 +234,15 @@ class Board:
                 return False
         return True
 
+    def cell(self, row, col, hidden=False):
+        """One cell as display_grid (or hidden_grid, with hidden=True) has it."""
+        return (self.hidden_grid if hidden else self.display_grid)[row][col]
+
+    def window(self, top, left, height, width, hidden=False):
+        """The rows top..top+height, columns left..left+width of display_grid (or hidden_grid)."""
+        grid = self.hidden_grid if hidden else self.display_grid
+        return [row[left:left + width] for row in grid[top:top + height]]
+
     def print_display_grid(self, show_hidden_board=False):
         """
         Print the board as a 2D grid.
@@ -228,27 +263,102 @@ class Board:
 
         # Column headers (1 .. N)
         print("  " + "".join(str(i + 1).rjust(2) for i in range(self.size)))
-        # Each row labeled with A, B, C, ...
+        # Each row labeled with A, B, C, ... Z, AA, AB, ...
         for r in range(self.size):
-            row_label = chr(ord('A') + r)
             row_str = " ".join(grid_to_print[r][c] for c in range(self.size))
-            print(f"{row_label:2} {row_str}")
+            print(f"{row_label(r):2} {row_str}")
+
+
+_COORDINATE = re.compile(r'([A-Z]+)(\d+)|(\d+)\s*[,\s]\s*(\d+)')
+
+
+def row_label(row):
+    """Zero-based row -> its letters, spreadsheet style: 0 => 'A', 25 => 'Z', 26 => 'AA'."""
+    label = ''
+    row += 1
+    while row:
+        row, rem = divmod(row - 1, 26)
+        label = chr(65 + rem) + label
+    return label
+
+
+def format_coordinate(row, col):
+    """Inverse of parse_coordinate: (27, 11) => 'AB12'."""
+    return f"{row_label(row)}{col + 1}"
 
 
 def parse_coordinate(coord_str):
     """
     Convert something like 'B5' into zero-based (row, col).
-    Example: 'A1' => (0, 0), 'C10' => (2, 9)
-    HINT: you might want to add additional input validation here...
+    Example: 'A1' => (0, 0), 'C10' => (2, 9), 'AB12' => (27, 11)
+    Rows past Z take more letters (row_label); 'row,col' numbers also work
+    ('28,12' => (27, 11)). Raises ValueError for anything else. Whether the
+    coordinate is on the board is for the board to say.
     """
-    coord_str = coord_str.strip().upper()
-    row_letter = coord_str[0]
-    col_digits = coord_str[1:]
+    match = _COORDINATE.fullmatch(coord_str.strip().upper())
+    if match is None:
+        raise ValueError(f"expected a coordinate like B5, AB12 or 28,12, not {coord_str.strip()!r}")
+    letters, digits, row_number, col_number = match.groups()
+    if letters is None:
+        row = int(row_number) - 1
+        digits = col_number
+    else:
+        row = -1
+        for letter in letters:
+            row = (row + 1) * 26 + ord(letter) - 65
+    col = int(digits) - 1  # zero-based
+    if row < 0 or col < 0:
+        raise ValueError("rows and columns are numbered from 1")
+    return (row, col)
 
-    row = ord(row_letter) - ord('A')
-    col = int(col_digits) - 1  # zero-based
 
-    return (row, col)
+def render_grid(grid, origin=None):
+    """
+    Render a 2D grid (display_grid or hidden_grid) as the "GRID" text block the
+    client understands: a GRID marker line, a column header, one labelled line per
+    row and a terminating blank line. A window of a bigger board (see view())
+    passes its (top, left) as origin, so rows and columns keep their own labels.
+    """
+    top, left = origin or (0, 0)
+    rows = len(grid)
+    cols = len(grid[0]) if rows else 0
+    width = max(2, len(str(left + cols)))
+    label_width = max(2, len(row_label(top + rows - 1))) if rows else 2
+    lines = ["GRID", " " * label_width + " ".join(str(left + i + 1).rjust(width) for i in range(cols))]
+    for r in range(rows):
+        if width == 2:
+            cells = " " + " ".join(grid[r])
+        else:  # past two digits, cells are padded to sit under their column numbers
+            cells = " ".join(cell.rjust(width) for cell in grid[r])
+        lines.append(f"{row_label(top + r):{label_width}}{cells}")
+    lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+def view(board, focus=None, hidden=False, span=VIEWPORT):
+    """
+    What to show of a board, as (grid, origin) for render_grid and the
+    connections' send_board. A board up to `span` square is shown whole
+    (origin None). A bigger one is shown as the span-square window around
+    focus, a (row, col) (default: the top left corner), and origin is the
+    window's (top, left): what is rendered and sent stays the same size
+    however big the board is.
+    """
+    size = board.size
+    if size <= span:
+        return (board.hidden_grid if hidden else board.display_grid), None
+    row, col = focus or (0, 0)
+    top = min(max(0, row - span // 2), size - span)
+    left = min(max(0, col - span // 2), size - span)
+    return board.window(top, left, span, span, hidden), (top, left)
+
+
+def fleet(copies=1):
+    """SHIPS, `copies` times over for big boards; copies after the first are numbered ("Carrier 2")."""
+    ships = list(SHIPS)
+    for n in range(2, copies + 1):
+        ships += [(f"{name} {n}", ship_size) for name, ship_size in SHIPS]
+    return ships
 
 
 def run_single_player_game_locally():
@@ -312,21 +422,15 @@ def run_single_player_game_online(rfile, wfile):
     You can use this as a starting point, or write your own.
     #####
     """
+    # Output is buffered in wfile and flushed once per move, when we need the client's answer
     def send(msg):
         wfile.write(msg + '\n')
-        wfile.flush()
 
     def send_board(board):
-        wfile.write("GRID\n")
-        wfile.write("  " + " ".join(str(i + 1).rjust(2) for i in range(board.size)) + '\n')
-        for r in range(board.size):
-            row_label = chr(ord('A') + r)
-            row_str = " ".join(board.display_grid[r][c] for c in range(board.size))
-            wfile.write(f"{row_label:2} {row_str}\n")
-        wfile.write('\n')
-        wfile.flush()
+        wfile.write(render_grid(board.display_grid))
 
     def recv():
+        wfile.flush()
         return rfile.readline().strip()
 
     board = Board(BOARD_SIZE)
@@ -341,6 +445,7 @@ def run_single_player_game_online(rfile, wfile):
         guess = recv()
         if guess.lower() == 'quit':
             send("Thanks for playing. Goodbye.")
+            wfile.flush()
             return
 
         try:
@@ -356,6 +461,7 @@ def run_single_player_game_online(rfile, wfile):
                 if board.all_ships_sunk():
                     send_board(board)
                     send(f"Congratulations! You sank all ships in {moves} moves.")
+                    wfile.flush()
                     return
             elif result == 'miss':
                 send("MISS!")
@@ -372,14 +478,35 @@ if __name__ == "__main__":
 class TwoPlayerGame:
     """
     Coordinates a 2-player Battleship game with turn management and win condition.
+    `board_cls` selects the board backend (Board, bitboard.BitBoard or
+    sparseboard.SparseBoard); by default Board, or SparseBoard on boards
+    bigger than DENSE_LIMIT. `size` defaults to BOARD_SIZE.
     """
-    def __init__(self):
-        board_size = 2 if TEST_MODE else 10
-        self.player_boards = [Board(board_size), Board(board_size)]
+    def __init__(self, board_cls=None, size=None):
+        board_size = size or (2 if TEST_MODE else BOARD_SIZE)
+        if board_cls is None:
+            if board_size > DENSE_LIMIT:
+                from sparseboard import SparseBoard as board_cls
+            else:
+                board_cls = Board
+        self.size = board_size
+        self.player_boards = [board_cls(board_size), board_cls(board_size)]
         self.current_turn = 0
         self.active = True
         self.ships_placed = [False, False]
-    
+        self.broadcaster = None  # spectator event stream (broadcast.Broadcaster), set by the server
+        self.game_id = None  # set when the match is journaled (journal.py)
+
+    def reset(self):
+        """Start over on the same boards, as if just constructed (gamepool.GamePool)."""
+        for board in self.player_boards:
+            board.reset()
+        self.current_turn = 0
+        self.active = True
+        self.ships_placed[0] = self.ships_placed[1] = False
+        self.broadcaster = None
+        self.game_id = None
+
 
     def get_current_player_index(self):
         return self.current_turn
@@ -387,36 +514,93 @@ class TwoPlayerGame:
     def get_opponent_index(self):
         return 1 - self.current_turn
     
-    def place_ships_for_player(self, player_index, placements):
+    def place_ships_for_player(self, player_index, placements, ships=SHIPS):
         """
-        Allows a player to manually place their ships.
-        `placements` is a list of tuples: (coord_str, orientation_str)
-        where orientation_str is 'H' or 'V'.
+        Place a player's whole fleet in one go, or none of it.
+        `placements` is a list of tuples: (coord_str, orientation_str), one per
+        ship in `ships`, where orientation_str is 'H' or 'V'. Every placement is
+        checked first (coordinate, orientation, board edges, overlap with the
+        other placements and with ships already on the board), and the ships
+        are only added if all of them fit.
+        Returns (True, [(row, col, orientation), ...]) or (False, errors) with
+        one message per ship that does not fit.
         """
         board = self.player_boards[player_index]
-        for (coord_str, orientation_str), (ship_name, ship_size) in zip(placements, SHIPS):
+        if len(placements) != len(ships):
+            return False, [f"Expected a coordinate and orientation for each of {len(ships)} ships, "
+                           f"got {len(placements)}"]
+        fleet = []
+        errors = []
+        taken = {}  # cell -> name of the ship on it, among these placements
+        for (coord_str, orientation_str), (ship_name, ship_size) in zip(placements, ships):
+            where = f"{ship_name} at {coord_str} {orientation_str}"
             try:
                 row, col = parse_coordinate(coord_str)
-                if orientation_str.upper() == 'H':
-                    orientation = 0
-                elif orientation_str.upper() == 'V':
-                    orientation = 1
-                else:
-                    return False, f"Invalid orientation: {orientation_str}"
-
-                if not board.can_place_ship(row, col, ship_size, orientation):
-                    return False, f"Cannot place {ship_name} at {coord_str} with orientation {orientation_str}"
-
-                occupied = board.do_place_ship(row, col, ship_size, orientation)
-                board.placed_ships.append({
-                    'name': ship_name,
-                    'positions': occupied
-                })
-            except Exception as e:
-                return False, f"Error placing {ship_name}: {e}"
+            except ValueError as e:
+                errors.append(f"{ship_name}: {e}")
+                continue
+            orientation = ORIENTATIONS.get(orientation_str.upper())
+            if orientation is None:
+                errors.append(f"{ship_name}: orientation must be H or V, not {orientation_str!r}")
+                continue
+            if orientation == 0:
+                cells = [(row, c) for c in range(col, col + ship_size)]
+            else:
+                cells = [(r, col) for r in range(row, row + ship_size)]
+            if not (0 <= row < board.size and 0 <= col < board.size) or max(cells[-1]) >= board.size:
+                errors.append(f"{where}: off the board")
+                continue
+            clash = next((taken[cell] for cell in cells if cell in taken), None)
+            if clash is not None:
+                errors.append(f"{where}: overlaps the {clash}")
+                continue
+            if not board.can_place_ship(row, col, ship_size, orientation):
+                errors.append(f"{where}: overlaps a ship already placed")
+                continue
+            for cell in cells:
+                taken[cell] = ship_name
+            fleet.append((row, col, orientation))
+        if errors:
+            return False, errors
+
+        for (ship_name, ship_size), (row, col, orientation) in zip(ships, fleet):
+            board.add_ship(ship_name, row, col, ship_size, orientation)
+        self.ships_placed[player_index] = True
+        return True, fleet
 
+    def place_random_fleet(self, player_index, ships=SHIPS, rng=random):
+        """
+        Place `ships` at random (placement.random_fleet), around any ships
+        already on the player's board. Returns [(row, col, orientation), ...];
+        raises ValueError if they do not fit.
+        """
+        board = self.player_boards[player_index]
+        for _ in range(100):
+            fleet = random_fleet(board.size, ships, rng)
+            if all(board.can_place_ship(row, col, ship_size, orientation)
+                   for (_, ship_size), (row, col, orientation) in zip(ships, fleet)):
+                break
+        else:
+            raise ValueError(f"no room for {len(ships)} more ships")
+        for (ship_name, ship_size), (row, col, orientation) in zip(ships, fleet):
+            board.add_ship(ship_name, row, col, ship_size, orientation)
         self.ships_placed[player_index] = True
-        return True, "All ships placed successfully."
+        return fleet
+
+    def place_fleet(self, player_index, args, ships=SHIPS):
+        """
+        The FLEET command: `args` are its words after FLEET, a coordinate and
+        an orientation for each ship in order ("A1 H B1 V ...") or just RANDOM.
+        Returns like place_ships_for_player.
+        """
+        if len(args) == 1 and args[0].upper() == "RANDOM":
+            try:
+                return True, self.place_random_fleet(player_index, ships)
+            except ValueError as e:
+                return False, [f"Cannot place a random fleet: {e}"]
+        if len(args) % 2:
+            return False, ["FLEET takes a coordinate and an orientation (H or V) for each ship, or RANDOM"]
+        return self.place_ships_for_player(player_index, list(zip(args[::2], args[1::2])), ships)
 
     def fire(self, coord_str):
         """
@@ -427,6 +611,8 @@ class TwoPlayerGame:
             row, col = parse_coordinate(coord_str)
         except ValueError as e:
             return ("invalid", None, False, f"Invalid coordinate: {e}")
+        if row >= self.size or col >= self.size:
+            return ("invalid", None, False, f"Invalid coordinate: {coord_str.strip()} is off the board")
 
         opponent_board = self.player_boards[self.get_opponent_index()]
         result, sunk_ship = opponent_board.fire_at(row, col)
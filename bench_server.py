@@ -0,0 +1,112 @@
+"""
+bench_server.py
+
+Connection-scaling benchmark comparing the threaded server (server.main) with the
+asyncio engine (async_server.main).
+
+For each mode it starts `server.py` in a subprocess, opens N idle client
+connections and reports:
+  - connect rate (connections per second)
+  - server resident memory (VmRSS) and thread count, read from /proc
+
+Usage:
+  python bench_server.py [--clients 10000] [--mode threaded|async|both]
+
+Linux only (uses /proc). The benchmark lifts its own open-file limit; N is
+capped by the hard limit.
+"""
+
+import argparse
+import socket
+import subprocess
+import sys
+import time
+
+from config import HOST, PORT, raise_fd_limit
+
+
+def read_proc_status(pid):
+    """Return (rss_kib, threads) for a process, from /proc/<pid>/status."""
+    rss = threads = 0
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1])
+            elif line.startswith("Threads:"):
+                threads = int(line.split()[1])
+    return rss, threads
+
+
+def wait_for_port(host, port, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def run_mode(mode, n_clients):
+    args = [sys.executable, "server.py"] + (["--async"] if mode == "async" else [])
+    proc = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    socks = []
+    try:
+        if not wait_for_port(HOST, PORT):
+            print(f"[ERROR] {mode} server did not start")
+            return None
+        time.sleep(0.2)  # let the probe connection settle
+        base_rss, base_threads = read_proc_status(proc.pid)
+
+        failures = 0
+        start = time.perf_counter()
+        for _ in range(n_clients):
+            try:
+                socks.append(socket.create_connection((HOST, PORT), timeout=5))
+            except OSError:
+                failures += 1
+        elapsed = time.perf_counter() - start
+
+        time.sleep(1.0)  # give the server time to spin up per-client state
+        alive = proc.poll() is None
+        rss, threads = read_proc_status(proc.pid) if alive else (0, 0)
+        return {
+            'mode': mode,
+            'connected': len(socks),
+            'failed': failures,
+            'connect_rate': len(socks) / elapsed if elapsed else 0.0,
+            'rss_kib': rss,
+            'rss_per_conn': (rss - base_rss) / max(len(socks), 1),
+            'threads': threads,
+            'base_threads': base_threads,
+            'alive': alive,
+        }
+    finally:
+        for s in socks:
+            s.close()
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Idle-connection benchmark: threaded vs asyncio server")
+    parser.add_argument("--clients", type=int, default=10000)
+    parser.add_argument("--mode", choices=["threaded", "async", "both"], default="both")
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    modes = ["threaded", "async"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        stats = run_mode(mode, args.clients)
+        if stats is None:
+            continue
+        print(f"[{stats['mode']:>8}] connected={stats['connected']} failed={stats['failed']} "
+              f"rate={stats['connect_rate']:.0f} conn/s rss={stats['rss_kib'] / 1024:.1f} MiB "
+              f"({stats['rss_per_conn']:.1f} KiB/conn) threads={stats['threads']} "
+              f"server_alive={stats['alive']}")
+        time.sleep(0.5)  # let the port free up before the next mode
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+bitboard.py
+
+Alternative Board backend that keeps the whole board state in a handful of Python ints.
+Cell (row, col) is bit (row * size + col):
+  - ships:      every cell occupied by a ship
+  - hits:       cells fired at that contained a ship
+  - misses:     cells fired at that were empty water
+  - ship_masks: one mask per placed ship (names in ship_names, same order)
+  - ship_at:    cell number -> index of the ship on it, for the ship cells only
+
+Placement overlap, sunk and game-over checks are each a single AND against
+these masks; a hit finds its ship with one ship_at lookup, however many ships
+the fleet has. BitBoard exposes the same API as battleship.Board (can_place_ship,
+do_place_ship, add_ship, fire_at, all_ships_sunk, place_ships_randomly, cell,
+window, reset, ...); hidden_grid/display_grid are built on demand for rendering.
+
+Run `python bitboard.py` for a memory/speed comparison against battleship.Board.
+"""
+
+from battleship import Board, TwoPlayerGame, SHIPS
+from placement import placement_mask, mask_cells
+
+
+class BitBoard:
+    """
+    Bitmask Board backend. Drop-in for Board in TwoPlayerGame(board_cls=BitBoard).
+    Unlike Board, out-of-range coordinates raise IndexError instead of wrapping
+    around via negative list indices.
+    """
+    __slots__ = ('size', 'ships', 'hits', 'misses', 'ship_masks', 'ship_names', 'ship_at')
+
+    def __init__(self, size=10):
+        self.size = size
+        self.ships = 0
+        self.hits = 0
+        self.misses = 0
+        self.ship_masks = []
+        self.ship_names = []
+        self.ship_at = {}
+
+    # These only go through can_place_ship/add_ship and the grid properties
+    place_ships_randomly = Board.place_ships_randomly
+    place_ships_manually = Board.place_ships_manually
+    print_display_grid = Board.print_display_grid
+
+    def reset(self):
+        self.ships = self.hits = self.misses = 0
+        self.ship_masks.clear()
+        self.ship_names.clear()
+        self.ship_at.clear()
+
+    def can_place_ship(self, row, col, ship_size, orientation):
+        mask = placement_mask(self.size, row, col, ship_size, orientation)
+        return mask != 0 and not (mask & self.ships)
+
+    def do_place_ship(self, row, col, ship_size, orientation):
+        """
+        Mark the ship's cells in `ships` and return its mask.
+        """
+        mask = placement_mask(self.size, row, col, ship_size, orientation)
+        self.ships |= mask
+        return mask
+
+    def add_ship(self, ship_name, row, col, ship_size, orientation):
+        index = len(self.ship_masks)
+        self.ship_masks.append(self.do_place_ship(row, col, ship_size, orientation))
+        self.ship_names.append(ship_name)
+        step = 1 if orientation == 0 else self.size
+        start = row * self.size + col
+        for i in range(ship_size):
+            self.ship_at[start + i * step] = index
+
+    def fire_at(self, row, col):
+        """
+        Same contract as Board.fire_at: returns ('hit', None), ('hit', <ship_name>),
+        ('miss', None) or ('already_shot', None).
+        """
+        size = self.size
+        if not (0 <= row < size and 0 <= col < size):
+            raise IndexError("coordinate is off the board")
+        cell = row * size + col
+        bit = 1 << cell
+        if (self.hits | self.misses) & bit:
+            return ('already_shot', None)
+        if not self.ships & bit:
+            self.misses |= bit
+            return ('miss', None)
+
+        hits = self.hits = self.hits | bit
+        index = self.ship_at[cell]
+        mask = self.ship_masks[index]
+        return ('hit', None if mask & ~hits else self.ship_names[index])
+
+    def all_ships_sunk(self):
+        return not (self.ships & ~self.hits)
+
+    @property
+    def placed_ships(self):
+        """
+        Board-compatible view: one dict per ship with its not-yet-hit positions.
+        Read-only; use add_ship() to place ships.
+        """
+        return [{'name': name, 'positions': set(mask_cells(self.size, mask & ~self.hits))}
+                for name, mask in zip(self.ship_names, self.ship_masks)]
+
+    def cell(self, row, col, hidden=False):
+        bit = 1 << (row * self.size + col)
+        if self.hits & bit:
+            return 'X'
+        if self.misses & bit:
+            return 'o'
+        return 'S' if hidden and self.ships & bit else '.'
+
+    def window(self, top, left, height, width, hidden=False):
+        return [[self.cell(r, c, hidden) for c in range(left, min(left + width, self.size))]
+                for r in range(top, min(top + height, self.size))]
+
+    @property
+    def hidden_grid(self):
+        return self._build_grid(show_ships=True)
+
+    @property
+    def display_grid(self):
+        return self._build_grid(show_ships=False)
+
+    def _build_grid(self, show_ships):
+        ships = self.ships if show_ships else 0
+        grid = []
+        bit = 1
+        for _ in range(self.size):
+            row = []
+            for _ in range(self.size):
+                if self.hits & bit:
+                    row.append('X')
+                elif self.misses & bit:
+                    row.append('o')
+                elif ships & bit:
+                    row.append('S')
+                else:
+                    row.append('.')
+                bit <<= 1
+            grid.append(row)
+        return grid
+
+
+def _measure_game_memory(board_cls, n_games):
+    """Average traced bytes per TwoPlayerGame with both fleets placed."""
+    import tracemalloc
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    games = []
+    for _ in range(n_games):
+        game = TwoPlayerGame(board_cls)
+        for board in game.player_boards:
+            board.place_ships_randomly(SHIPS)
+        games.append(game)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / n_games
+
+
+def _time_full_sweeps(board_cls, n_boards):
+    """Seconds per shot when firing at every cell of n_boards random boards, checking for a win each time."""
+    import random
+    import time
+    boards = []
+    for _ in range(n_boards):
+        board = board_cls(10)
+        board.place_ships_randomly(SHIPS)
+        boards.append(board)
+    cells = [(r, c) for r in range(10) for c in range(10)]
+    random.shuffle(cells)
+
+    start = time.perf_counter()
+    for board in boards:
+        for r, c in cells:
+            board.fire_at(r, c)
+            board.all_ships_sunk()
+    return (time.perf_counter() - start) / (n_boards * len(cells))
+
+
+if __name__ == "__main__":
+    n = 2000
+    for cls in (Board, BitBoard):
+        mem = _measure_game_memory(cls, n)
+        per_shot = _time_full_sweeps(cls, n)
+        print(f"{cls.__name__:>8}: {mem:8.0f} bytes/game  {per_shot * 1e9:6.0f} ns/shot (fire_at + all_ships_sunk)")
@@ -0,0 +1,166 @@
+"""
+chat.py
+
+Chat for players and spectators, kept off the game path.
+
+  - Clients send `CHAT <message>`. The line is taken out before the game sees
+    it (sessions.Seat, read by the lobby watcher's thread, for players in a
+    match; the lobby watcher for players in the lobby; the spectator hub for
+    spectators) and handed to post(), which
+    only checks the sender's token bucket and queues the line: the turn loop
+    never formats or sends chat.
+  - One chat thread delivers. It waits `window` seconds after the first
+    queued message, so a burst of messages goes out as one frame
+    ("[chat] name: text" lines), encoded once and passed to every sink
+    (subscribe()). The server's sinks write without blocking: the spectator
+    hub's chat stream, and each player's connection (protocol.Output).
+  - Fan-out costs a send per recipient per frame, so it is bounded however
+    many clients chat: frames are at least `gap` seconds apart (a busy room
+    just gets bigger frames), and the whole room is limited to `room_rate`
+    messages per second on top of the per-sender limit.
+  - The last `history` lines are kept for late joiners (history()).
+
+Run `python chat.py` for the cost of post() and the frames per second a
+busy room produces.
+"""
+
+import threading
+import time
+import weakref
+from collections import deque
+
+from metrics import counter
+
+MAX_LENGTH = 200  # characters of one message
+
+CHAT_MESSAGES = counter("battleship_chat_messages_total", "Chat messages delivered")
+CHAT_DROPPED = counter("battleship_chat_dropped_total", "Chat messages dropped by the rate limits")
+
+
+class ChatRoom:
+    """
+    Each sender may post `rate` messages per second, `burst` at once. A sender
+    is the object that stands for a client (a Seat, a spectator's Subscriber);
+    its bucket goes away with it.
+    """
+
+    def __init__(self, rate=1.0, burst=5, window=0.005, gap=0.05, room_rate=100.0, history=100):
+        self.rate = rate
+        self.burst = burst
+        self.window = window
+        self.gap = gap
+        self.room_rate = room_rate
+        self._buckets = weakref.WeakKeyDictionary()  # sender -> [tokens, last refill]
+        self._room = [room_rate, time.monotonic()]  # one second's worth of burst
+        self._pending = []
+        self._cond = threading.Condition()
+        self._sinks = []
+        self._history = deque(maxlen=history)
+        self.frames = 0
+
+    def start(self):
+        threading.Thread(target=self._run, name="chat", daemon=True).start()
+
+    def subscribe(self, deliver):
+        """deliver(frame) is called on the chat thread with each frame (str, lines without the last newline)."""
+        self._sinks.append(deliver)
+
+    def post(self, sender, text):
+        """Queue a message from sender (shown as sender.name). Returns False if it was over a rate limit."""
+        now = time.monotonic()
+        bucket = self._buckets.get(sender)
+        if bucket is None:
+            bucket = self._buckets[sender] = [self.burst, now]
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            CHAT_DROPPED.inc()
+            return False
+        bucket[0] -= 1
+        text = text[:MAX_LENGTH]
+        if not text.isprintable():
+            text = ''.join(c for c in text if c.isprintable())
+        text = text.strip()
+        if not text:
+            return True
+        with self._cond:
+            room = self._room
+            room[0] = min(self.room_rate, room[0] + (now - room[1]) * self.room_rate)
+            room[1] = now
+            if room[0] < 1:
+                CHAT_DROPPED.inc()
+                return False
+            room[0] -= 1
+            self._pending.append(f"[chat] {sender.name}: {text}")
+            if len(self._pending) == 1:
+                self._cond.notify()
+        return True
+
+    def history(self):
+        """The recent lines, as one frame ('' if none)."""
+        return '\n'.join(list(self._history))
+
+    def _run(self):
+        last = 0.0
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            # Let the rest of a burst arrive, and keep frames `gap` apart
+            time.sleep(max(self.window, last + self.gap - time.monotonic()))
+            last = time.monotonic()
+            with self._cond:
+                lines, self._pending = self._pending, []
+            self._history.extend(lines)
+            frame = '\n'.join(lines)
+            self.frames += 1
+            CHAT_MESSAGES.inc(len(lines))
+            for deliver in self._sinks:
+                deliver(frame)
+
+
+def _benchmark(senders=1000, seconds=2.0):
+    class Sender:
+        def __init__(self, name):
+            self.name = name
+
+    room = ChatRoom(rate=1.0, burst=5, room_rate=1e9)
+    delivered = []
+    room.subscribe(lambda frame: delivered.append(frame.count('\n') + 1))
+    room.start()
+
+    n = 200_000
+    sender = Sender("bench")
+    room.rate = 1e9  # measure the accepting path
+    start = time.perf_counter()
+    for _ in range(n):
+        room.post(sender, "hello")
+    print(f"post() accepted:        {(time.perf_counter() - start) / n * 1e9:6.0f} ns")
+    room.rate = 1.0
+    room.burst = 0
+    del room._buckets[sender]
+    start = time.perf_counter()
+    for _ in range(n):
+        room.post(sender, "hello")
+    print(f"post() rate-limited:    {(time.perf_counter() - start) / n * 1e9:6.0f} ns")
+    time.sleep(0.1)
+    delivered.clear()
+    room.burst = 5
+    frames = room.frames
+
+    # `senders` clients, each posting once per second, spread evenly
+    clients = [Sender(f"c{i}") for i in range(senders)]
+    start = time.perf_counter()
+    i = 0
+    while time.perf_counter() - start < seconds:
+        room.post(clients[i % senders], "hello there")
+        i += 1
+        time.sleep(max(0.0, start + i / senders - time.perf_counter()))
+    time.sleep(0.05)
+    frames = room.frames - frames
+    print(f"{senders} senders at 1 msg/s: {sum(delivered)} messages in {frames} frames "
+          f"({frames / seconds:.0f} frames/s, {sum(delivered) / max(1, frames):.1f} messages per frame)")
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -1,60 +1,319 @@
-import threading
+"""
+client.py
+
+Terminal client, and the core that scripted and bot clients share.
+
+Client is a single-threaded selectors loop over the server socket and
+(interactively) stdin. Received data is buffered and parsed into events for a
+Handler: a text line or message, a board (a complete GRID block, or a BOARD
+or VIEW packet; DELTA packets keep client.boards current), a binary RESULT. Whatever
+the handler outputs while one batch of received data is processed goes to the
+terminal in a single write, followed by the prompt, so a fast match (or a
+spectated bot match) doesn't cost a print per line, and prompt and output
+don't interleave. On boards too big to show whole, a board is a window of it:
+client.origins has where it starts.
+
+Terminal is the interactive handler. Without stdin the same loop runs
+headless: the handler answers through client.send() (see workers._bot).
+
+`--psk FILE` encrypts the binary protocol (secure.py). With `--ticket FILE` the
+session ticket is kept there between runs, so reconnecting (`--resume TOKEN`)
+resumes the session instead of running the full handshake again.
+"""
+
+import os
+import selectors
 import socket
+import sys
+import secure
+from battleship import parse_coordinate, render_grid
+from protocol import (PacketReader, PacketWriter, PKT_TEXT, PKT_FIRE, PKT_RESULT, PKT_BOARD, PKT_DELTA, PKT_VIEW,
+                      BOARD_OWN, BOARD_TARGET, unpack_board, unpack_view, unpack_result, result_message, apply_delta,
+                      pack_fire)
 
 HOST = '127.0.0.1'
 PORT = 5001
+BINARY_PORT = PORT + 1
+SPECTATOR_PORT = PORT + 2
+
+PROMPT = ">> "
+
+
+class Handler:
+    """Client events; every method is optional. Answer with client.send(), stop with client.stop()."""
+
+    def on_text(self, client, text):
+        pass
+
+    def on_board(self, client, kind, grid):
+        pass
+
+    def on_result(self, client, result, sunk, game_over):
+        pass
+
+    def on_close(self, client):
+        pass
+
+
+class Terminal(Handler):
+    """Prints what the server sends, like the original threaded client did."""
+
+    def on_text(self, client, text):
+        if client.binary and text.startswith("Your turn!") and BOARD_TARGET in client.boards:
+            self._board(client, client.boards[BOARD_TARGET], client.origins.get(BOARD_TARGET))
+        client.write(text)
+
+    def on_board(self, client, kind, grid):
+        if not client.binary:
+            self._board(client, grid, client.origins.get(kind))  # "Your current board:" came as its own line
+        elif kind == BOARD_OWN:
+            client.write("Your current board:")
+            self._board(client, grid, client.origins.get(kind))
+        # binary target boards are shown when the server asks for a shot
+
+    def on_result(self, client, result, sunk, game_over):
+        client.write(result_message(result, sunk) + (" You win!" if game_over else ""))
+
+    def on_close(self, client):
+        client.write("[INFO] Server disconnected.")
+        reader = client.reader
+        if reader is not None and (reader.corrupted or reader.out_of_sequence):
+            client.write(f"[INFO] {reader.corrupted} corrupted and {reader.out_of_sequence} out-of-sequence packets")
+
+    @staticmethod
+    def _board(client, grid, origin=None):
+        client.write("\n[Board]")
+        for line in render_grid(grid, origin).splitlines()[1:]:
+            if line.strip():
+                client.write(line.strip())
+
 
-running = True
+class Client:
+    """
+    One connection to the server, text or binary (binary=True). run() loops
+    until the server disconnects or stop() is called; with `stdin`, typed lines
+    are sent to the server ("quit" stops).
+    """
 
+    def __init__(self, sock, binary=False, handler=None, out=None):
+        self.sock = sock
+        self.binary = binary
+        self.handler = handler or Terminal()
+        self.out = out if out is not None else sys.stdout
+        self.boards = {}  # BOARD_OWN / BOARD_TARGET -> grid, as last received
+        self.origins = {}  # the same kinds -> (top, left) when that grid is a window of a bigger board
+        self.awaiting_shot = False  # binary mode: the server last asked us to fire
+        self.running = False
+        self.interactive = False
+        self._output = []
+        if binary:
+            self.reader = PacketReader()
+            self.writer = PacketWriter(sock)
+        else:
+            self.reader = None
+            self._buf = b''
+            self._grid = None  # rows of the GRID block being received
+            self._grid_size = 0
+            self._grid_origin = (0, 0)
+            self._own_next = False  # "Your current board:" announced the next GRID
+            self._after_grid = False
 
-def receive_messages(rfile):
-     while running:
+    def write(self, text):
+        """Queue a line of output for the end of the current batch."""
+        self._output.append(text)
+
+    def send(self, line):
+        """
+        Send a line as the server expects it: in binary mode a coordinate goes as
+        a FIRE packet when we've been asked to fire, anything else as TEXT.
+        """
+        if not self.binary:
+            self.sock.sendall(line.encode() + b'\n')
+            return
+        if self.awaiting_shot:
+            try:
+                row, col = parse_coordinate(line)
+                if 0 <= row < 65536 and 0 <= col < 65536:
+                    self.awaiting_shot = False
+                    self.writer.send(PKT_FIRE, pack_fire(row, col))
+                    return
+            except (ValueError, IndexError):
+                pass
+        self.writer.send(PKT_TEXT, line.encode())
+
+    def stop(self):
+        self.running = False
+
+    def run(self, stdin=None):
+        selector = selectors.DefaultSelector()
+        selector.register(self.sock, selectors.EVENT_READ, self._on_socket)
+        self.interactive = stdin is not None
+        if stdin is not None:
+            selector.register(stdin.fileno(), selectors.EVENT_READ, self._on_stdin)
+            self._stdin_buf = b''
+            self.out.write(PROMPT)
+            self.out.flush()
+        self.running = True
         try:
-            line = rfile.readline()
-            if not line:
-                print("[INFO] Server disconnected.")
-                break
-            line = line.strip()
-            if line == "GRID":
-                print("\n[Board]")
-                while True:
-                    board_line = rfile.readline()
-                    if not board_line or board_line.strip() == "":
+            while self.running:
+                for key, _ in selector.select():
+                    key.data(key.fileobj)
+                    if not self.running:
                         break
-                    print(board_line.strip())
+                self._flush()
+        finally:
+            self._flush()
+            selector.close()
+
+    def _flush(self):
+        if not self._output:
+            return
+        text = '\n'.join(self._output) + '\n'
+        self._output.clear()
+        if self.interactive and self.running:
+            text = '\n' + text + PROMPT  # under the pending prompt, then prompt again
+        self.out.write(text)
+        self.out.flush()
+
+    def _on_stdin(self, fd):
+        data = os.read(fd, 4096)
+        if not data:
+            self.stop()
+            return
+        self._stdin_buf += data
+        *lines, self._stdin_buf = self._stdin_buf.split(b'\n')
+        for line in lines:
+            line = line.decode(errors='replace').rstrip('\r')
+            if line.lower() == "quit":
+                self.stop()
+                return
+            self.send(line)
+        if lines and not self._output:
+            self.out.write(PROMPT)
+            self.out.flush()
+
+    def _on_socket(self, sock):
+        try:
+            if self.binary:
+                closed = self.reader.recv_from(sock) == 0
+                self._packets()
             else:
-                print(line)
-        except Exception as e:
-            print(f"[ERROR] Receiving thread: {e}")
-            break
+                data = sock.recv(65536)
+                closed = not data
+                self._lines(data)
+        except OSError:
+            closed = True
+        if closed:
+            self.handler.on_close(self)
+            self.stop()
 
-def main():
-    global running
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.connect((HOST, PORT))
-        rfile = s.makefile('r')
-        wfile = s.makefile('w')
-
-        # Start the receiving thread
-        receiver = threading.Thread(
-            target=receive_messages, 
-            args=(rfile,), daemon=True
-        )
-        receiver.start()
+    def _packets(self):
+        handler = self.handler
+        while self.running:
+            packet = self.reader.next_packet()
+            if packet is None:
+                return
+            ptype, _, payload = packet
+            if ptype == PKT_TEXT:
+                text = str(payload, 'utf-8', 'replace')
+                if not text.startswith("[chat] "):  # chat can arrive between the prompt and our shot
+                    self.awaiting_shot = text.startswith("Your turn!")
+                handler.on_text(self, text)
+            elif ptype == PKT_BOARD:
+                kind, grid = unpack_board(payload)
+                self.boards[kind] = grid
+                self.origins.pop(kind, None)
+                handler.on_board(self, kind, grid)
+            elif ptype == PKT_VIEW:
+                kind, origin, grid = unpack_view(payload)
+                self.boards[kind] = grid
+                self.origins[kind] = origin
+                handler.on_board(self, kind, grid)
+            elif ptype == PKT_DELTA:
+                apply_delta(self.boards, payload)
+            elif ptype == PKT_RESULT:
+                handler.on_result(self, *unpack_result(payload))
 
+    def _lines(self, data):
+        *lines, self._buf = (self._buf + data).split(b'\n')
+        handler = self.handler
+        for raw in lines:
+            if not self.running:
+                return
+            line = raw.decode(errors='replace').strip()
+            if self._grid is not None:
+                # Rows until a blank line; spectator boards have none, so also stop after `size` rows
+                if line and self._grid_size == 0:
+                    header = line.split()  # the column header; a window's starts past 1
+                    self._grid_size = len(header)
+                    self._grid_origin = (0, int(header[0]) - 1)
+                    continue
+                if line:
+                    label, *row = line.split()
+                    if not self._grid:
+                        self._grid_origin = (parse_coordinate(label + "1")[0], self._grid_origin[1])
+                    self._grid.append(row)
+                if not line or len(self._grid) == self._grid_size:
+                    grid, self._grid = self._grid, None
+                    self._after_grid = bool(line)
+                    kind = BOARD_OWN if self._own_next else BOARD_TARGET
+                    self.boards[kind] = grid
+                    self.origins[kind] = self._grid_origin if any(self._grid_origin) else None
+                    handler.on_board(self, kind, grid)
+                    self._own_next = False
+                continue
+            if line == "GRID":
+                self._grid = []
+                self._grid_size = 0
+                continue
+            if not line and self._after_grid:
+                self._after_grid = False  # the blank line that ends a full GRID block
+                continue
+            self._after_grid = False
+            self._own_next = line == "Your current board:"
+            handler.on_text(self, line)
+
+
+def load_session(path):
+    try:
+        with open(path, 'rb') as f:
+            return secure.Session.load(f.read())
+    except FileNotFoundError:
+        return None
+
+
+def save_session(path, session):
+    # The master secret is in there: owner-only
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(session.dump())
+
+
+def main():
+    psk = secure.PresharedKey.load(sys.argv[sys.argv.index("--psk") + 1]) if "--psk" in sys.argv else None
+    ticket_path = sys.argv[sys.argv.index("--ticket") + 1] if "--ticket" in sys.argv else None
+    binary = "--binary" in sys.argv or psk is not None  # only the binary protocol is encrypted
+    spectate = "--spectate" in sys.argv  # watch matches; of what is typed, the server only takes CHAT lines
+    # `--resume TOKEN` rejoins a game this client dropped out of (token printed at connect)
+    resume = sys.argv[sys.argv.index("--resume") + 1] if "--resume" in sys.argv else None
+    with socket.create_connection((HOST, SPECTATOR_PORT if spectate else BINARY_PORT if binary else PORT)) as s:
+        client = Client(s, binary=binary and not spectate)
+        if psk is not None and client.binary:
+            try:
+                session = secure.connect(s, client.reader, client.writer, psk,
+                                         load_session(ticket_path) if ticket_path else None)
+            except secure.HandshakeError as e:
+                print(f"[INFO] Secure handshake failed: {e}")
+                return
+            if ticket_path and not session.resumed:
+                save_session(ticket_path, session)
+        if not spectate:
+            # Must be the first thing the server reads from us: it waits for it
+            client.send(f"RESUME {resume}" if resume else "HELLO")
         try:
-            while running:
-                user_input = input(">> ")
-                if user_input.lower() == "quit":
-                    running = False
-                    break
-                wfile.write(user_input + '\n')
-                wfile.flush()
+            client.run(stdin=sys.stdin)
         except KeyboardInterrupt:
             print("\n[INFO] Client exiting...")
-        finally:
-            running = False
-            s.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,40 @@
+"""
+config.py
+
+Settings shared by the server engines (server.py, async_server.py, workers.py)
+and the tools that talk to them (loadgen.py, bench_server.py). Kept apart from
+server.py so importing them doesn't build the threaded server's lobby, timer
+wheel and spectator hub.
+"""
+
+import sys
+
+#Turn to true for testing.
+TEST_MODE = False
+
+# A client's first line is HELLO, or RESUME <token> to rejoin a dropped game. The server
+# waits for it, up to this many seconds for older clients that don't send one.
+HELLO_WAIT = 1.0
+
+# debug, info, warning, error or off. Set with `--log-level LEVEL`.
+LOG_LEVEL = sys.argv[sys.argv.index("--log-level") + 1] if "--log-level" in sys.argv else 'info'
+
+HOST = '127.0.0.1'
+PORT = 5001
+BINARY_PORT = PORT + 1  # framed binary protocol (protocol.py)
+SPECTATOR_PORT = PORT + 2  # read-only text stream of the most recent match
+STATS_PORT = PORT + 3  # Prometheus-style metrics (metrics.py), local only
+
+
+def raise_fd_limit():
+    """
+    Lift the soft open-file limit to the hard limit so one process can hold
+    thousands of client sockets. No-op on platforms without `resource`.
+    """
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
@@ -0,0 +1,346 @@
+"""
+journal.py
+
+Append-only move journal, so matches survive a server crash or restart.
+
+Every journaled match writes fixed-size 32-byte records to the current
+segment file in the journal directory:
+  - NEW    a match started (game_id)
+  - SEAT   a player's session token (sessions.Seat), so they can RESUME after a restart
+  - PLACE  a ship was placed (player, ship index into the fleet, row, col, orientation)
+  - FIRE   a valid shot was fired (player, row, col); already-shot cells included,
+           since TwoPlayerGame.fire passes the turn for those too
+  - END    the match is over
+Each record ends in a CRC-32 of the rest, so a write torn by a crash is
+recognised (and ignored) on replay.
+
+Group commit: append() only adds the record to an in-memory batch. One
+flusher thread writes the batch and fdatasyncs it, then wakes every
+appender whose record that flush covered. While one flush is on disk the next
+batch builds up, so a single fsync covers the moves of every game that moved
+in the meantime. With wait=True (the default) append() returns once its
+record is durable; the server waits before telling anyone a move's result.
+
+Segments roll over at segment_bytes. A segment is deleted once every match
+that has a record in it has ended.
+
+recover() replays the segments into TwoPlayerGame objects for the matches
+that were still running; the server restarts them with both seats waiting for
+their players to resume.
+
+Run `python journal.py` for per-move journaling cost and recovery time for
+10k in-flight matches.
+"""
+
+import base64
+import os
+import struct
+import threading
+import zlib
+
+from battleship import Board, TwoPlayerGame, SHIPS
+from logs import log
+
+# Record kinds
+NEW = 1
+SEAT = 2
+PLACE = 3
+FIRE = 4
+END = 5
+
+# game_id, kind, player, row, col, a, b, (pad), payload, crc
+RECORD = struct.Struct('<IBBBBBB2x16sI')
+_CRC_SPAN = RECORD.size - 4
+
+SEGMENT_BYTES = 64 * 1024 * 1024
+
+_fsync = getattr(os, 'fdatasync', os.fsync)
+
+
+def _token_bytes(token):
+    """sessions tokens are token_urlsafe(16): 16 random bytes, base64 without padding."""
+    return base64.urlsafe_b64decode(token + '==')
+
+
+def _token_str(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+class Journal:
+    """
+    Journal in `directory`. Call recover() (optional) and then start() before
+    appending; close() flushes what is left.
+    """
+
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, sync=True):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.sync = sync
+        os.makedirs(directory, exist_ok=True)
+        self._segments = sorted(int(name.split('.')[0]) for name in os.listdir(directory)
+                                if name.endswith('.journal'))
+        self._segment = self._segments[-1] if self._segments else 0
+        self._fd = None
+        self._size = 0
+        self._next_id = 1
+        self._live = {}  # game_id -> oldest segment holding one of its records
+
+        self._lock = threading.Lock()
+        self._work = threading.Condition(self._lock)
+        self._done = threading.Condition(self._lock)
+        self._pending = bytearray()
+        self._appended = 0  # records handed to append()
+        self._durable = 0  # records written (and synced, if self.sync)
+        self._closing = False
+        self._thread = None
+        self.flushes = 0
+
+    def _path(self, segment):
+        return os.path.join(self.directory, f"{segment:08d}.journal")
+
+    def start(self):
+        # Always a fresh segment: the last one may end in a torn record
+        self._open_segment(self._segment + 1)
+        self._thread = threading.Thread(target=self._run, name="journal", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        with self._lock:
+            self._closing = True
+            self._work.notify()
+        if self._thread is not None:
+            self._thread.join()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def append(self, game_id, kind, player=0, row=0, col=0, a=0, b=0, payload=b'', wait=True):
+        record = bytearray(RECORD.pack(game_id, kind, player, row, col, a, b, payload, 0))
+        struct.pack_into('<I', record, _CRC_SPAN, zlib.crc32(memoryview(record)[:_CRC_SPAN]))
+        with self._lock:
+            self._pending += record
+            self._appended += 1
+            seq = self._appended
+            self._work.notify()
+            if wait:
+                while self._durable < seq:
+                    self._done.wait()
+
+    def new_game(self, tokens):
+        """Journal a new match between the seats with these tokens; returns its game_id."""
+        with self._lock:
+            game_id = self._next_id
+            self._next_id += 1
+            self._live[game_id] = self._segment
+        for player, token in enumerate(tokens):
+            self.append(game_id, SEAT, player, payload=_token_bytes(token), wait=False)
+        self.append(game_id, NEW)
+        return game_id
+
+    def place(self, game_id, player, ship_index, row, col, orientation, wait=True):
+        # A whole fleet waits only on its last ship: records become durable in order
+        self.append(game_id, PLACE, player, row, col, ship_index, orientation, wait=wait)
+
+    def fire(self, game_id, player, row, col):
+        self.append(game_id, FIRE, player, row, col)
+
+    def end_game(self, game_id):
+        # Not waited for: losing it in a crash only brings back a finished match
+        with self._lock:
+            self._live.pop(game_id, None)
+        self.append(game_id, END, wait=False)
+
+    def _open_segment(self, segment):
+        self._fd = os.open(self._path(segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._segment = segment
+        self._segments.append(segment)
+        self._size = 0
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._pending and not self._closing:
+                    self._work.wait()
+                if not self._pending:
+                    return
+                batch, self._pending = self._pending, bytearray()
+                upto = self._appended
+            view = memoryview(batch)
+            while view:
+                view = view[os.write(self._fd, view):]
+            if self.sync:
+                _fsync(self._fd)
+            self._size += len(batch)
+            if self._size >= self.segment_bytes:
+                # Before waking anyone: a match started after append() returns
+                # must be filed under the segment its records go to
+                self._roll()
+            with self._lock:
+                self._durable = upto
+                self.flushes += 1
+                self._done.notify_all()
+
+    def _roll(self):
+        os.close(self._fd)
+        self._open_segment(self._segment + 1)
+        with self._lock:
+            oldest = min(self._live.values(), default=self._segment)
+        while self._segments[0] < oldest:
+            os.remove(self._path(self._segments.pop(0)))
+
+    def recover(self, ships=SHIPS, board_cls=None, size=None):
+        """
+        Replay every segment. Returns {game_id: (TwoPlayerGame, [token1, token2])}
+        for the matches that had not ended, with game.game_id set. Replay stops
+        at the first record that fails its CRC in each segment (a torn tail).
+        """
+        games = {}
+        for segment in self._segments:
+            with open(self._path(segment), 'rb') as f:
+                data = f.read()
+            view = memoryview(data)[:len(data) - len(data) % RECORD.size]
+            for index, (game_id, kind, player, row, col, a, b, payload, crc) in enumerate(RECORD.iter_unpack(view)):
+                offset = index * RECORD.size
+                if zlib.crc32(view[offset:offset + _CRC_SPAN]) != crc:
+                    log.warning("Journal segment %d: bad record at offset %d; ignoring the rest", segment, offset)
+                    break
+                if kind == SEAT:
+                    entry = games.get(game_id)
+                    if entry is None:
+                        entry = games[game_id] = (TwoPlayerGame(board_cls, size), [None, None])
+                        self._live[game_id] = segment
+                        self._next_id = max(self._next_id, game_id + 1)
+                    entry[1][player] = _token_str(payload)
+                elif kind == NEW:
+                    self._next_id = max(self._next_id, game_id + 1)
+                    if game_id not in games:
+                        games[game_id] = (TwoPlayerGame(board_cls, size), [None, None])
+                        self._live[game_id] = segment
+                elif kind == PLACE:
+                    entry = games.get(game_id)
+                    if entry is None:
+                        # Its NEW/SEAT records are gone (a removed segment, or a torn tail before them)
+                        log.warning("Journal segment %d: PLACE record for unknown game %d; skipped", segment, game_id)
+                        continue
+                    game = entry[0]
+                    board = game.player_boards[player]
+                    ship_name, ship_size = ships[a]
+                    board.add_ship(ship_name, row, col, ship_size, b)
+                    if len(board.placed_ships) == len(ships):
+                        game.ships_placed[player] = True
+                elif kind == FIRE:
+                    entry = games.get(game_id)
+                    if entry is None:
+                        # Its NEW/SEAT records are gone (a removed segment, or a torn tail before them)
+                        log.warning("Journal segment %d: FIRE record for unknown game %d; skipped", segment, game_id)
+                        continue
+                    game = entry[0]
+                    game.current_turn = player
+                    _replay_shot(game, row, col)
+                elif kind == END:
+                    games.pop(game_id, None)
+                    self._live.pop(game_id, None)
+
+        recovered = {}
+        for game_id, (game, tokens) in games.items():
+            if game.active and None not in tokens:
+                game.game_id = game_id
+                recovered[game_id] = (game, tokens)
+            else:
+                self._live.pop(game_id, None)  # finished, but its END was lost
+        return recovered
+
+
+def _replay_shot(game, row, col):
+    """TwoPlayerGame.fire for an already-parsed, already-validated shot, without the messages."""
+    opponent_board = game.player_boards[game.get_opponent_index()]
+    _, sunk = opponent_board.fire_at(row, col)
+    if sunk and opponent_board.all_ships_sunk():
+        game.active = False
+    else:
+        game.current_turn = game.get_opponent_index()
+
+
+def _benchmark(games=10_000):
+    import random
+    import shutil
+    import tempfile
+    import time
+    from placement import random_fleet
+
+    directory = tempfile.mkdtemp(prefix="journal-bench-")
+    try:
+        # Per-move cost: one game alone (every move pays a whole fsync) vs many
+        # games moving at once (group commit shares the fsync)
+        for threads, moves in ((1, 300), (50, 200), (200, 100)):
+            journal = Journal(directory)
+            journal.start()
+            latencies = []
+
+            def play(game_id):
+                for i in range(moves):
+                    start = time.perf_counter()
+                    journal.fire(game_id, i & 1, i % 10, i // 10 % 10)
+                    latencies.append(time.perf_counter() - start)
+
+            workers = [threading.Thread(target=play, args=(journal.new_game([]),)) for _ in range(threads)]
+            start = time.perf_counter()
+            for t in workers:
+                t.start()
+            for t in workers:
+                t.join()
+            elapsed = time.perf_counter() - start
+            journal.close()
+            latencies.sort()
+            total = threads * moves
+            print(f"{threads:4} games moving: {total / elapsed:9,.0f} moves/s  "
+                  f"p50 {latencies[len(latencies) // 2] * 1e3:6.2f} ms  "
+                  f"p99 {latencies[len(latencies) * 99 // 100] * 1e3:6.2f} ms  "
+                  f"{total / journal.flushes:6.1f} moves per fsync")
+
+        journal = Journal(directory, sync=False)
+        journal.start()
+        start = time.perf_counter()
+        for i in range(100_000):
+            journal.append(1, FIRE, i & 1, 0, 0, wait=False)
+        print(f"append cost without waiting: {(time.perf_counter() - start) / 100_000 * 1e6:.2f} us/move")
+        journal.close()
+        shutil.rmtree(directory)
+
+        # Recovery: `games` matches in flight, each fully placed and partway through
+        rng = random.Random(5)
+        journal = Journal(directory, sync=False)
+        journal.start()
+        token = base64.urlsafe_b64encode(bytes(16)).rstrip(b'=').decode()
+        for _ in range(games):
+            game_id = journal.new_game([token, token])
+            boards = []
+            for player in (0, 1):
+                board = Board(10)
+                for index, ((name, size), (row, col, orientation)) in enumerate(zip(SHIPS, random_fleet(10, SHIPS, rng))):
+                    board.add_ship(name, row, col, size, orientation)
+                    journal.append(game_id, PLACE, player, row, col, index, orientation, wait=False)
+                boards.append(board)
+            cells = [[divmod(c, 10) for c in rng.sample(range(100), 100)] for _ in (0, 1)]
+            for shot in range(rng.randrange(20, 80)):
+                player = shot & 1
+                row, col = cells[player][shot // 2]
+                boards[1 - player].fire_at(row, col)
+                if boards[1 - player].all_ships_sunk():
+                    break
+                journal.append(game_id, FIRE, player, row, col, wait=False)
+        journal.close()
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        records = size // RECORD.size
+
+        start = time.perf_counter()
+        recovered = Journal(directory).recover()
+        elapsed = time.perf_counter() - start
+        print(f"recovery: {len(recovered)} of {games} games from {records:,} records "
+              f"({size / 1e6:.1f} MB) in {elapsed:.2f} s ({records / elapsed:,.0f} records/s)")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    _benchmark()
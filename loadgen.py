@@ -0,0 +1,539 @@
+"""
+loadgen.py
+
+Load-generation harness: thousands of scripted bot clients against a local
+server, so every server change can be compared on the same workload.
+
+Each bot is a coroutine that speaks the real client protocols: the text
+prompts ("Place your ...", "Enter starting coordinate", "Your turn!") on PORT,
+or with --binary the framed packets of protocol.py on BINARY_PORT, firing with
+FIRE packets. Fleets and shots are random (--moves random) or the same fixed
+script every game (--moves scripted). Fleets are placed a ship at a time, or
+with --fleet in one FLEET line. Bots stay in the lobby between games and
+hang up after --games games.
+
+Reported:
+  - connections/s over the connect phase
+  - matches/s (completed games) over the whole run
+  - time-to-match p50/p95/p99: "Waiting for another player..." to "Welcome Player"
+  - placement p50/p95/p99: "Welcome Player" to "All ships placed"
+  - shot latency p50/p95/p99: sending a coordinate to receiving its result
+  - the server's own part of it (its battleship_turn_seconds histogram over
+    the run, from the stats port): unlike the shot latency, not inflated when
+    the bots and the server compete for the same CPUs
+  - with --stuck N: how long the server took to cut off N extra clients that
+    send moves but never read (slow-consumer isolation; the shot latencies of
+    the other bots should not change). The bots paired with them wait out the
+    server's RESUME_GRACE and show up as stranded.
+  - with --chatters N: N extra spectator connections, in a process of their
+    own, that each send `CHAT <message>` every --chat-interval seconds and
+    read all the chat; reported is how long a chatter's own message took to
+    come back to it (the shot latencies of the bots should not change).
+
+Usage:
+  python loadgen.py [--clients 2000] [--games 3] [--binary] [--moves random|scripted] [--fleet]
+                    [--procs 1] [--server "--workers 4"] [--stuck 0]
+                    [--chatters 0] [--chat-interval 2.0]
+
+Without --server the bots target a server that is already running; with it the
+harness starts `python server.py <args>` itself and stops it afterwards.
+--procs splits the bots over several processes so they don't become the
+bottleneck. Linux only in practice (thousands of sockets, fork).
+"""
+
+import argparse
+import asyncio
+import random
+import socket
+import subprocess
+import sys
+import time
+
+from battleship import SHIPS, BOARD_SIZE
+from placement import random_fleet
+from protocol import (PacketReader, PacketWriter, PKT_TEXT, PKT_FIRE, PKT_RESULT,
+                      coordinate_str)
+from config import HOST, PORT, BINARY_PORT, SPECTATOR_PORT, STATS_PORT, raise_fd_limit
+
+RESULT_PREFIXES = ("HIT!", "MISS!", "You've already", "Invalid coordinate")
+
+
+class Stats:
+    """Raw samples from one process' bots; merged across processes by the parent."""
+
+    def __init__(self):
+        self.connect_times = []  # seconds per successful connect
+        self.connect_failures = 0
+        self.connect_span = [None, None]  # time.monotonic() of the first connect attempt, last connect
+        self.match_waits = []
+        self.placement_times = []
+        self.shot_latencies = []
+        self.games = 0  # games finished, counted by both players
+        self.last_game_at = None  # time.monotonic() of the last finished game
+        self.disconnects = 0  # bots whose connection dropped before --games games
+        self.stranded = 0  # bots left without an opponent at the end (idle timeout)
+        self.stuck_cutoffs = []  # seconds until the server cut off each --stuck client
+        self.stuck_left = 0  # --stuck clients still connected at the end
+        self.chat_sent = 0
+        self.chat_latencies = []  # seconds from a chatter sending a message to reading it back
+        self.chat_bytes = 0  # received by chatters
+
+    def merge(self, other):
+        self.connect_times += other.connect_times
+        self.connect_failures += other.connect_failures
+        self.connect_span = [min((t for t in (self.connect_span[0], other.connect_span[0]) if t is not None),
+                                 default=None),
+                             max((t for t in (self.connect_span[1], other.connect_span[1]) if t is not None),
+                                 default=None)]
+        self.match_waits += other.match_waits
+        self.placement_times += other.placement_times
+        self.shot_latencies += other.shot_latencies
+        self.games += other.games
+        self.last_game_at = max((t for t in (self.last_game_at, other.last_game_at) if t is not None),
+                                default=None)
+        self.disconnects += other.disconnects
+        self.stranded += other.stranded
+        self.stuck_cutoffs += other.stuck_cutoffs
+        self.stuck_left += other.stuck_left
+        self.chat_sent += other.chat_sent
+        self.chat_latencies += other.chat_latencies
+        self.chat_bytes += other.chat_bytes
+
+
+def percentiles(samples, points=(50, 95, 99)):
+    if not samples:
+        return [0.0 for _ in points]
+    ordered = sorted(samples)
+    return [ordered[min(len(ordered) - 1, len(ordered) * p // 100)] for p in points]
+
+
+class Bot:
+    """
+    One simulated player. Reacts to prompts only, so it copes with any pairing
+    order, the opponent leaving, and repeated games.
+    """
+
+    def __init__(self, stats, games, scripted, rng, fleet=False):
+        self.stats = stats
+        self.games = games
+        self.scripted = scripted
+        self.rng = rng
+        self.fleet = fleet  # place with one FLEET line
+        self.played = 0
+        self.placements = {}
+        self.current_ship = None
+        self.shots = iter(())
+        self.waiting_since = None
+        self.placing_since = None
+        self.shot_sent = None
+
+    def new_game(self):
+        if self.scripted:
+            fleet = [(i, 0, 0) for i in range(len(SHIPS))]
+            cells = [(r, c) for r in range(BOARD_SIZE) for c in range(BOARD_SIZE)]
+        else:
+            fleet = random_fleet(BOARD_SIZE, SHIPS, self.rng)
+            cells = [(r, c) for r in range(BOARD_SIZE) for c in range(BOARD_SIZE)]
+            self.rng.shuffle(cells)
+        self.placements = {name: placement for (name, _), placement in zip(SHIPS, fleet)}
+        self.shots = iter(cells)
+
+    def on_text(self, line):
+        """
+        Handle one server message. Returns a reply: a str to send as a line,
+        a (row, col) to fire at, or None. Returns False once the bot is done.
+        """
+        now = time.perf_counter()
+        if line.startswith("Waiting for another player"):
+            self.waiting_since = now
+        elif line.startswith("Welcome Player"):
+            if self.waiting_since is not None:
+                self.stats.match_waits.append(now - self.waiting_since)
+                self.waiting_since = None
+            self.placing_since = now
+            self.new_game()
+        elif line.startswith("Place your "):
+            self.current_ship = line[len("Place your "):].split(" (")[0]
+        elif line.startswith("Enter starting coordinate"):
+            if self.fleet:
+                return "FLEET " + " ".join(f"{coordinate_str(row, col)} {'HV'[orientation]}"
+                                           for row, col, orientation in self.placements.values())
+            row, col, _ = self.placements[self.current_ship]
+            return coordinate_str(row, col)
+        elif line.startswith("Enter orientation"):
+            return "HV"[self.placements[self.current_ship][2]]
+        elif line.startswith("Your turn!"):
+            self.shot_sent = now
+            return next(self.shots)
+        elif line.startswith("All ships placed"):
+            if self.placing_since is not None:
+                self.stats.placement_times.append(now - self.placing_since)
+                self.placing_since = None
+        elif line.startswith(RESULT_PREFIXES):
+            self.on_result(now)
+        elif line.startswith("Game over."):
+            self.played += 1
+            self.stats.games += 1
+            self.stats.last_game_at = time.monotonic()
+            if self.played >= self.games:
+                return False
+        return None
+
+    def on_result(self, now):
+        if self.shot_sent is not None:
+            self.stats.shot_latencies.append(now - self.shot_sent)
+            self.shot_sent = None
+
+
+async def connect(host, port, stats):
+    if stats.connect_span[0] is None:
+        stats.connect_span[0] = time.monotonic()
+    start = time.perf_counter()
+    try:
+        streams = await asyncio.open_connection(host, port)
+    except OSError:
+        stats.connect_failures += 1
+        return None
+    stats.connect_times.append(time.perf_counter() - start)
+    stats.connect_span[1] = time.monotonic()
+    return streams
+
+
+async def run_text_bot(bot, streams, idle_timeout):
+    reader, writer = streams
+    writer.write(b"HELLO\n")
+    try:
+        while True:
+            line = await asyncio.wait_for(reader.readline(), idle_timeout)
+            if not line:
+                bot.stats.disconnects += 1
+                return
+            reply = bot.on_text(line.decode().rstrip('\n'))
+            if reply is False:
+                return
+            if isinstance(reply, tuple):
+                reply = coordinate_str(*reply)
+            if reply is not None:
+                writer.write((reply + '\n').encode())
+    finally:
+        writer.close()
+
+
+async def run_binary_bot(bot, streams, idle_timeout):
+    reader, writer = streams
+    packets = PacketReader()
+    out = PacketWriter(None)  # only encode() is used; the asyncio writer does the I/O
+    writer.write(bytes(out.encode(PKT_TEXT, b"HELLO")))
+    try:
+        while True:
+            # 4 KiB reads always fit PacketReader's fixed buffer
+            data = await asyncio.wait_for(reader.read(4096), idle_timeout)
+            if not data:
+                bot.stats.disconnects += 1
+                return
+            packets.feed(data)
+            while (packet := packets.next_packet()) is not None:
+                ptype, _, payload = packet
+                if ptype == PKT_RESULT:
+                    bot.on_result(time.perf_counter())
+                    continue
+                if ptype != PKT_TEXT:
+                    continue  # BOARD / DELTA: a bot doesn't look at the boards
+                for line in str(payload, 'utf-8', 'replace').splitlines():
+                    reply = bot.on_text(line)
+                    if reply is False:
+                        return
+                    if isinstance(reply, tuple):
+                        writer.write(bytes(out.encode(PKT_FIRE, bytes(reply))))
+                    elif reply is not None:
+                        writer.write(bytes(out.encode(PKT_TEXT, reply.encode())))
+    finally:
+        writer.close()
+
+
+async def run_stuck_client(host, port, binary, stats):
+    """
+    A client that stops reading: a tiny receive buffer, and moves sent every few
+    ms without ever reading a reply. Records when the server cuts it off (the
+    connection leaves ESTABLISHED, or a send fails).
+    """
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.setblocking(False)
+    start = time.perf_counter()
+    try:
+        await loop.sock_connect(sock, (host, port))
+        move = bytes(PacketWriter(None).encode(PKT_TEXT, b"A1")) if binary else b"A1\n"
+        while sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 1)[0] == _TCP_ESTABLISHED:
+            await loop.sock_sendall(sock, move)
+            await asyncio.sleep(0.005)
+        stats.stuck_cutoffs.append(time.perf_counter() - start)
+    except asyncio.CancelledError:
+        stats.stuck_left += 1
+    except OSError:
+        stats.stuck_cutoffs.append(time.perf_counter() - start)
+    finally:
+        sock.close()
+
+
+_TCP_ESTABLISHED = 1  # tcp_info.tcpi_state
+
+
+async def run_chatter(host, index, interval, stats, rng):
+    """
+    A spectator that chats: a message every `interval` seconds (random phase),
+    stamped so that it can time its own message's way back. Runs until cancelled.
+    """
+    try:
+        reader, writer = await asyncio.open_connection(host, SPECTATOR_PORT)
+    except OSError:
+        stats.connect_failures += 1
+        return
+    marker = f": c{index}@".encode()
+    buf = b''
+
+    async def talk():
+        await asyncio.sleep(rng.random() * interval)
+        while True:
+            writer.write(f"CHAT c{index}@{time.perf_counter():.6f}\n".encode())
+            stats.chat_sent += 1
+            await asyncio.sleep(interval)
+
+    talker = asyncio.ensure_future(talk())
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            now = time.perf_counter()
+            stats.chat_bytes += len(data)
+            # Only this chatter's own lines are timed: a find() per read, not a parse per line
+            buf += data
+            at = buf.find(marker)
+            while at >= 0:
+                end = buf.find(b'\n', at)
+                if end < 0:
+                    break
+                stats.chat_latencies.append(now - float(buf[at + len(marker):end]))
+                at = buf.find(marker, end)
+            buf = buf[at:] if at >= 0 else buf[-len(marker):]  # a line or marker cut off by the read
+    except asyncio.CancelledError:
+        pass
+    finally:
+        talker.cancel()
+        writer.close()
+
+
+async def run_bots(n, args, seed):
+    """Connect n bots (at most --connect-concurrency at a time), then let them play."""
+    stats = Stats()
+    rng = random.Random(seed)
+    port = BINARY_PORT if args.binary else PORT
+    run_bot = run_binary_bot if args.binary else run_text_bot
+    gate = asyncio.Semaphore(args.connect_concurrency)
+
+    async def one_bot():
+        async with gate:
+            streams = await connect(args.host, port, stats)
+        if streams is None:
+            return
+        bot = Bot(stats, args.games, args.moves == "scripted", random.Random(rng.random()), args.fleet)
+        try:
+            await run_bot(bot, streams, args.idle_timeout)
+        except asyncio.TimeoutError:
+            stats.stranded += 1
+        except (ConnectionError, OSError):
+            stats.disconnects += 1
+
+    stuck = [asyncio.ensure_future(run_stuck_client(args.host, port, args.binary, stats))
+             for _ in range(args.stuck)]
+    await asyncio.gather(*(one_bot() for _ in range(n)))
+    for task in stuck:
+        task.cancel()
+    await asyncio.gather(*stuck)
+    return stats
+
+
+async def run_chatters(args, done):
+    """--chatters, until done (a multiprocessing Event) is set."""
+    stats = Stats()
+    rng = random.Random(args.seed)
+    chatters = [asyncio.ensure_future(run_chatter(args.host, i, args.chat_interval, stats, random.Random(rng.random())))
+                for i in range(args.chatters)]
+    while not done.is_set():
+        await asyncio.sleep(0.1)
+    for task in chatters:
+        task.cancel()
+    await asyncio.gather(*chatters)
+    return stats
+
+
+def _bot_process(n, args, seed, results):
+    raise_fd_limit()
+    results.put(asyncio.run(run_bots(n, args, seed)))
+
+
+def _chat_process(args, done, results):
+    raise_fd_limit()
+    results.put(asyncio.run(run_chatters(args, done)))
+
+
+def run_load(args):
+    """
+    Run the whole workload. Returns (merged Stats, seconds from start to the
+    last finished game), so stranded bots idling out don't dilute matches/s.
+    """
+    import multiprocessing
+    ctx = multiprocessing.get_context('fork')
+    chat = None
+    if args.chatters:
+        # Their own process: reading everyone's chat would otherwise hold up the bots' event loop
+        done, chat_results = ctx.Event(), ctx.Queue()
+        chat = ctx.Process(target=_chat_process, args=(args, done, chat_results))
+        chat.start()
+        time.sleep(1.0)  # connected before the bots start
+
+    start = time.monotonic()
+    if args.procs <= 1:
+        stats = asyncio.run(run_bots(args.clients, args, args.seed))
+    else:
+        stats = _run_bot_processes(ctx, args)
+    if chat is not None:
+        done.set()
+        stats.merge(chat_results.get())
+        chat.join()
+    return stats, (stats.last_game_at or time.monotonic()) - start
+
+
+def _run_bot_processes(ctx, args):
+    results = ctx.Queue()
+    share, extra = divmod(args.clients, args.procs)
+    procs = [ctx.Process(target=_bot_process,
+                         args=(share + (i < extra), args, args.seed + i, results))
+             for i in range(args.procs)]
+    for proc in procs:
+        proc.start()
+    stats = Stats()
+    for _ in procs:
+        stats.merge(results.get())
+    for proc in procs:
+        proc.join()
+    return stats
+
+
+def scrape_turn_times(host):
+    """
+    The server's battleship_turn_seconds as (count, sum, [(le, cumulative count)]),
+    or None if it has no stats port (with --workers each worker has its own).
+    """
+    try:
+        with socket.create_connection((host, STATS_PORT), timeout=2.0) as sock:
+            sock.sendall(b"GET /metrics HTTP/1.0\r\n\r\n")
+            data = b''
+            while chunk := sock.recv(65536):
+                data += chunk
+    except OSError:
+        return None
+    count, total, buckets = 0, 0.0, []
+    for line in data.decode(errors='replace').splitlines():
+        name, _, value = line.rpartition(' ')
+        if name.startswith('battleship_turn_seconds_bucket{le="'):
+            buckets.append((float(name.split('"')[1]), int(value)))
+        elif name == 'battleship_turn_seconds_count':
+            count = int(value)
+        elif name == 'battleship_turn_seconds_sum':
+            total = float(value)
+    return (count, total, buckets) if buckets else None
+
+
+def report(args, stats, elapsed, turns=None):
+    mode = f"{'binary' if args.binary else 'text'}/{args.moves}{'/fleet' if args.fleet else ''}"
+    first, last = stats.connect_span
+    connect_span = last - first if last is not None else 0.0
+    matches = stats.games // 2
+    wait50, wait95, wait99 = (w * 1e3 for w in percentiles(stats.match_waits))
+    place50, place95, place99 = (p * 1e3 for p in percentiles(stats.placement_times))
+    shot50, shot95, shot99 = (s * 1e3 for s in percentiles(stats.shot_latencies))
+    print(f"clients={args.clients} games/bot={args.games} mode={mode} procs={args.procs} "
+          f"elapsed={elapsed:.2f}s")
+    print(f"  connections: {len(stats.connect_times)} ok, {stats.connect_failures} failed, "
+          f"{len(stats.connect_times) / connect_span if connect_span else 0.0:.0f} conn/s")
+    print(f"  matches:     {matches} completed, {matches / elapsed:.1f} matches/s, "
+          f"{stats.disconnects} early disconnects, {stats.stranded} stranded")
+    print(f"  time-to-match ms: p50 {wait50:.2f}  p95 {wait95:.2f}  p99 {wait99:.2f}  "
+          f"(n={len(stats.match_waits)})")
+    print(f"  placement     ms: p50 {place50:.2f}  p95 {place95:.2f}  p99 {place99:.2f}  "
+          f"(n={len(stats.placement_times)})")
+    print(f"  shot latency  ms: p50 {shot50:.3f}  p95 {shot95:.3f}  p99 {shot99:.3f}  "
+          f"(n={len(stats.shot_latencies)})")
+    if turns is not None and turns[0]:
+        count, total, buckets = turns
+        bounds = [next(le for le, n in buckets if n >= count * q / 100) * 1e6 for q in (50, 99)]
+        print(f"  server turn   us: mean {total / count * 1e6:.0f}  p50 <= {bounds[0]:g}  p99 <= {bounds[1]:g}  "
+              f"(n={count}, battleship_turn_seconds)")
+    if args.stuck:
+        cut50, cut_max = percentiles(stats.stuck_cutoffs, (50, 100))
+        print(f"  stuck clients: {len(stats.stuck_cutoffs)} cut off (p50 {cut50:.1f}s, max {cut_max:.1f}s), "
+              f"{stats.stuck_left} still connected at the end")
+    if args.chatters:
+        chat50, chat95, chat99 = (c * 1e3 for c in percentiles(stats.chat_latencies))
+        print(f"  chat:        {stats.chat_sent} messages sent by {args.chatters} chatters, "
+              f"{stats.chat_bytes / 1e6:.1f} MB received (chat and game streams)")
+        print(f"  chat latency ms: p50 {chat50:.1f}  p95 {chat95:.1f}  p99 {chat99:.1f}  "
+              f"(n={len(stats.chat_latencies)}, own messages that came back)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scripted bot load generator for the Battleship server")
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--games", type=int, default=3, help="games each bot plays before hanging up")
+    parser.add_argument("--binary", action="store_true", help="use the framed binary protocol")
+    parser.add_argument("--moves", choices=["random", "scripted"], default="random")
+    parser.add_argument("--fleet", action="store_true",
+                        help="place each fleet with one FLEET line instead of a prompt per ship")
+    parser.add_argument("--procs", type=int, default=1, help="bot processes")
+    parser.add_argument("--connect-concurrency", type=int, default=256)
+    parser.add_argument("--idle-timeout", type=float, default=10.0,
+                        help="seconds a bot waits for the server before giving up")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--stuck", type=int, default=0,
+                        help="extra clients (per process) that send moves but never read")
+    parser.add_argument("--chatters", type=int, default=0,
+                        help="extra spectator connections that chat")
+    parser.add_argument("--chat-interval", type=float, default=2.0,
+                        help="seconds between one chatter's messages")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--server", metavar="ARGS",
+                        help='start `server.py ARGS` for the run, e.g. --server "--workers 4"')
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    server = None
+    if args.server is not None:
+        from bench_server import wait_for_port
+        server = subprocess.Popen([sys.executable, "server.py"] + args.server.split(),
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if not wait_for_port(args.host, BINARY_PORT if args.binary else PORT):
+            print("[ERROR] server did not start")
+            server.terminate()
+            return
+        time.sleep(0.2)
+    try:
+        before = scrape_turn_times(args.host)
+        stats, elapsed = run_load(args)
+        after = scrape_turn_times(args.host)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    turns = None
+    if before is not None and after is not None:
+        # This run's share of the histogram; the server may have been running before
+        turns = (after[0] - before[0], after[1] - before[1],
+                 [(le, n - m) for (le, n), (_, m) in zip(after[2], before[2])])
+    report(args, stats, elapsed, turns)
+
+
+if __name__ == "__main__":
+    main()
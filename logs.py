@@ -0,0 +1,84 @@
+"""
+logs.py
+
+Leveled logging for the server, replacing its print() calls.
+
+  - Records go through a queue (logging.handlers.QueueHandler) to one
+    listener thread that does the writing, so a game thread never blocks on
+    the terminal or a slow pipe.
+  - Each call site may log at most `rate` records per second (burst `burst`);
+    the rest are counted, and the next record from that site that gets through
+    says how many were suppressed.
+  - `--log-level off` disables logging altogether: a log call is then just a
+    level check, and its message is never formatted. Pass arguments %-style
+    (log.info("joined: %s", addr)) so that holds.
+
+Output looks like the old prints: "[INFO] message".
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+log = logging.getLogger("battleship")
+log.propagate = False
+
+LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+    'off': logging.CRITICAL + 1,
+}
+
+
+class RateLimit(logging.Filter):
+    """Token bucket per call site (file and line)."""
+
+    def __init__(self, rate=20.0, burst=50):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._sites = {}  # (pathname, lineno) -> [tokens, last refill, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None:
+                site = self._sites[key] = [self.burst, now, 0]
+            site[0] = min(self.burst, site[0] + (now - site[1]) * self.rate)
+            site[1] = now
+            if site[0] < 1:
+                site[2] += 1
+                return False
+            site[0] -= 1
+            suppressed, site[2] = site[2], 0
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+
+def setup(level='info', rate=20.0, burst=50, stream=None):
+    """Configure the "battleship" logger; returns it. Only the first call in a process counts."""
+    if log.handlers:
+        return log
+    log.setLevel(LEVELS[level])
+    if level == 'off':
+        return log
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
+    records = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(RateLimit(rate, burst))
+    log.addHandler(handler)
+    listener = logging.handlers.QueueListener(records, output)
+    listener.start()
+    atexit.register(listener.stop)  # write out what is still queued
+    return log
@@ -0,0 +1,310 @@
+"""
+matchmaking.py
+
+Event-driven matchmaking for the lobby, shared by the threaded server (server.py)
+and the asyncio engine (async_server.py).
+
+ - Matchmaker: FIFO queue of Tickets. join() pairs a player with the oldest waiter
+   the moment two are available; leave() removes a waiter in O(1).
+ - Ticket / AsyncTicket: one per lobby visit. The player that completes a pair
+   becomes the host and runs the match; the waiting player is woken only when
+   that match finishes (or when it is evicted for disconnecting).
+ - LobbyWatcher: a single selector thread that notices queued players hanging up,
+   so the threaded server needs no per-client polling loop. It also reads the
+   sockets of players in a match (follow()), so their chat isn't held up until
+   the game next wants a line from them.
+"""
+
+import asyncio
+import selectors
+import socket
+import threading
+import time
+from collections import OrderedDict, deque
+
+from logs import log
+
+
+class Ticket:
+    """
+    A player's place in the matchmaking queue.
+      - player: whatever the server uses to reach the client, e.g. a protocol.TextConnection
+      - opponent: the other Ticket once matched
+      - is_host: True for the player that completed the pair (it runs the match)
+      - disconnected: True if the player was evicted from the queue
+      - handed_off: True if the player's socket was moved to another worker
+        process (workers.py); the waiting thread must release it without closing it
+    """
+
+    def __init__(self, player):
+        self.player = player
+        self.joined_at = time.perf_counter()
+        self.matched_at = None
+        self.opponent = None
+        self.is_host = False
+        self.disconnected = False
+        self.handed_off = False
+        self._finished = threading.Event()
+
+    @property
+    def time_to_match(self):
+        if self.matched_at is None:
+            return None
+        return self.matched_at - self.joined_at
+
+    def finish(self, disconnected=False):
+        """Wake the waiting player: its match is over, or it was evicted."""
+        self.disconnected = self.disconnected or disconnected
+        self._finished.set()
+
+    def wait_finished(self, timeout=None):
+        return self._finished.wait(timeout)
+
+
+class AsyncTicket(Ticket):
+    """
+    Ticket for the asyncio engine; waiting is done on a future instead of an Event.
+    Must be created from inside the running event loop.
+    """
+
+    def __init__(self, player):
+        super().__init__(player)
+        self.finished = asyncio.get_running_loop().create_future()
+        self.lobby_read = None  # the waiter's pending readline(), cancelled by the host
+
+    def finish(self, disconnected=False):
+        self.disconnected = self.disconnected or disconnected
+        if not self.finished.done():
+            self.finished.set_result(None)
+
+    async def wait_finished(self):
+        await self.finished
+        return True
+
+
+class Matchmaker:
+    """
+    FIFO matchmaking queue. Waiting tickets live in an OrderedDict so the oldest
+    waiter is popped in O(1) and any waiter can be removed in O(1).
+    """
+
+    def __init__(self, ticket_cls=Ticket):
+        self.ticket_cls = ticket_cls
+        self._lock = threading.Lock()
+        self._queue = OrderedDict()
+        self.matches = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def join(self, player):
+        """
+        Enter the queue. If someone is already waiting, the returned ticket is
+        matched straight away (is_host=True, opponent set); otherwise the caller
+        should wait on it.
+        """
+        ticket = self.ticket_cls(player)
+        with self._lock:
+            if self._queue:
+                opponent, _ = self._queue.popitem(last=False)
+                self._pair(opponent, ticket)
+            else:
+                self._queue[ticket] = None
+        return ticket
+
+    def leave(self, ticket):
+        """
+        Remove a waiting ticket and wake its owner with disconnected=True.
+        Returns False if the ticket had already been matched.
+        """
+        with self._lock:
+            if ticket not in self._queue:
+                return False
+            del self._queue[ticket]
+        ticket.finish(disconnected=True)
+        return True
+
+    def evict_if(self, ticket, is_gone):
+        """
+        Call is_gone() under the queue lock (so the ticket cannot be matched
+        concurrently) and evict the ticket if it returns True.
+        Returns True while the ticket is still waiting afterwards.
+        """
+        with self._lock:
+            if ticket not in self._queue:
+                return False
+            if not is_gone():
+                return True
+            del self._queue[ticket]
+        ticket.finish(disconnected=True)
+        return False
+
+    def withdraw(self, ticket):
+        """
+        Take a waiting ticket out of the queue without waking anyone; the caller
+        keeps the player (e.g. to give it a house-bot match). Returns False if
+        the ticket had already been matched or evicted.
+        """
+        with self._lock:
+            if ticket not in self._queue:
+                return False
+            del self._queue[ticket]
+        return True
+
+    def is_waiting(self, ticket):
+        with self._lock:
+            return ticket in self._queue
+
+    def depth(self):
+        return len(self._queue)
+
+    def _pair(self, waiter, host):
+        now = time.perf_counter()
+        for ticket in (waiter, host):
+            ticket.matched_at = now
+            wait = ticket.time_to_match
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+        waiter.opponent, host.opponent = host, waiter
+        host.is_host = True
+        self.matches += 1
+
+    def stats(self):
+        """Queue depth, matches made and time-to-match (seconds) across all matched players."""
+        with self._lock:
+            matched_players = self.matches * 2
+            return {
+                'waiting': len(self._queue),
+                'matches': self.matches,
+                'avg_time_to_match': self._wait_total / matched_players if matched_players else 0.0,
+                'max_time_to_match': self._wait_max,
+            }
+
+
+class LobbyWatcher:
+    """
+    Watches the sockets of queued players on one selector thread. When a queued
+    player hangs up, its ticket is evicted from the Matchmaker and its lobby
+    thread is woken. Anything a queued player sends goes to on_input(ticket,
+    data) if set (the server picks chat out of it), and is otherwise discarded.
+
+    The same thread reads the sockets of seated players in a match (follow()):
+    what they send is passed on as it arrives (sessions.Seat queues game input
+    for the turn loop and hands chat to the room straight away).
+    """
+
+    def __init__(self, matchmaker, on_input=None):
+        self.matchmaker = matchmaker
+        self.on_input = on_input
+        self._selector = selectors.DefaultSelector()
+        self._pending = deque()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+
+    def start(self):
+        threading.Thread(target=self._run, name="lobby-watcher", daemon=True).start()
+
+    def watch(self, conn, ticket):
+        """Start watching conn on behalf of a queued ticket (safe from any thread)."""
+        self._post(conn, 'watch', ticket)
+
+    def follow(self, conn, on_data):
+        """
+        Read conn for a player in a match (safe from any thread): on_data(data)
+        is called on the watcher thread with whatever arrives, and with b'' once
+        conn is closed, after which it is no longer watched. Replaces an earlier
+        watch() or follow() of conn.
+        """
+        self._post(conn, 'follow', on_data)
+
+    def forget(self, conn, then):
+        """
+        Stop watching conn, then call then() on the watcher thread. Used before
+        closing a socket that another process still holds open, since epoll
+        would otherwise keep reporting it after our descriptor is gone.
+        """
+        self._post(conn, 'forget', then)
+
+    def _post(self, conn, op, target):
+        self._pending.append((conn, op, target))
+        try:
+            self._wake_w.send(b'\0')
+        except BlockingIOError:
+            pass  # a wake-up is already pending
+
+    def _apply_pending(self):
+        while self._pending:
+            conn, op, target = self._pending.popleft()
+            if op == 'watch' and not self.matchmaker.is_waiting(target):
+                # Matched (or gone) before we got to it: the match may be reading conn already
+                continue
+            try:
+                self._selector.unregister(conn)
+            except (KeyError, ValueError):
+                pass
+            if op == 'forget':
+                target()  # conn is no longer ours
+                continue
+            try:
+                self._selector.register(conn, selectors.EVENT_READ, (op, target))
+            except (ValueError, OSError):
+                # Socket closed before we got to it
+                if op == 'watch':
+                    self.matchmaker.leave(target)
+                else:
+                    self._deliver(target, b'')
+
+    def _run(self):
+        while True:
+            self._apply_pending()
+            for key, _ in self._selector.select():
+                if key.data is None:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+
+                conn, (op, ticket) = key.fileobj, key.data
+                if op == 'follow':
+                    self._read(conn, ticket)
+                    continue
+                if not self.matchmaker.evict_if(ticket, lambda: self._hung_up(conn, ticket)):
+                    # Matched or evicted: the lobby no longer owns this socket
+                    try:
+                        self._selector.unregister(conn)
+                    except (KeyError, ValueError):
+                        pass
+
+    def _hung_up(self, conn, ticket):
+        try:
+            data = conn.recv(4096, socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            return False
+        except OSError:
+            return True
+        if data and self.on_input is not None:
+            self._deliver(lambda data: self.on_input(ticket, data), data)
+        return not data
+
+    def _read(self, conn, on_data):
+        try:
+            data = conn.recv(4096, socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            try:
+                self._selector.unregister(conn)
+            except (KeyError, ValueError):
+                pass
+        self._deliver(on_data, data)
+
+    def _deliver(self, on_data, data):
+        try:
+            on_data(data)
+        except Exception as e:
+            log.error("Reading a player's input failed: %s", e)
@@ -0,0 +1,307 @@
+"""
+metrics.py
+
+Server instrumentation: counters, gauges and latency histograms, exposed in
+the Prometheus text format on a local stats port (StatsServer).
+
+Updates are cheap enough for the hot path (a shot, a packet):
+  - No lock. Every thread updates its own cell of a metric (a threading.local
+    list); only that thread ever writes it, so nothing is lost between
+    threads. Reading sums the cells, under a lock, at scrape time.
+  - Cells of finished threads (one per connection in the threaded server)
+    are folded into a retired total when the thread's locals are freed, so
+    memory doesn't grow with the number of connections ever served.
+Histograms are log-linear like HdrHistogram: 8 sub-buckets per power of two
+of microseconds, so any quantile is within 12.5% from 1 us to hours, in at
+most 256 buckets per thread.
+
+Metrics are created with counter() / gauge() / histogram() on the module's
+REGISTRY and are plain module globals in the code that updates them.
+
+Run `python metrics.py` for the cost of an update vs a locked counter.
+"""
+
+import socket
+import threading
+import weakref
+
+_SUB_BITS = 3
+_SUB = 1 << _SUB_BITS
+BUCKETS = 256
+
+
+def bucket_index(us):
+    """Histogram bucket of an integer number of microseconds."""
+    if us < 2 * _SUB:
+        return us if us >= 0 else 0
+    shift = us.bit_length() - _SUB_BITS - 1
+    return min(shift * _SUB + (us >> shift), BUCKETS - 1)
+
+
+def bucket_floor(index):
+    """Smallest value (us) that falls in bucket index."""
+    if index < 2 * _SUB:
+        return index
+    shift = index // _SUB - 1
+    return (index % _SUB + _SUB) << shift
+
+
+class _Holder:
+    __slots__ = ('cell', '__weakref__')
+
+
+class _Cells:
+    """Per-thread cells of `width` numbers, summed by totals()."""
+
+    def __init__(self, width):
+        self.width = width
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._live = {}
+        self._retired = [0] * width
+
+    def cell(self):
+        try:
+            return self._local.holder.cell
+        except AttributeError:
+            holder = _Holder()
+            holder.cell = cell = [0] * self.width
+            with self._lock:
+                self._live[id(cell)] = cell
+            weakref.finalize(holder, self._retire, cell)
+            self._local.holder = holder
+            return cell
+
+    def _retire(self, cell):
+        with self._lock:
+            del self._live[id(cell)]
+            retired = self._retired
+            for i, value in enumerate(cell):
+                retired[i] += value
+
+    def totals(self):
+        with self._lock:
+            totals = list(self._retired)
+            for cell in self._live.values():
+                for i, value in enumerate(cell):
+                    totals[i] += value
+        return totals
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._cells = _Cells(1)
+        self._local = self._cells._local
+
+    def inc(self, n=1):
+        try:
+            self._local.holder.cell[0] += n
+        except AttributeError:
+            self._cells.cell()[0] += n
+
+    @property
+    def value(self):
+        return self._cells.totals()[0]
+
+    def expose(self):
+        return [f"{self.name} {self.value}"]
+
+
+class Gauge(Counter):
+    """Goes up (inc) and down (dec); or, with `read`, is computed at scrape time."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, read=None):
+        super().__init__(name, help)
+        self.read = read
+
+    def dec(self, n=1):
+        self.inc(-n)
+
+    @property
+    def value(self):
+        return self.read() if self.read is not None else self._cells.totals()[0]
+
+
+class Histogram:
+    """Latencies in seconds. Exposed with buckets at powers of four microseconds."""
+    kind = 'histogram'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._cells = _Cells(BUCKETS + 1)  # bucket counts, then the sum in us
+        self._local = self._cells._local
+
+    def observe(self, seconds):
+        us = int(seconds * 1e6)
+        try:
+            cell = self._local.holder.cell
+        except AttributeError:
+            cell = self._cells.cell()
+        # bucket_index(), inlined
+        if us < 2 * _SUB:
+            index = us if us >= 0 else 0
+        else:
+            shift = us.bit_length() - _SUB_BITS - 1
+            index = shift * _SUB + (us >> shift)
+            if index >= BUCKETS:
+                index = BUCKETS - 1
+        cell[index] += 1
+        cell[BUCKETS] += us
+
+    def snapshot(self):
+        """(bucket counts, sum in seconds)."""
+        totals = self._cells.totals()
+        return totals[:BUCKETS], totals[BUCKETS] / 1e6
+
+    def quantile(self, q, counts=None):
+        """Approximate q-quantile in seconds (lower edge of its bucket); 0.0 if empty."""
+        counts = counts if counts is not None else self.snapshot()[0]
+        rank = q * sum(counts)
+        seen = 0
+        for index, n in enumerate(counts):
+            seen += n
+            if n and seen >= rank:
+                return bucket_floor(index) / 1e6
+        return 0.0
+
+    def expose(self):
+        counts, total = self.snapshot()
+        lines = []
+        cumulative = 0
+        index = 0
+        for k in range(17):  # 1 us .. ~72 min
+            edge = 4 ** k
+            while index < BUCKETS and bucket_floor(index) < edge:
+                cumulative += counts[index]
+                index += 1
+            lines.append(f'{self.name}_bucket{{le="{edge / 1e6:g}"}} {cumulative}')
+        count = sum(counts)
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {count}')
+        lines.append(f"{self.name}_sum {total:.6f}")
+        lines.append(f"{self.name}_count {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, metric):
+        """
+        Register metric; if one of that name exists already, return that one
+        instead (server.py is imported twice when run as a script: as __main__
+        and as `server`).
+        """
+        return self.metrics.setdefault(metric.name, metric)
+
+    def expose(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help):
+    return REGISTRY.add(Counter(name, help))
+
+
+def gauge(name, help, read=None):
+    return REGISTRY.add(Gauge(name, help, read))
+
+
+def histogram(name, help):
+    return REGISTRY.add(Histogram(name, help))
+
+
+class StatsServer:
+    """
+    Serves REGISTRY.expose() on a local TCP port: to an HTTP GET (a Prometheus
+    scrape, curl) as an HTTP response, to anything else (nc) as plain text.
+    """
+
+    def __init__(self, host, port, registry=REGISTRY):
+        self.host = host
+        self.port = port
+        self.registry = registry
+
+    def start(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((self.host, self.port))
+        listener.listen(16)
+        threading.Thread(target=self._serve, args=(listener,), name="stats", daemon=True).start()
+
+    def _serve(self, listener):
+        while True:
+            conn, _ = listener.accept()
+            with conn:
+                try:
+                    conn.settimeout(0.2)
+                    try:
+                        request = conn.recv(4096)
+                    except socket.timeout:
+                        request = b''
+                    body = self.registry.expose().encode()
+                    if request.startswith(b'GET'):
+                        conn.sendall(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                                     b"Content-Length: %d\r\n\r\n" % len(body))
+                    conn.sendall(body)
+                except OSError:
+                    pass
+
+
+def _benchmark(n=1_000_000):
+    import time
+
+    c = Counter("bench", "")
+    start = time.perf_counter()
+    for _ in range(n):
+        c.inc()
+    per_inc = (time.perf_counter() - start) / n
+
+    lock = threading.Lock()
+    value = [0]
+    start = time.perf_counter()
+    for _ in range(n):
+        with lock:
+            value[0] += 1
+    per_locked = (time.perf_counter() - start) / n
+
+    h = Histogram("bench_seconds", "")
+    start = time.perf_counter()
+    for i in range(n):
+        h.observe(i * 1e-7)
+    per_observe = (time.perf_counter() - start) / n
+
+    print(f"Counter.inc:          {per_inc * 1e9:6.0f} ns")
+    print(f"locked counter:       {per_locked * 1e9:6.0f} ns")
+    print(f"Histogram.observe:    {per_observe * 1e9:6.0f} ns")
+    print(f"p50 of 0..0.1 s uniform: {h.quantile(0.5) * 1e3:.2f} ms, p99 {h.quantile(0.99) * 1e3:.2f} ms")
+
+    # Threads that come and go (one per connection) fold into the total
+    def work():
+        for _ in range(1000):
+            c.inc()
+    threads = [threading.Thread(target=work) for _ in range(200)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    print(f"after 200 short-lived threads: value {c.value} (expected {n + 200_000}), "
+          f"{len(c._cells._live)} live cells")
+
+
+if __name__ == "__main__":
+    _benchmark()
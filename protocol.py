@@ -0,0 +1,834 @@
+"""
+protocol.py
+
+Framed binary protocol that runs alongside the original line-based text protocol.
+
+Packet layout (network byte order, 14-byte header + payload):
+
+    offset size field
+    0      2    magic     b'BS'
+    2      4    crc32     CRC-32 over everything after this field (bytes 6..end)
+    6      1    version   PROTOCOL_VERSION
+    7      1    type      one of the PKT_* constants
+    8      4    seq       per-direction sequence number, starting at 0
+    12     2    length    payload length in bytes
+
+Payloads:
+    TEXT    UTF-8 message (prompts, notices, and any typed command)
+    FIRE    row byte, col byte; on boards past 256 rows or columns, row and col
+            as two 16-bit numbers
+    RESULT  result code byte, game_over byte, sunk ship index byte (0xFF = none)
+    BOARD   kind byte (BOARD_TARGET / BOARD_OWN), size byte, then the cells
+            bit-packed 2 bits each (CELL_CODES), four cells per byte, row-major
+    DELTA   kind byte, then one (row, col, cell code) byte triple per changed cell
+    HELLO   handshake of the optional encrypted mode (secure.py)
+    VIEW    kind byte, top and left (16 bits each), rows byte, cols byte, then
+            the window's cells packed as in BOARD
+
+Board updates: a binary connection gets one BOARD snapshot per board per match,
+then only DELTA packets for the cells each shot changes; the client keeps local
+copies of both boards and applies the deltas (apply_delta). Text connections keep
+receiving the full GRID block every turn. Boards bigger than
+battleship.VIEWPORT are never sent whole: the server sends a window of them
+(battleship.view) whenever it would have sent the board, as a VIEW packet or a
+GRID block labelled with the window's own rows and columns, and no deltas.
+
+Receiving: PacketReader keeps one preallocated bytearray per connection, receives
+into it with recv_into() and hands out memoryview slices of the payload, so no
+per-line strings are built. A packet whose CRC does not match is counted and
+dropped; a bad magic or version triggers a resync to the next magic. Packets with
+a sequence number lower than expected (duplicates/replays) are counted and dropped;
+a gap is counted and the reader resyncs to the new number. A length above the
+reader's max_payload is treated as corruption straight away, so a damaged length
+field cannot stall the stream waiting for bytes that will never come. The
+default, MAX_PACKET, is the largest payload the server sends: boards and
+windows are at most battleship.VIEWPORT cells a side, and a TEXT message
+longer than MAX_TEXT bytes (chat history, a busy chat frame) goes out as
+several TEXT packets, split between lines.
+Bytes read from a socket by another thread (the server's lobby watcher) go in
+through a connection's feed(), which parses them with the same per-connection
+state as recv(): a line or packet split across two reads is put back together.
+
+Encryption: after a secure.py handshake the writer and reader of a connection
+each hold a Cipher (`cipher`), and payloads are encrypted and authenticated in
+their buffers; a packet that fails authentication is counted as forged and
+dropped.
+
+Connections: TextConnection and BinaryConnection give the server one interface
+(send, send_board, send_result, recv) over either protocol.
+
+Sending: a connection's output goes through an Output. Between cork() and
+uncork() what the corking thread sends is queued and leaves in one sendmsg()
+(writev) at flush() or uncork(), or when the connection is about to block in
+recv(), so a prompt is never held back. Sends don't block either: a client
+that stops reading is cut off (HIGH_WATER, WRITE_DEADLINE) instead of stalling
+the match that is sending to it. The server corks a player for each
+placement step and for the turn loop, which makes a turn one write per player
+instead of one per message. Sockets have TCP_NODELAY set: a step's output is
+complete when it is flushed, and Nagle would only hold its last segment back
+until the client's (delayed) ACK of the previous one.
+
+Run `python protocol.py` for wire-size, parse-cost and corruption-detection numbers.
+"""
+
+import select
+import socket
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+
+from battleship import SHIPS, VIEWPORT, format_coordinate, render_grid
+from logs import log
+from metrics import counter
+
+MAGIC = b'BS'
+PROTOCOL_VERSION = 1
+HEADER = struct.Struct('!2sIBBIH')
+MAX_PAYLOAD = 0xFFFF
+VIEW = struct.Struct('!BHHBB')
+FIRE_WIDE = struct.Struct('!HH')
+TAG = 16  # authentication tag after an encrypted payload (secure.py)
+MAX_TEXT = 4096  # bytes of text per TEXT packet; longer messages are split (BinaryConnection.send)
+# Largest payload the server sends, and so PacketReader's default limit: TEXT, or a
+# BOARD / VIEW of at most VIEWPORT x VIEWPORT cells; plus the tag when encrypted
+MAX_PACKET = max(MAX_TEXT, 2 + (VIEWPORT * VIEWPORT + 3) // 4, VIEW.size + (VIEWPORT * VIEWPORT + 3) // 4) + TAG
+
+PKT_TEXT = 1
+PKT_FIRE = 2
+PKT_RESULT = 3
+PKT_BOARD = 4
+PKT_DELTA = 5
+PKT_HELLO = 6
+PKT_VIEW = 7
+
+BOARD_TARGET = 0  # opponent's board as seen by the player ('.', 'X', 'o')
+BOARD_OWN = 1     # player's own board, ships included
+
+CELL_CODES = {'.': 0, 'o': 1, 'X': 2, 'S': 3}
+CELL_CHARS = '.oXS'
+
+RESULT_CODES = {'miss': 0, 'hit': 1, 'already_shot': 2}
+RESULT_NAMES = {code: name for name, code in RESULT_CODES.items()}
+NO_SHIP = 0xFF
+SHIP_INDEX = {name: i for i, (name, _) in enumerate(SHIPS)}
+
+BYTES_IN = counter("battleship_bytes_received_total", "Bytes received from clients")
+BYTES_OUT = counter("battleship_bytes_sent_total", "Bytes sent to clients (spectator streams not included)")
+SOCKET_WRITES = counter("battleship_socket_writes_total", "Send calls on client connections (spectator streams not included)")
+SLOW_CONSUMERS = counter("battleship_slow_consumers_total", "Clients cut off for not reading what they were sent")
+
+# Outgoing bytes a client may leave unread, and seconds it may go without
+# reading any, before it is cut off (Output)
+HIGH_WATER = 256 * 1024
+WRITE_DEADLINE = 10.0
+
+_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0)
+
+
+class PacketWriter:
+    """
+    Builds packets into one reusable bytearray and sends them with sendall().
+    Not thread-safe; each connection direction owns one writer.
+    """
+    cipher = None  # secure.Cipher once a handshake has set one
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.seq = 0
+        self.bytes_sent = 0
+        self._buf = bytearray(HEADER.size + MAX_PAYLOAD)
+        self._view = memoryview(self._buf)
+
+    def encode(self, ptype, payload=b''):
+        """Frame payload into the internal buffer; returns a memoryview of the packet."""
+        n = len(payload)
+        cipher = self.cipher
+        overhead = 0 if cipher is None else TAG
+        if n + overhead > MAX_PAYLOAD:
+            raise ValueError(f"payload too large: {n} bytes")
+        buf = self._buf
+        HEADER.pack_into(buf, 0, MAGIC, 0, PROTOCOL_VERSION, ptype, self.seq, n + overhead)
+        end = HEADER.size + n
+        buf[HEADER.size:end] = payload
+        if cipher is not None:
+            end = cipher.seal(buf, self._view, self.seq, end)
+        struct.pack_into('!I', buf, 2, zlib.crc32(self._view[6:end]))
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        return self._view[:end]
+
+    def send(self, ptype, payload=b''):
+        packet = self.encode(ptype, payload)
+        self.sock.sendall(packet)
+        self.bytes_sent += len(packet)
+        BYTES_OUT.inc(len(packet))
+
+
+class SlowConsumer(ConnectionError):
+    """The client stopped reading what it was sent (see Output)."""
+
+
+class Output:
+    """
+    Outgoing side of a connection, with a sendall() for PacketWriter. Sends
+    straight away unless corked: then the corking thread's sends are queued
+    until flush() or uncork(). Sends from other threads (a notice to a player
+    from the opponent's placement thread, chat) go straight out, taking any
+    output the corking thread has queued out ahead of them.
+
+    Sends never block: what the kernel won't take is kept in a buffer and goes
+    out with the next send, or in wait(), which the connection calls before it
+    blocks in recv(). A client that stops reading is cut off (SlowConsumer,
+    and the socket shut down) once more than high_water bytes are waiting, or
+    once no byte has gone out for `deadline` seconds. So the thread sending to
+    it stalls for at most `deadline`, and only when it needs that client's answer.
+    """
+
+    def __init__(self, sock, high_water=HIGH_WATER, deadline=WRITE_DEADLINE):
+        self.sock = sock
+        self.high_water = high_water
+        self.deadline = deadline
+        self.failed = None  # why the connection was cut off
+        self._owner = None
+        self._queued = []
+        self._unsent = bytearray()
+        self._stalled_at = None  # last time anything went out while _unsent was non-empty
+        self._lock = threading.Lock()
+
+    def sendall(self, data):
+        with self._lock:
+            if self._owner == threading.get_ident():
+                self._queued.append(bytes(data))  # PacketWriter reuses its buffer
+                return
+            # Another thread's send flushes the owner's queued output with it: it
+            # can't overtake that (binary packets must leave in sequence), and
+            # mustn't wait for the owner's next flush (chat to a waiting player)
+            chunks, self._queued = self._queued, []
+            chunks.append(data)
+            self._send(chunks)
+
+    def cork(self):
+        self._owner = threading.get_ident()
+
+    def flush(self):
+        if self._queued:
+            with self._lock:
+                chunks, self._queued = self._queued, []
+                if chunks:
+                    self._send(chunks)
+
+    def uncork(self):
+        self._owner = None
+        self.flush()
+
+    def wait(self):
+        """Flush, then block until everything has gone out; raises SlowConsumer past the deadline."""
+        self.flush()
+        poller = None
+        while True:
+            with self._lock:
+                if not self._unsent:
+                    return
+                self._drain()
+                if not self._unsent:
+                    return
+                self._check()
+                remaining = self._stalled_at + self.deadline - time.monotonic()
+            if poller is None:
+                poller = select.poll()
+                poller.register(self.sock, select.POLLOUT)
+            poller.poll(max(1, int(remaining * 1000)))
+
+    def _send(self, chunks):
+        """Under the lock."""
+        if self.failed is not None:
+            raise SlowConsumer(self.failed)
+        if self._unsent:
+            for chunk in chunks:
+                self._unsent += chunk
+            self._drain()
+        else:
+            try:
+                sent = self.sock.sendmsg(chunks, (), _DONTWAIT)
+            except BlockingIOError:
+                sent = 0
+            SOCKET_WRITES.inc()
+            if sent < sum(map(len, chunks)):
+                self._unsent += b''.join(chunks)[sent:]
+                self._stalled_at = time.monotonic()
+        self._check()
+
+    def _drain(self):
+        try:
+            sent = self.sock.send(self._unsent, _DONTWAIT)
+        except BlockingIOError:
+            sent = 0
+        SOCKET_WRITES.inc()
+        if sent:
+            del self._unsent[:sent]
+            self._stalled_at = time.monotonic() if self._unsent else None
+
+    def _check(self):
+        if len(self._unsent) > self.high_water:
+            self._fail(f"{len(self._unsent)} bytes unsent")
+        elif self._stalled_at is not None and time.monotonic() - self._stalled_at > self.deadline:
+            self._fail(f"nothing sent for {self.deadline:g}s")
+
+    def _fail(self, reason):
+        self.failed = reason
+        self._unsent.clear()
+        SLOW_CONSUMERS.inc()
+        log.info("Cutting off a client that stopped reading (%s)", reason)
+        try:
+            # Reset, not FIN, when it is closed: the FIN would queue behind the unread data
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            self.sock.shutdown(socket.SHUT_RDWR)  # its recv(), maybe blocked on another thread, returns EOF
+        except OSError:
+            pass
+        raise SlowConsumer(reason)
+
+
+def encode_packet(ptype, seq, payload=b''):
+    """Standalone encoder returning bytes (tests, tools and fault injection)."""
+    body = HEADER.pack(MAGIC, 0, PROTOCOL_VERSION, ptype, seq, len(payload))[6:] + payload
+    return MAGIC + struct.pack('!I', zlib.crc32(body)) + body
+
+
+class PacketReader:
+    """
+    Incremental packet parser over a fixed, preallocated receive buffer.
+
+    next_packet() returns (ptype, seq, payload) with payload a memoryview into the
+    buffer; it is only valid until the next recv_from()/feed(), so copy it
+    (bytes(payload)) if it needs to outlive that.
+    """
+    cipher = None  # secure.Cipher once a handshake has set one
+
+    def __init__(self, max_payload=MAX_PACKET, capacity=None):
+        self.max_payload = max_payload
+        self._buf = bytearray(capacity or HEADER.size + max_payload + 4096)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+        self.next_seq = 0
+        self.received = 0
+        self.corrupted = 0
+        self.out_of_sequence = 0
+        self.forged = 0
+        self.bytes_received = 0
+        self._resyncing = False
+
+    def _compact(self):
+        # Same-length slice assignment never resizes, so outstanding views stay legal
+        pending = self._end - self._start
+        if self._start:
+            self._buf[:pending] = self._buf[self._start:self._end]
+            self._start, self._end = 0, pending
+
+    def recv_from(self, sock):
+        """Receive straight into the buffer. Returns bytes read (0 on EOF)."""
+        if self._end == len(self._buf):
+            self._compact()
+        n = sock.recv_into(self._view[self._end:])
+        self._end += n
+        self.bytes_received += n
+        BYTES_IN.inc(n)
+        return n
+
+    def feed(self, data):
+        """Append bytes obtained elsewhere (e.g. from an asyncio reader)."""
+        if self._end + len(data) > len(self._buf):
+            self._compact()
+        if self._end + len(data) > len(self._buf):
+            raise ValueError("receive buffer overflow")
+        self._buf[self._end:self._end + len(data)] = data
+        self._end += len(data)
+        self.bytes_received += len(data)
+
+    def pending(self):
+        """Whether received bytes are waiting to be parsed."""
+        return self._end > self._start
+
+    def next_packet(self):
+        """Return the next valid packet, or None if a full packet isn't buffered yet."""
+        buf, view = self._buf, self._view
+        while self._end - self._start >= HEADER.size:
+            start = self._start
+            magic, crc, version, ptype, seq, length = HEADER.unpack_from(buf, start)
+            if magic != MAGIC or version != PROTOCOL_VERSION or length > self.max_payload:
+                self._resync(start + 1)
+                continue
+
+            end = start + HEADER.size + length
+            if end > self._end:
+                if end > len(buf):
+                    self._compact()
+                return None
+
+            payload = view[start + HEADER.size:end]
+            if zlib.crc32(view[start + 6:end]) != crc:
+                # Can't trust the length either: resync to the next magic
+                self._resync(start + 1)
+                continue
+
+            self._start = end
+            self._resyncing = False
+            cipher = self.cipher
+            if cipher is not None:
+                # Authenticated before its sequence number is believed
+                if not cipher.open(buf, view, start, end, seq):
+                    self.forged += 1
+                    continue
+                payload = view[start + HEADER.size:end - TAG]
+            if seq != self.next_seq:
+                self.out_of_sequence += 1
+                if seq < self.next_seq:
+                    continue  # duplicate or replay
+            self.next_seq = (seq + 1) & 0xFFFFFFFF
+            self.received += 1
+            return ptype, seq, payload
+        if self._start == self._end:
+            self._start = self._end = 0
+        return None
+
+    def _resync(self, pos):
+        # One corruption event may take several steps to resync past; count it once
+        if not self._resyncing:
+            self.corrupted += 1
+            self._resyncing = True
+        found = self._buf.find(MAGIC, pos, self._end)
+        self._start = found if found != -1 else max(self._end - 1, pos)
+
+
+def _pack_cells(grid, out, offset):
+    i = 0
+    for row in grid:
+        for cell in row:
+            out[offset + (i >> 2)] |= CELL_CODES.get(cell, 0) << ((i & 3) * 2)
+            i += 1
+
+
+def _unpack_cells(payload, offset, rows, cols):
+    grid = []
+    i = 0
+    for _ in range(rows):
+        row = []
+        for _ in range(cols):
+            row.append(CELL_CHARS[(payload[offset + (i >> 2)] >> ((i & 3) * 2)) & 3])
+            i += 1
+        grid.append(row)
+    return grid
+
+
+def pack_board(grid, kind=BOARD_TARGET):
+    """BOARD payload: kind, size, then 2-bit cell codes packed four to a byte."""
+    size = len(grid)
+    out = bytearray(2 + (size * size + 3) // 4)
+    out[0] = kind
+    out[1] = size
+    _pack_cells(grid, out, 2)
+    return out
+
+
+def unpack_board(payload):
+    """Inverse of pack_board: returns (kind, grid)."""
+    kind, size = payload[0], payload[1]
+    return kind, _unpack_cells(payload, 2, size, size)
+
+
+def pack_view(grid, origin, kind=BOARD_TARGET):
+    """VIEW payload: the window of a big board at origin (top, left), see battleship.view."""
+    rows = len(grid)
+    cols = len(grid[0]) if rows else 0
+    out = bytearray(VIEW.size + (rows * cols + 3) // 4)
+    VIEW.pack_into(out, 0, kind, origin[0], origin[1], rows, cols)
+    _pack_cells(grid, out, VIEW.size)
+    return out
+
+
+def unpack_view(payload):
+    """Inverse of pack_view: returns (kind, (top, left), grid)."""
+    kind, top, left, rows, cols = VIEW.unpack_from(payload)
+    return kind, (top, left), _unpack_cells(payload, VIEW.size, rows, cols)
+
+
+def pack_delta(cells, kind=BOARD_TARGET):
+    """DELTA payload for an iterable of (row, col, cell_char)."""
+    out = bytearray((kind,))
+    for row, col, cell in cells:
+        out += bytes((row, col, CELL_CODES.get(cell, 0)))
+    return out
+
+
+def apply_delta(boards, payload):
+    """
+    Apply a DELTA payload to a client's local boards ({kind: grid}).
+    Returns the kind that changed, or None if that board has no snapshot yet.
+    """
+    kind = payload[0]
+    grid = boards.get(kind)
+    if grid is None:
+        return None
+    for i in range(1, len(payload) - 2, 3):
+        grid[payload[i]][payload[i + 1]] = CELL_CHARS[payload[i + 2] & 3]
+    return kind
+
+
+def pack_result(result, sunk, game_over):
+    return bytes((RESULT_CODES[result], 1 if game_over else 0, SHIP_INDEX.get(sunk, NO_SHIP)))
+
+
+def unpack_result(payload):
+    """Returns (result, sunk_ship_name_or_None, game_over)."""
+    sunk = SHIPS[payload[2]][0] if payload[2] != NO_SHIP else None
+    return RESULT_NAMES[payload[0]], sunk, bool(payload[1])
+
+
+def result_message(result, sunk):
+    """The text TwoPlayerGame.fire would show for this result (without " You win!")."""
+    if result == 'hit':
+        return f"HIT!{' You sank the ' + sunk + '!' if sunk else ''}"
+    if result == 'miss':
+        return "MISS!"
+    return "You've already fired at that location."
+
+
+def pack_fire(row, col):
+    """FIRE payload: two bytes, or two 16-bit numbers past row or column 256."""
+    if row < 256 and col < 256:
+        return bytes((row, col))
+    return FIRE_WIDE.pack(row, col)
+
+
+coordinate_str = format_coordinate
+
+
+def split_text(data, limit=MAX_TEXT):
+    """
+    Yield the pieces of a UTF-8 message, at most limit bytes each, to send as
+    separate TEXT packets: split at the last newline that fits (dropping it),
+    or, for a single line that is too long, before a character that doesn't.
+    """
+    while len(data) > limit:
+        cut = data.rfind(b'\n', 0, limit + 1)
+        if cut > 0:
+            yield data[:cut]
+            data = data[cut + 1:]
+            continue
+        cut = limit
+        while cut and data[cut] & 0xC0 == 0x80:  # a UTF-8 continuation byte
+            cut -= 1
+        yield data[:cut]
+        data = data[cut:]
+    yield data
+
+
+def _packet_line(packet):
+    """A client's packet as the line the game reads: TEXT as its text, FIRE as a coordinate; else None."""
+    ptype, _, payload = packet
+    if ptype == PKT_TEXT:
+        return str(payload, 'utf-8', 'replace').strip()
+    if ptype == PKT_FIRE and len(payload) == 2:
+        return coordinate_str(payload[0], payload[1])
+    if ptype == PKT_FIRE and len(payload) == FIRE_WIDE.size:
+        return coordinate_str(*FIRE_WIDE.unpack(payload))
+    return None  # anything else from a client is ignored
+
+
+class TextConnection:
+    """The original line protocol: newline-terminated UTF-8 lines each way."""
+    binary = False
+    dropped = False  # errors are raised, never deferred (see sessions.Seat)
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.lines = deque()  # complete lines received and not yet taken, stripped
+        self._partial = bytearray()  # a line still waiting for its newline
+        self.output = Output(conn)
+
+    def send(self, msg):
+        data = (msg + '\n').encode()
+        self.output.sendall(data)
+        BYTES_OUT.inc(len(data))
+
+    def send_board(self, grid, own=False, origin=None):
+        text = render_grid(grid, origin)
+        if own:
+            text = "Your current board:\n" + text
+        data = text.encode()
+        self.output.sendall(data)
+        BYTES_OUT.inc(len(data))
+
+    def cork(self):
+        self.output.cork()
+
+    def flush(self):
+        self.output.flush()
+
+    def uncork(self):
+        self.output.uncork()
+
+    def new_match(self):
+        pass
+
+    def send_target_board(self, grid, origin=None):
+        """The per-turn view of the opponent's board: always the full GRID (or window) in text mode."""
+        self.send_board(grid, origin=origin)
+
+    def send_cells(self, cells, own=False):
+        pass  # text clients only ever see full boards
+
+    def send_result(self, result, sunk, game_over, message):
+        self.send(message)
+
+    def interrupt(self):
+        """
+        Wake a recv() blocked on another thread; it (and every later recv) returns
+        None. Used for inactivity forfeits; sending still works afterwards.
+        """
+        try:
+            self.conn.shutdown(socket.SHUT_RD)
+        except OSError:
+            pass
+
+    def feed(self, data):
+        """Take bytes read from the socket elsewhere: complete lines go on `lines`."""
+        BYTES_IN.inc(len(data))
+        self._partial += data
+        if b'\n' in data:
+            *complete, rest = self._partial.split(b'\n')
+            self._partial = bytearray(rest)
+            self.lines.extend(str(line, 'utf-8', 'replace').strip() for line in complete)
+
+    def recv(self):
+        """Next line from the client, stripped; None once the client has disconnected."""
+        self.output.wait()
+        while not self.lines:
+            data = self.conn.recv(4096)
+            if not data:
+                return None
+            self.feed(data)
+        return self.lines.popleft()
+
+    def close(self):
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+
+
+class BinaryConnection:
+    """
+    Packet protocol connection. recv() returns strings like TextConnection so the
+    game loop stays protocol-agnostic: TEXT packets come back as their text and
+    FIRE packets as a coordinate such as 'B5'.
+    """
+    binary = True
+    dropped = False
+
+    def __init__(self, conn, max_payload=MAX_PACKET):
+        self.conn = conn
+        self.reader = PacketReader(max_payload)  # the server raises it for long FLEET lines
+        self.lines = deque()  # packets fed in (feed()) and not yet taken, as recv() returns them
+        self.output = Output(conn)
+        self.writer = PacketWriter(self.output)
+        self._snapshots = set()  # board kinds the client holds an up-to-date copy of
+        self._lock = threading.Lock()  # the writer: chat and notices come from other threads
+
+    def _send(self, ptype, payload):
+        with self._lock:
+            self.writer.send(ptype, payload)
+
+    def send(self, msg):
+        data = msg.encode()
+        if len(data) <= MAX_TEXT:
+            self._send(PKT_TEXT, data)
+            return
+        with self._lock:
+            for chunk in split_text(data):
+                self.writer.send(PKT_TEXT, chunk)
+
+    def send_board(self, grid, own=False, origin=None):
+        kind = BOARD_OWN if own else BOARD_TARGET
+        if origin is not None:
+            # A window of a big board: the client holds no copy to keep current
+            self._send(PKT_VIEW, pack_view(grid, origin, kind))
+            self._snapshots.discard(kind)
+            return
+        self._send(PKT_BOARD, pack_board(grid, kind))
+        self._snapshots.add(kind)
+
+    def new_match(self):
+        """Forget which boards the client holds; the next board view is a full snapshot."""
+        self._snapshots.clear()
+
+    def send_target_board(self, grid, origin=None):
+        # After the first snapshot the client's copy is kept current by send_cells()
+        if origin is not None or BOARD_TARGET not in self._snapshots:
+            self.send_board(grid, origin=origin)
+
+    def send_cells(self, cells, own=False):
+        kind = BOARD_OWN if own else BOARD_TARGET
+        if kind in self._snapshots:
+            self._send(PKT_DELTA, pack_delta(cells, kind))
+
+    def send_result(self, result, sunk, game_over, message):
+        # A RESULT packet names the sunk ship by its place in SHIPS: not the copies of a big fleet
+        if result in RESULT_CODES and (sunk is None or sunk in SHIP_INDEX):
+            self._send(PKT_RESULT, pack_result(result, sunk, game_over))
+        else:
+            self.send(message)
+
+    interrupt = TextConnection.interrupt
+    cork = TextConnection.cork
+    flush = TextConnection.flush
+    uncork = TextConnection.uncork
+
+    def feed(self, data):
+        """As TextConnection.feed: the packets data completes go on `lines`."""
+        BYTES_IN.inc(len(data))
+        self.reader.feed(data)
+        while (packet := self.reader.next_packet()) is not None:
+            line = _packet_line(packet)
+            if line is not None:
+                self.lines.append(line)
+
+    def recv(self):
+        self.output.wait()
+        while not self.lines:
+            packet = self.reader.next_packet()
+            if packet is None:
+                if self.reader.recv_from(self.conn) == 0:
+                    return None
+                continue
+            line = _packet_line(packet)
+            if line is not None:
+                return line
+        return self.lines.popleft()
+
+    def state(self):
+        """What restore() needs to carry on this connection in another process (JSON-friendly)."""
+        r, w = self.reader, self.writer
+        return {'seq': w.seq, 'next_seq': r.next_seq,
+                'keys': None if w.cipher is None else [r.cipher.export(), w.cipher.export()]}
+
+    def restore(self, state):
+        from secure import Cipher
+        self.writer.seq = state['seq']
+        self.reader.next_seq = state['next_seq']
+        if state['keys'] is not None:
+            self.reader.cipher, self.writer.cipher = map(Cipher.restore, state['keys'])
+
+    def close(self):
+        r = self.reader
+        if r.corrupted or r.out_of_sequence or r.forged:
+            log.info("Binary connection closed: %d packets, %d corrupted, %d out of sequence, %d forged",
+                     r.received, r.corrupted, r.out_of_sequence, r.forged)
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+
+
+def _benchmark():
+    import random
+    import time
+    from battleship import Board
+
+    board = Board(10)
+    board.place_ships_randomly(SHIPS)
+    for _ in range(30):
+        board.fire_at(random.randrange(10), random.randrange(10))
+    grid = board.display_grid
+
+    # Bytes for one turn as seen by the two players: board + prompt, the shot,
+    # the result to the shooter and the notice to the opponent.
+    prompt = "Your turn! Enter coordinate to fire at (or 'quit'):"
+    text_turn = (render_grid(grid) + prompt + '\n' + "B5\n" + "HIT!\n" + "Opponent fired at B5: HIT!\n").encode()
+    binary_turn = b''.join([
+        encode_packet(PKT_BOARD, 0, bytes(pack_board(grid))),
+        encode_packet(PKT_TEXT, 1, prompt.encode()),
+        encode_packet(PKT_FIRE, 0, bytes((1, 4))),
+        encode_packet(PKT_RESULT, 2, pack_result('hit', None, False)),
+        encode_packet(PKT_TEXT, 3, b"Opponent fired at B5: HIT!"),
+    ])
+    # Delta mode: no board at the start of the turn, one-cell DELTA to each player after the shot
+    delta_turn = b''.join([
+        encode_packet(PKT_TEXT, 1, prompt.encode()),
+        encode_packet(PKT_FIRE, 0, bytes((1, 4))),
+        encode_packet(PKT_RESULT, 2, pack_result('hit', None, False)),
+        encode_packet(PKT_DELTA, 3, bytes(pack_delta([(1, 4, 'X')]))),
+        encode_packet(PKT_DELTA, 4, bytes(pack_delta([(1, 4, 'X')], BOARD_OWN))),
+        encode_packet(PKT_TEXT, 5, b"Opponent fired at B5: HIT!"),
+    ])
+    print(f"bytes per turn: text {len(text_turn)}  binary full board {len(binary_turn)}  binary deltas {len(delta_turn)}")
+
+    # Server-side cost of the per-turn board update: full text GRID, full BOARD
+    # snapshot, or the one-cell DELTA that delta mode sends instead
+    n = 20000
+    writer = PacketWriter(None)
+    start = time.perf_counter()
+    for _ in range(n):
+        data = render_grid(grid).encode()
+    text_cpu = (time.perf_counter() - start) / n
+    start = time.perf_counter()
+    for _ in range(n):
+        full = writer.encode(PKT_BOARD, pack_board(grid))
+    full_cpu = (time.perf_counter() - start) / n
+    start = time.perf_counter()
+    for _ in range(n):
+        delta = writer.encode(PKT_DELTA, pack_delta([(1, 4, 'X')]))
+    delta_cpu = (time.perf_counter() - start) / n
+    print(f"board update per turn: text GRID {len(data)} B / {text_cpu * 1e6:.2f} us   "
+          f"BOARD snapshot {len(full)} B / {full_cpu * 1e6:.2f} us   "
+          f"DELTA {len(delta)} B / {delta_cpu * 1e6:.2f} us")
+
+    # Parse cost per board update: the client's GRID line loop vs one BOARD packet
+    import io
+    text_board = render_grid(grid)
+    n = 20000
+    start = time.perf_counter()
+    for _ in range(n):
+        rfile = io.StringIO(text_board)
+        rows = []
+        line = rfile.readline()
+        if line.strip() == "GRID":
+            while True:
+                board_line = rfile.readline()
+                if not board_line or board_line.strip() == "":
+                    break
+                rows.append(board_line.strip())
+    text_cost = (time.perf_counter() - start) / n
+
+    packet = encode_packet(PKT_BOARD, 0, bytes(pack_board(grid)))
+    reader = PacketReader()
+    start = time.perf_counter()
+    for seq in range(n):
+        reader.next_seq = 0
+        reader.feed(packet)
+        _, _, payload = reader.next_packet()
+        payload[1]  # size byte; cells stay packed until rendered
+    binary_cost = (time.perf_counter() - start) / n
+    print(f"parse per board update: text {text_cost * 1e6:.2f} us  binary {binary_cost * 1e6:.2f} us "
+          f"(binary framing + CRC only; unpack_board adds rendering cost on display)")
+
+    # Fault injection: flip one random bit in a fraction of packets
+    reader = PacketReader()
+    flipped = 0
+    total = 10000
+    for seq in range(total):
+        pkt = bytearray(encode_packet(PKT_FIRE, seq, bytes((seq % 10, seq % 7))))
+        if random.random() < 0.1:
+            bit = random.randrange(len(pkt) * 8)
+            pkt[bit // 8] ^= 1 << (bit % 8)
+            flipped += 1
+        reader.feed(pkt)
+        while reader.next_packet() is not None:
+            pass
+    print(f"fault injection: {flipped} of {total} packets corrupted, {reader.corrupted} flagged corrupted, "
+          f"{reader.out_of_sequence} out of sequence, {reader.received} delivered")
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,356 @@
+"""
+replay.py
+
+Replay files for finished matches, and an analytics scanner over them.
+
+A replay file is a short header followed by chunks, each holding a batch of
+games laid out column by column so a scanner can look at them through NumPy
+views of an mmap, without building a Board (or even a Python object) per game:
+
+  header:  b'BSRP', version, board size, number of ships, ship sizes (1 byte each)
+  chunk:   b'GAMS', n_games (u32), n_shots (u32), then
+           games    n_games x (n_shots u16, winner u8, end u8,
+                               placements u8[2][ships][3] = row, col, orientation)
+           rows     n_shots x u8    shots of all the chunk's games, game after game
+           cols     n_shots x u8
+           results  n_shots x u8    MISS / HIT / SUNK / ALREADY_SHOT
+
+Rows and columns are the (row, col) of battleship.parse_coordinate. Only
+valid shots are stored, and those alternate strictly between the players
+(player 1 first), so the shooter of each shot is implied by its position.
+A torn chunk at the end of a file (server killed mid-write) is ignored.
+
+ReplayWriter is what the server uses (`--replays FILE`); it needs nothing
+beyond the standard library. The analytics side needs NumPy:
+
+  python replay.py stats FILE [FILE ...]     aggregate tables + scan speed
+  python replay.py synth FILE --games N      write N synthetic random games
+"""
+
+import argparse
+import mmap
+import struct
+import threading
+
+from battleship import BOARD_SIZE, SHIPS, row_label
+
+MAGIC = b'BSRP'
+VERSION = 1
+FILE_HEADER = struct.Struct('<4sBBB')
+CHUNK_HEADER = struct.Struct('<4sII')
+CHUNK_MAGIC = b'GAMS'
+GAME_HEADER = struct.Struct('<HBB')
+
+# Shot results
+MISS = 0
+HIT = 1
+SUNK = 2
+ALREADY_SHOT = 3
+
+# How a game ended
+WIN = 0
+QUIT = 1
+DISCONNECT = 2
+TIMEOUT = 3
+END_NAMES = ('win', 'quit', 'disconnect', 'timeout')
+NO_WINNER = 255
+
+
+def result_code(result, sunk):
+    """Shot result code for TwoPlayerGame.fire's (result, sunk)."""
+    if result == 'hit':
+        return SUNK if sunk else HIT
+    return MISS if result == 'miss' else ALREADY_SHOT
+
+
+class MatchRecord:
+    """Placements and shots of one match, collected while it is played."""
+
+    def __init__(self, n_ships):
+        self.placements = bytearray(2 * n_ships * 3)
+        self.n_ships = n_ships
+        self.rows = bytearray()
+        self.cols = bytearray()
+        self.results = bytearray()
+
+    def place(self, player, ship_index, row, col, orientation):
+        at = (player * self.n_ships + ship_index) * 3
+        self.placements[at:at + 3] = bytes((row, col, orientation))
+
+    def shot(self, row, col, result, sunk=None):
+        self.rows.append(row)
+        self.cols.append(col)
+        self.results.append(result_code(result, sunk))
+
+
+class ReplayWriter:
+    """
+    Appends finished games to a replay file, a chunk of up to chunk_games at
+    a time. Thread-safe. Games still buffered are lost if the process dies, so
+    call flush() now and then.
+    """
+
+    def __init__(self, path, size=BOARD_SIZE, ships=SHIPS, chunk_games=1024):
+        self.path = path
+        self.n_ships = len(ships)
+        self.chunk_games = chunk_games
+        header = FILE_HEADER.pack(MAGIC, VERSION, size, len(ships)) + bytes(s for _, s in ships)
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(header)
+            self._file.flush()
+        else:
+            with open(path, 'rb') as f:
+                if f.read(len(header)) != header:
+                    raise ValueError(f"{path} is a replay file for a different board or fleet")
+        self._lock = threading.Lock()
+        self._reset()
+        self.games = 0
+
+    def _reset(self):
+        self._games = bytearray()
+        self._rows = bytearray()
+        self._cols = bytearray()
+        self._results = bytearray()
+        self._count = 0
+
+    def add(self, record, winner, end):
+        """Add a finished game. winner is a player index or NO_WINNER; end one of WIN..TIMEOUT."""
+        with self._lock:
+            self._games += GAME_HEADER.pack(len(record.rows), winner, end)
+            self._games += record.placements
+            self._rows += record.rows
+            self._cols += record.cols
+            self._results += record.results
+            self._count += 1
+            self.games += 1
+            if self._count >= self.chunk_games:
+                self._flush_buffer()
+
+    def flush(self):
+        with self._lock:
+            if self._count:
+                self._flush_buffer()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def write_chunk(self, n_games, games, rows, cols, results):
+        """Write a whole chunk of already-encoded columns (bulk producers, e.g. synthesize())."""
+        with self._lock:
+            self._write_chunk(n_games, games, rows, cols, results)
+            self.games += n_games
+
+    def _flush_buffer(self):
+        self._write_chunk(self._count, self._games, self._rows, self._cols, self._results)
+        self._reset()
+
+    def _write_chunk(self, n_games, games, rows, cols, results):
+        self._file.write(CHUNK_HEADER.pack(CHUNK_MAGIC, n_games, len(rows)))
+        for column in (games, rows, cols, results):
+            self._file.write(column)
+        self._file.flush()
+
+
+def game_dtype(n_ships):
+    import numpy as np
+    return np.dtype([('n_shots', '<u2'), ('winner', 'u1'), ('end', 'u1'),
+                     ('placements', 'u1', (2, n_ships, 3))])
+
+
+def iter_chunks(path):
+    """
+    Yield (size, ship_sizes, games, rows, cols, results) per chunk of a replay
+    file. All four arrays are read-only views into an mmap of the file.
+    """
+    import numpy as np
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, size, n_ships = FILE_HEADER.unpack_from(mm, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path}: not a version {VERSION} replay file")
+    ship_sizes = tuple(mm[FILE_HEADER.size:FILE_HEADER.size + n_ships])
+    dtype = game_dtype(n_ships)
+    offset = FILE_HEADER.size + n_ships
+    while offset + CHUNK_HEADER.size <= len(mm):
+        magic, n_games, n_shots = CHUNK_HEADER.unpack_from(mm, offset)
+        end = offset + CHUNK_HEADER.size + n_games * dtype.itemsize + 3 * n_shots
+        if magic != CHUNK_MAGIC or end > len(mm):
+            break  # torn last chunk
+        offset += CHUNK_HEADER.size
+        games = np.frombuffer(mm, dtype, n_games, offset)
+        offset += n_games * dtype.itemsize
+        rows, cols, results = (np.frombuffer(mm, np.uint8, n_shots, offset + i * n_shots) for i in range(3))
+        offset = end
+        yield size, ship_sizes, games, rows, cols, results
+
+
+class ReplayStats:
+    """Aggregates over any number of replay chunks; see scan()."""
+
+    def __init__(self, size, ship_sizes):
+        import numpy as np
+        self.size = size
+        self.ship_sizes = ship_sizes
+        cells = size * size
+        self.games = 0
+        self.shots = 0
+        self.ends = np.zeros(len(END_NAMES), dtype=np.int64)
+        self.moves_to_win = np.zeros(cells * 8 + 1, dtype=np.int64)  # histogram, winner's shots
+        self.shots_at = np.zeros(cells, dtype=np.int64)
+        self.hits_at = np.zeros(cells, dtype=np.int64)
+        self.ships_at = np.zeros(cells, dtype=np.int64)
+
+    def add_chunk(self, games, rows, cols, results):
+        import numpy as np
+        size, cells = self.size, self.size * self.size
+        self.games += len(games)
+        self.shots += len(rows)
+        self.ends += np.bincount(games['end'], minlength=len(END_NAMES))[:len(END_NAMES)]
+
+        # The winner fired the last shot, and players alternate from player 1
+        won = games['end'] == WIN
+        moves = (games['n_shots'][won].astype(np.int64) + 1) // 2
+        self.moves_to_win += np.bincount(np.minimum(moves, len(self.moves_to_win) - 1),
+                                         minlength=len(self.moves_to_win))
+
+        # One pass over the shots: count (cell, result) pairs, then fold
+        key = (rows.astype(np.uint16) * size + cols) * 4 + results
+        by_result = np.bincount(key, minlength=cells * 4).reshape(cells, 4)
+        self.shots_at += by_result[:, [MISS, HIT, SUNK]].sum(axis=1)
+        self.hits_at += by_result[:, HIT] + by_result[:, SUNK]
+
+        # Every cell covered by every ship of both fleets
+        placements = games['placements'].reshape(-1, len(self.ship_sizes), 3)
+        for s, ship_size in enumerate(self.ship_sizes):
+            row = placements[:, s, 0].astype(np.intp)
+            col = placements[:, s, 1].astype(np.intp)
+            vertical = placements[:, s, 2].astype(np.intp)
+            for k in range(ship_size):
+                self.ships_at += np.bincount((row + k * vertical) * size + col + k * (1 - vertical),
+                                             minlength=cells)
+
+    def report(self):
+        import numpy as np
+        size = self.size
+        wins = int(self.moves_to_win.sum())
+        print(f"games: {self.games:,}  shots: {self.shots:,}")
+        print("endings: " + ", ".join(f"{name} {int(n):,}" for name, n in zip(END_NAMES, self.ends)))
+        if wins:
+            moves = np.arange(len(self.moves_to_win))
+            cumulative = np.cumsum(self.moves_to_win)
+            p50, p90 = (int(np.searchsorted(cumulative, wins * q)) for q in (0.5, 0.9))
+            print(f"moves to win: mean {float((moves * self.moves_to_win).sum()) / wins:.1f}  "
+                  f"median {p50}  p90 {p90}  best {int(np.flatnonzero(self.moves_to_win)[0])}")
+
+        def table(title, values, fmt):
+            print(f"\n{title}")
+            print("    " + "".join(f"{c + 1:>6}" for c in range(size)))
+            for r in range(size):
+                print(f"  {row_label(r)} " + "".join(fmt(v) for v in values[r * size:(r + 1) * size]))
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            hit_rate = np.where(self.shots_at > 0, self.hits_at / self.shots_at, np.nan)
+        table("hit rate by cell (% of shots at the cell that hit)", hit_rate * 100,
+              lambda v: "     -" if np.isnan(v) else f"{v:6.1f}")
+        fleets = max(2 * self.games, 1)
+        table("ship placement heatmap (% of fleets with a ship on the cell)", self.ships_at / fleets * 100,
+              lambda v: f"{v:6.1f}")
+
+
+def scan(paths):
+    """Aggregate every game in the given replay files. Returns a ReplayStats (None if no games)."""
+    stats = None
+    for path in paths:
+        for size, ship_sizes, games, rows, cols, results in iter_chunks(path):
+            if stats is None:
+                stats = ReplayStats(size, ship_sizes)
+            elif (size, ship_sizes) != (stats.size, stats.ship_sizes):
+                raise ValueError(f"{path}: different board or fleet from the other files")
+            stats.add_chunk(games, rows, cols, results)
+    return stats
+
+
+def synthesize(path, games, seed=1, chunk_games=65536):
+    """
+    Write `games` random games (random fleets, random shot order, to the
+    finish) to path, simulated in bulk with batchsim.
+    """
+    import numpy as np
+    from batchsim import BatchBoards, HIT as SIM_HIT, ALREADY_SHOT as SIM_ALREADY
+
+    rng = np.random.default_rng(seed)
+    sizes = [ship_size for _, ship_size in SHIPS]
+    cells = BOARD_SIZE * BOARD_SIZE
+    writer = ReplayWriter(path, BOARD_SIZE, SHIPS)
+    dtype = game_dtype(len(SHIPS))
+    done = 0
+    while done < games:
+        k = min(chunk_games, games - done)
+        boards = [BatchBoards.random(k, rng=rng), BatchBoards.random(k, rng=rng)]
+        table = np.zeros(k, dtype=dtype)
+        for player, batch in enumerate(boards):
+            for s in range(len(SHIPS)):
+                first = (batch.ship_id == s).argmax(axis=1)
+                table['placements'][:, player, s, 0], table['placements'][:, player, s, 1] = divmod(first, BOARD_SIZE)
+                table['placements'][:, player, s, 2] = batch.ship_id[np.arange(k), first + 1] != s
+
+        orders = [rng.random((k, cells)).argsort(axis=1) for _ in (0, 1)]
+        shots = np.zeros((k, 2 * cells), dtype=np.uint8)
+        results = np.zeros((k, 2 * cells), dtype=np.uint8)
+        n_shots = np.zeros(k, dtype=np.uint16)
+        active = np.arange(k)
+        for turn in range(2 * cells):
+            if not len(active):
+                break
+            player = turn % 2
+            cell = orders[player][active, turn // 2]
+            result, sunk, over = boards[1 - player].fire(cell, active)
+            shots[active, turn] = cell
+            results[active, turn] = np.where(result == SIM_HIT, np.where(sunk >= 0, SUNK, HIT),
+                                             np.where(result == SIM_ALREADY, ALREADY_SHOT, MISS))
+            n_shots[active] = turn + 1
+            table['winner'][active[over]] = player
+            active = active[~over]
+
+        taken = np.arange(2 * cells) < n_shots[:, None]
+        table['n_shots'] = n_shots
+        flat_shots = shots[taken]
+        writer.write_chunk(k, table.tobytes(), (flat_shots // BOARD_SIZE).tobytes(),
+                           (flat_shots % BOARD_SIZE).tobytes(), results[taken].tobytes())
+        done += k
+    writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Battleship replay files")
+    commands = parser.add_subparsers(dest="command", required=True)
+    stats_cmd = commands.add_parser("stats", help="aggregate statistics over replay files")
+    stats_cmd.add_argument("files", nargs="+")
+    synth_cmd = commands.add_parser("synth", help="write synthetic random games")
+    synth_cmd.add_argument("file")
+    synth_cmd.add_argument("--games", type=int, default=1_000_000)
+    synth_cmd.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    import time
+    if args.command == "synth":
+        start = time.perf_counter()
+        synthesize(args.file, args.games, args.seed)
+        print(f"wrote {args.games:,} games to {args.file} in {time.perf_counter() - start:.1f} s")
+        return
+
+    start = time.perf_counter()
+    stats = scan(args.files)
+    elapsed = time.perf_counter() - start
+    if stats is None:
+        print("no games")
+        return
+    stats.report()
+    print(f"\nscanned {stats.games:,} games ({stats.shots:,} shots) in {elapsed:.2f} s: "
+          f"{stats.games / elapsed:,.0f} games/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+"""
+secure.py
+
+Optional encrypted transport for the binary protocol, keyed by a pre-shared key
+(`--psk FILE` for server.py and client.py). Standard library only.
+
+  - Handshake: PKT_HELLO packets, in the clear, before anything else on the
+    connection. Payloads start with a mode byte:
+        client  FULL      client nonce, DH share
+        server  FULL      server nonce, DH share, proof, ticket
+        client  FINISHED  proof (the client's first encrypted packet)
+    The DH shares are ephemeral (RFC 3526 group 14), so traffic recorded now
+    stays secret if the key leaks later. The master secret mixes the DH result
+    with the PSK: only key holders arrive at it, and each side's proof (a MAC
+    under it) shows the other one that it did.
+  - Resumption: the ticket is the master secret and its issue time, sealed
+    under a key derived from the PSK (so every worker, and a restarted server,
+    can open it). A reconnecting client that kept the Session sends
+        client  RESUME    client nonce, ticket
+        server  RESUMED   server nonce, proof      (REJECTED: do a full one)
+        client  FINISHED  proof
+    and both derive fresh traffic keys from the master secret and the new
+    nonces. That skips the DH, whose modexps are nearly all of a full
+    handshake's cost; resumed sessions don't get forward secrecy of their
+    own. Tickets are good for TICKET_LIFETIME.
+  - Packets: the header stays in the clear. The payload is XORed with a
+    SHAKE-256 keystream keyed by the direction's key and the packet's sequence
+    number, and followed by a 16-byte keyed BLAKE2b tag over version, type,
+    seq, length and ciphertext (length counts the tag). PacketWriter encrypts
+    in its own buffer and PacketReader checks and decrypts in its receive
+    buffer (Cipher). A packet that fails the tag is counted as forged and
+    dropped before its sequence number is looked at; since that number is
+    authenticated, the reader's existing check drops replays. A direction
+    stops at 2**32 - 1 packets rather than reuse a keystream (reconnect).
+
+The spectator port and the text protocol stay in the clear.
+
+Run `python secure.py` for handshake and resumed-handshake times and the
+per-packet cost against plaintext.
+"""
+
+import hashlib
+import hmac
+import secrets
+import socket
+import struct
+import time
+
+from metrics import counter
+from protocol import HEADER, PKT_HELLO, TAG, PacketReader, PacketWriter
+
+NONCE = 16
+TICKET_LIFETIME = 24 * 3600  # seconds
+HANDSHAKE_TIMEOUT = 5.0
+
+FULL, RESUME, FINISHED = 0, 1, 3
+RESUMED, REJECTED = 1, 2  # server replies to RESUME
+
+# RFC 3526 group 14: 2048-bit MODP, generator 2
+P = int(
+    "FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74"
+    "020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F1437"
+    "4FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED"
+    "EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF05"
+    "98DA48361C55D39A69163FA8FD24CF5F83655D23DCA3AD961C62F356208552BB"
+    "9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B"
+    "E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF6955817183"
+    "995497CEA956AE515D2261898FA051015728E5A8AACAA68FFFFFFFFFFFFFFFF", 16)
+SHARE = 256  # bytes of a DH share
+EXPONENT_BITS = 256
+
+HANDSHAKES = counter("battleship_handshakes_total", "Completed full (DH) handshakes")
+RESUMPTIONS = counter("battleship_resumed_handshakes_total", "Completed handshakes that resumed a session ticket")
+
+_ISSUED = struct.Struct('!Q')
+_LAST_SEQ = 0xFFFFFFFF
+
+
+class HandshakeError(ConnectionError):
+    pass
+
+
+def _hkdf(secret, salt, info, length):
+    """HKDF-SHA256 (RFC 5869)."""
+    prk = hmac.digest(salt, secret, 'sha256')
+    out, block = b'', b''
+    i = 1
+    while len(out) < length:
+        block = hmac.digest(prk, block + info + bytes((i,)), 'sha256')
+        out += block
+        i += 1
+    return out[:length]
+
+
+def _xor(data, stream):
+    n = len(data)
+    return (int.from_bytes(data, 'little') ^ int.from_bytes(stream, 'little')).to_bytes(n, 'little')
+
+
+class Cipher:
+    """
+    One direction of a session: seal() on the sending side (PacketWriter.cipher),
+    open() on the receiving side (PacketReader.cipher). Both work in place on
+    the caller's buffer, where the packet starts with its header.
+    """
+    __slots__ = ('key', 'mac_key')
+
+    def __init__(self, key, mac_key):
+        self.key = key
+        self.mac_key = mac_key
+
+    def seal(self, buf, view, seq, end):
+        """Encrypt buf[HEADER.size:end] and append the tag (the header's length must count it). Returns the new end."""
+        if seq == _LAST_SEQ:
+            raise ConnectionError("sequence numbers exhausted; reconnect for new keys")
+        n = end - HEADER.size
+        if n:
+            stream = hashlib.shake_256(self.key + seq.to_bytes(4, 'big')).digest(n)
+            buf[HEADER.size:end] = _xor(view[HEADER.size:end], stream)
+        buf[end:end + TAG] = hashlib.blake2b(view[6:end], key=self.mac_key, digest_size=TAG).digest()
+        return end + TAG
+
+    def open(self, buf, view, start, end, seq):
+        """Check the tag of the packet at buf[start:end] and decrypt its payload in place. False if forged."""
+        body, tag_at = start + HEADER.size, end - TAG
+        if tag_at < body:
+            return False
+        tag = hashlib.blake2b(view[start + 6:tag_at], key=self.mac_key, digest_size=TAG).digest()
+        if not hmac.compare_digest(tag, view[tag_at:end]):
+            return False
+        if tag_at > body:
+            stream = hashlib.shake_256(self.key + seq.to_bytes(4, 'big')).digest(tag_at - body)
+            buf[body:tag_at] = _xor(view[body:tag_at], stream)
+        return True
+
+    def export(self):
+        """JSON-friendly keys, for moving the connection to another process (Cipher.restore)."""
+        return (self.key + self.mac_key).hex()
+
+    @classmethod
+    def restore(cls, exported):
+        keys = bytes.fromhex(exported)
+        return cls(keys[:32], keys[32:])
+
+
+class PresharedKey:
+    """The shared key, and the server's ticket keys derived from it."""
+
+    def __init__(self, psk):
+        if len(psk) < 16:
+            raise ValueError("pre-shared key must be at least 16 bytes")
+        self.psk = psk
+        keys = _hkdf(psk, b'', b'battleship tickets', 64)
+        self._ticket_key, self._ticket_mac = keys[:32], keys[32:]
+
+    @classmethod
+    def load(cls, path):
+        """From a key file: its contents, surrounding whitespace stripped."""
+        with open(path, 'rb') as f:
+            return cls(f.read().strip())
+
+    def issue(self, master):
+        nonce = secrets.token_bytes(NONCE)
+        plain = _ISSUED.pack(int(time.time())) + master
+        sealed = nonce + _xor(plain, hashlib.shake_256(self._ticket_key + nonce).digest(len(plain)))
+        return sealed + hashlib.blake2b(sealed, key=self._ticket_mac, digest_size=TAG).digest()
+
+    def redeem(self, ticket):
+        """The master secret in a ticket, or None if it isn't ours or has expired."""
+        if len(ticket) != NONCE + _ISSUED.size + 32 + TAG:
+            return None
+        sealed, tag = ticket[:-TAG], ticket[-TAG:]
+        if not hmac.compare_digest(tag, hashlib.blake2b(sealed, key=self._ticket_mac, digest_size=TAG).digest()):
+            return None
+        nonce, body = sealed[:NONCE], sealed[NONCE:]
+        plain = _xor(body, hashlib.shake_256(self._ticket_key + nonce).digest(len(body)))
+        issued, = _ISSUED.unpack_from(plain)
+        if not 0 <= time.time() - issued < TICKET_LIFETIME:
+            return None
+        return plain[_ISSUED.size:]
+
+
+class Session:
+    """What a client keeps to resume: the master secret and the server's ticket for it."""
+
+    def __init__(self, master, ticket, resumed=False):
+        self.master = master
+        self.ticket = ticket
+        self.resumed = resumed  # this connection skipped the DH
+
+    def dump(self):
+        return self.master + self.ticket
+
+    @classmethod
+    def load(cls, data):
+        return cls(data[:32], data[32:])
+
+
+def _keys(master, transcript):
+    """(client -> server Cipher, server -> client Cipher, client proof, server proof)."""
+    k = _hkdf(master, transcript, b'battleship traffic', 128)
+    return (Cipher(k[0:32], k[32:64]), Cipher(k[64:96], k[96:128]),
+            hmac.digest(master, b'client finished' + transcript, 'sha256'),
+            hmac.digest(master, b'server finished' + transcript, 'sha256'))
+
+
+def _dh():
+    secret = secrets.randbits(EXPONENT_BITS)
+    return secret, pow(2, secret, P).to_bytes(SHARE, 'big')
+
+
+def _dh_finish(secret, peer_share):
+    peer = int.from_bytes(peer_share, 'big')
+    if not 1 < peer < P - 1:
+        raise HandshakeError("bad DH share")
+    return pow(peer, secret, P).to_bytes(SHARE, 'big')
+
+
+def _full_master(psk, shared, transcript):
+    return _hkdf(psk + shared, transcript, b'battleship master', 32)
+
+
+def _read_hello(sock, reader, deadline):
+    """The next HELLO packet's payload (bytes). Anything else before it is a protocol error."""
+    while True:
+        packet = reader.next_packet()
+        if packet is not None:
+            ptype, _, payload = packet
+            if ptype != PKT_HELLO or not payload:
+                raise HandshakeError("expected a HELLO packet")
+            return bytes(payload)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise HandshakeError("handshake timed out")
+        sock.settimeout(remaining)
+        try:
+            if reader.recv_from(sock) == 0:
+                raise HandshakeError("peer closed during the handshake")
+        except socket.timeout:
+            raise HandshakeError("handshake timed out") from None
+
+
+def accept(sock, reader, writer, key, timeout=HANDSHAKE_TIMEOUT):
+    """
+    Server side. Runs the handshake on a new binary connection and installs the
+    session's ciphers on its reader and writer. Raises HandshakeError.
+    """
+    deadline = time.monotonic() + timeout
+    saved = sock.gettimeout()
+    try:
+        hello = _read_hello(sock, reader, deadline)
+        mode, nc = hello[0], hello[1:1 + NONCE]
+        ns = secrets.token_bytes(NONCE)
+        master = None
+        if mode == RESUME:
+            ticket = hello[1 + NONCE:]
+            master = key.redeem(ticket)
+            if master is None:
+                writer.send(PKT_HELLO, bytes((REJECTED,)))
+                hello = _read_hello(sock, reader, deadline)  # the client falls back to a full handshake
+                mode, nc = hello[0], hello[1:1 + NONCE]
+            else:
+                transcript = hashlib.sha256(nc + ticket + ns).digest()
+                c2s, s2c, client_proof, server_proof = _keys(master, transcript)
+                writer.send(PKT_HELLO, bytes((RESUMED,)) + ns + server_proof)
+        if master is None:
+            share = hello[1 + NONCE:]
+            if mode != FULL or len(nc) != NONCE or len(share) != SHARE:
+                raise HandshakeError("malformed HELLO")
+            secret, ours = _dh()
+            transcript = hashlib.sha256(nc + share + ns + ours).digest()
+            master = _full_master(key.psk, _dh_finish(secret, share), transcript)
+            c2s, s2c, client_proof, server_proof = _keys(master, transcript)
+            writer.send(PKT_HELLO, bytes((FULL,)) + ns + ours + server_proof + key.issue(master))
+
+        reader.cipher, writer.cipher = c2s, s2c
+        # The client's proof comes encrypted; a client without the key can't send it
+        finished = _read_hello(sock, reader, deadline)
+        if finished[0] != FINISHED or not hmac.compare_digest(finished[1:], client_proof):
+            raise HandshakeError("client proof did not verify")
+        (RESUMPTIONS if mode == RESUME else HANDSHAKES).inc()
+    finally:
+        sock.settimeout(saved)
+
+
+def connect(sock, reader, writer, key, session=None, timeout=HANDSHAKE_TIMEOUT):
+    """
+    Client side: resumes `session` if the server still takes its ticket, else
+    runs a full handshake. Installs the ciphers and returns the Session to
+    resume next time. Raises HandshakeError.
+    """
+    deadline = time.monotonic() + timeout
+    saved = sock.gettimeout()
+    try:
+        if session is not None:
+            nc = secrets.token_bytes(NONCE)
+            writer.send(PKT_HELLO, bytes((RESUME,)) + nc + session.ticket)
+            reply = _read_hello(sock, reader, deadline)
+            if reply[0] == RESUMED:
+                ns, proof = reply[1:1 + NONCE], reply[1 + NONCE:]
+                transcript = hashlib.sha256(nc + session.ticket + ns).digest()
+                c2s, s2c, client_proof, server_proof = _keys(session.master, transcript)
+                if not hmac.compare_digest(proof, server_proof):
+                    raise HandshakeError("server proof did not verify")
+                reader.cipher, writer.cipher = s2c, c2s
+                writer.send(PKT_HELLO, bytes((FINISHED,)) + client_proof)
+                return Session(session.master, session.ticket, resumed=True)
+            if reply[0] != REJECTED:
+                raise HandshakeError("unexpected reply to RESUME")
+
+        nc = secrets.token_bytes(NONCE)
+        secret, ours = _dh()
+        writer.send(PKT_HELLO, bytes((FULL,)) + nc + ours)
+        reply = _read_hello(sock, reader, deadline)
+        at = 1 + NONCE
+        ns, share, proof, ticket = reply[1:at], reply[at:at + SHARE], reply[at + SHARE:at + SHARE + 32], reply[at + SHARE + 32:]
+        if reply[0] != FULL or len(share) != SHARE or len(proof) != 32:
+            raise HandshakeError("malformed HELLO")
+        transcript = hashlib.sha256(nc + ours + ns + share).digest()
+        master = _full_master(key.psk, _dh_finish(secret, share), transcript)
+        c2s, s2c, client_proof, server_proof = _keys(master, transcript)
+        if not hmac.compare_digest(proof, server_proof):
+            raise HandshakeError("server proof did not verify (different key?)")
+        reader.cipher, writer.cipher = s2c, c2s
+        writer.send(PKT_HELLO, bytes((FINISHED,)) + client_proof)
+        return Session(master, ticket)
+    finally:
+        sock.settimeout(saved)
+
+
+def _benchmark(n=200):
+    import threading
+
+    key = PresharedKey(secrets.token_bytes(32))
+
+    def handshake(session=None):
+        a, b = socket.socketpair()
+        with a, b:
+            server = threading.Thread(target=accept, args=(b, PacketReader(), PacketWriter(b), key))
+            server.start()
+            result = connect(a, PacketReader(), PacketWriter(a), key, session)
+            server.join()
+        return result
+
+    session = handshake()
+    for label, arg in (("full handshake:   ", None), ("resumed handshake:", session)):
+        start = time.perf_counter()
+        for _ in range(n):
+            resumed = handshake(arg).resumed
+        assert resumed == (arg is not None)
+        print(f"{label} {(time.perf_counter() - start) / n * 1e3:6.2f} ms  (both sides, socketpair)")
+
+    # Per-packet cost: build one packet and parse it back, plaintext vs encrypted
+    c2s, _, _, _ = _keys(secrets.token_bytes(32), b'bench')
+    prompt = b"Your turn! Enter coordinate to fire at (or 'quit'):"
+    m = 50_000
+    for label, cipher in (("plaintext", None), ("encrypted", c2s)):
+        for payload in (bytes((1, 4)), prompt):
+            writer, reader = PacketWriter(None), PacketReader()
+            writer.cipher = reader.cipher = cipher
+            start = time.perf_counter()
+            for _ in range(m):
+                reader.feed(writer.encode(2, payload))
+                reader.next_packet()
+            per = (time.perf_counter() - start) / m * 1e6
+            size = len(writer.encode(2, payload))
+            print(f"{label} {len(payload):3d}-byte payload: {size:3d} B on the wire, {per:5.2f} us encode + parse")
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -1,106 +1,243 @@
 import threading
+import select
 import socket
-from battleship import run_single_player_game_online, Board, parse_coordinate, TwoPlayerGame, SHIPS
-
-#Turn to true for testing.
-TEST_MODE = False
-
-
-HOST = '127.0.0.1'
-PORT = 5001
+import sys
+import time
+from battleship import (run_single_player_game_online, parse_coordinate, format_coordinate, BOARD_SIZE as
+                        STANDARD_SIZE, VIEWPORT, render_grid, view, fleet)
+from ai import AIConnection
+from broadcast import Broadcaster, BroadcastHub
+from chat import ChatRoom
+from config import (TEST_MODE, HELLO_WAIT, LOG_LEVEL, HOST, PORT, BINARY_PORT, SPECTATOR_PORT, STATS_PORT,
+                    raise_fd_limit)
+from gamepool import GamePool
+from matchmaking import Matchmaker, LobbyWatcher
+from protocol import TextConnection, BinaryConnection, MAX_PACKET, TAG
+from journal import Journal
+from logs import log, setup as setup_logging
+from metrics import counter, gauge, histogram, StatsServer
+from replay import ReplayWriter, MatchRecord, WIN, QUIT, DISCONNECT, TIMEOUT, NO_WINNER
+from sessions import SessionStore
+from timers import TimerWheel
+import secure
+import tracing
+
+# Seconds a player may take over each ship placement or turn before forfeiting the match
+INACTIVITY_TIMEOUT = 30
+
+# Seconds a disconnected player has to reconnect (RESUME <token>) before forfeiting
+RESUME_GRACE = 60
+
+# Seconds a lone player waits in the lobby before playing the house bot (ai.py);
+# None disables it. Set with `--house-bot SECONDS` (read here so forked workers see it too).
+HOUSE_BOT_WAIT = float(sys.argv[sys.argv.index("--house-bot") + 1]) if "--house-bot" in sys.argv else None
+
+# Directory for the move journal (journal.py); None runs without one. Set with `--journal DIR`.
+# Matches that were in progress when the server stopped are restarted from it.
+JOURNAL_DIR = sys.argv[sys.argv.index("--journal") + 1] if "--journal" in sys.argv else None
+
+# Replay file that finished matches are appended to (replay.py); None records nothing.
+# Set with `--replays FILE`. Buffered games are written out every REPLAY_FLUSH seconds.
+REPLAY_PATH = sys.argv[sys.argv.index("--replays") + 1] if "--replays" in sys.argv else None
+REPLAY_FLUSH = 30
+
+# Span trace file (tracing.py); None traces nothing. Set with `--trace FILE`; one match in
+# TRACE_EVERY is traced (`--trace-every N`). Read it with `python tracing.py FILE`.
+TRACE_PATH = sys.argv[sys.argv.index("--trace") + 1] if "--trace" in sys.argv else None
+TRACE_EVERY = int(sys.argv[sys.argv.index("--trace-every") + 1]) if "--trace-every" in sys.argv else 1
+
+# Board size and fleet: `--board-size N` (default 10) and `--fleets K`, the standard fleet K
+# times over, for big-board events. Boards over battleship.VIEWPORT are shown a window at a time.
+BOARD_SIZE = int(sys.argv[sys.argv.index("--board-size") + 1]) if "--board-size" in sys.argv else (2 if TEST_MODE else STANDARD_SIZE)
+FLEET = [("TestShip", 1)] if TEST_MODE else fleet(int(sys.argv[sys.argv.index("--fleets") + 1]) if "--fleets" in sys.argv else 1)
+# Journal and replay records hold rows, columns and ship numbers in a byte each
+RECORDABLE = BOARD_SIZE <= 255 and len(FLEET) <= 255
+# Longest packet a binary client may send: a FLEET line with every ship at the longest coordinate
+BINARY_INPUT_LIMIT = max(MAX_PACKET, len("FLEET") + TAG +
+                         len(FLEET) * len(f" {format_coordinate(BOARD_SIZE - 1, BOARD_SIZE - 1)} H"))
+# Biggest board the house bot plays on: its placement tables grow with the area
+HOUSE_BOT_MAX_SIZE = 100
+
+# Pre-shared key file for the encrypted binary protocol (secure.py); None runs it in the clear.
+# Set with `--psk FILE`: binary-port clients must then complete the handshake first.
+PSK_PATH = sys.argv[sys.argv.index("--psk") + 1] if "--psk" in sys.argv else None
+
+SEND_BUFFER = 64 * 1024  # SO_SNDBUF of game connections; a turn is well under 1 KiB
 
 clients = []
 clients_lock = threading.Lock()
 
-waiting_clients = []
-waiting_lock = threading.Lock()
-
-def handle_incoming_client(conn, addr):
+matchmaker = Matchmaker()
+lobby_watcher = LobbyWatcher(matchmaker)
+
+# Every inactivity deadline on the server lives on this one wheel
+timeouts = TimerWheel()
+sessions = SessionStore(timeouts, grace=RESUME_GRACE)
+journal = None  # opened by main() when JOURNAL_DIR is set
+replays = None  # opened by main() when REPLAY_PATH is set
+psk = None  # secure.PresharedKey, loaded by main() when PSK_PATH is set
+# Games of ended matches, reset and handed to the next ones (gamepool.py)
+game_pool = GamePool()
+
+# CHAT <message> from players and spectators, to all of them (chat.py)
+chat = ChatRoom()
+
+spectator_hub = BroadcastHub(chat=chat)
+spectator_lock = threading.Lock()
+latest_broadcaster = None
+
+CONNECTIONS = counter("battleship_connections_accepted_total", "Client connections accepted on the game ports")
+LOBBY_WAITING = gauge("battleship_lobby_waiting", "Players waiting in the lobby",
+                      read=lambda: matchmaker.stats()['waiting'])
+ACTIVE_GAMES = gauge("battleship_active_games", "Matches in progress")
+PLACEMENT_SECONDS = histogram("battleship_placement_seconds", "Time a player takes to place their whole fleet")
+TURN_SECONDS = histogram("battleship_turn_seconds", "Server time from receiving a shot to sending its result")
+
+def read_resume_token(player, conn):
+    """
+    Read the client's first line: `RESUME <token>` from a reconnecting client,
+    HELLO from any other. Anything else arriving this early would be discarded
+    by the lobby anyway.
+    """
+    poller = select.poll()  # not select.select(): descriptors go past FD_SETSIZE with many spectators
+    poller.register(conn, select.POLLIN)
+    reader = getattr(player, 'reader', None)
+    # An encrypted client's first line may have come in with the end of its handshake
+    if not (reader is not None and reader.pending()) and not poller.poll(HELLO_WAIT * 1000):
+        return None
+    line = player.recv()
+    if line and line.upper().startswith("RESUME "):
+        return line.split(None, 1)[1].strip()
+    return None
+
+def binary_connection(conn):
+    """A BinaryConnection that takes this server's longest FLEET line (BINARY_INPUT_LIMIT)."""
+    return BinaryConnection(conn, max_payload=BINARY_INPUT_LIMIT)
+
+def handle_incoming_client(conn, addr, conn_cls=TextConnection):
     try:
-        rfile = conn.makefile('r')
-        wfile = conn.makefile('w')
-        print(f"[INFO] Client joined: {addr}")
-        lobby_loop(rfile, wfile, conn)
+        connection = conn_cls(conn)
+        if psk is not None and connection.binary:
+            secure.accept(conn, connection.reader, connection.writer, psk)
+        token = read_resume_token(connection, conn)
+        if token is not None:
+            if sessions.resume(token, connection):
+                # The suspended game's thread picks the player up from here
+                log.info("Client resumed a session: %s", addr)
+                return
+            connection.send("Unknown or expired session; starting a new one.")
+        player = sessions.open(connection)
+        log.info("Client joined: %s%s", addr, " (binary)" if player.binary else "")
+        player.send(f"Session token: {player.token} (reconnect with RESUME <token> to rejoin a dropped game)")
+        history = chat.history()
+        if history:
+            player.send(history)
+        lobby_loop(player)
+    except secure.HandshakeError as e:
+        log.info("Handshake with %s failed: %s", addr, e)
+        conn.close()
     except Exception as e:
-        print(f"[ERROR] Client setup failed: {e}")
+        log.error("Client setup failed: %s", e)
         try: conn.close()
         except: pass
 
-def start_match_if_possible():
-    with waiting_lock:
-        if len(waiting_clients) >= 2:
-            client1 = waiting_clients.pop(0)
-            client2 = waiting_clients.pop(0)
-
-            rfile1, wfile1, conn1 = client1
-            rfile2, wfile2, conn2 = client2
-
-            print("[INFO] Starting a new game")
-
-            def game_and_return_to_lobby():
-                run_two_player_game_online(rfile1, wfile1, rfile2, wfile2)
-                lobby_loop(rfile1, wfile1, conn1)
-                lobby_loop(rfile2, wfile2, conn2)
-
-            threading.Thread(target=game_and_return_to_lobby, daemon=True).start()
-
-
-
-def run_two_player_game_online(rfile1, wfile1, rfile2, wfile2):
-    
-    test_ships = [("TestShip", 1)] if TEST_MODE else SHIPS
-    
-
-    game = TwoPlayerGame()
-    rfiles = [rfile1, rfile2]
-    wfiles = [wfile1, wfile2]
-
-    def send(wfile, msg):
-        wfile.write(msg + '\n')
-        wfile.flush()
-
-    def send_board(wfile, board_grid):
-        wfile.write("GRID\n")
-        wfile.write("  " + " ".join(str(i + 1).rjust(2) for i in range(10)) + '\n')
-        for r in range(10):
-            row_label = chr(ord('A') + r)
-            row_str = " ".join(board_grid[r][c] for c in range(10))
-            wfile.write(f"{row_label:2} {row_str}\n")
-        wfile.write('\n')
-        wfile.flush()
-        
-    def send_player_board(wfile, board):
-        wfile.write("Your current board:\n")
-        wfile.write("GRID\n")
-        wfile.write("  " + " ".join(str(i + 1).rjust(2) for i in range(board.size)) + '\n')
-        for r in range(board.size):
-            row_label = chr(ord('A') + r)
-            row_str = " ".join(board.hidden_grid[r][c] for c in range(board.size))
-            wfile.write(f"{row_label:2} {row_str}\n")
-        wfile.write('\n')
-        wfile.flush()
-    
+def send_snapshot(p, game, player_index, focus=None):
+    """Bring a reconnected player up to date from the current boards, not from history."""
+    p.send("Reconnected to your game.")
+    grid, origin = view(game.player_boards[player_index], hidden=True)
+    p.send_board(grid, own=True, origin=origin)
+    if all(game.ships_placed):
+        p.send_target_board(*view(game.player_boards[1 - player_index], focus))
+
+def run_two_player_game_online(player1, player2, game=None):
+    """
+    Run one match between two players (sessions.Seat, or any connection with the
+    same interface, e.g. protocol.TextConnection or ai.AIConnection). A Seat that
+    drops is given RESUME_GRACE seconds to reconnect before it forfeits.
+    Matches between two Seats are journaled if there is a journal; `game` is a
+    match recovered from it, picked up where it stopped.
+    """
+    players = [player1, player2]
+    ACTIVE_GAMES.inc()
+    # Matches recovered from the journal aren't recorded: their earlier moves weren't seen here
+    record = MatchRecord(len(FLEET)) if replays is not None and game is None else None
+    if game is None:
+        game = game_pool.acquire(size=BOARD_SIZE)
+        if journal is not None and all(hasattr(p, 'token') for p in players):
+            game.game_id = journal.new_game([p.token for p in players])
+    for p in players:
+        p.new_match()
+    game.broadcaster = start_spectator_stream(game)
+    spectate = lambda msg: game.broadcaster.publish((msg + '\n').encode())
+
+    # One deadline per player, pushed back after each valid placement or shot.
+    # Expiry interrupts the player's blocked recv(), which then returns None.
+    timed_out = [False, False]
+    def on_idle(player_index):
+        timed_out[player_index] = True
+        players[player_index].interrupt()
+    deadlines = [timeouts.schedule(INACTIVITY_TIMEOUT, on_idle, i) for i in [0, 1]]
+    # Where on the opponent's board each player is looking (big boards: see battleship.view)
+    focus = [None, None]
+
+    def wait_for_resume(player_index):
+        """A player's connection dropped: hold their place (and pause their clock) until they're back."""
+        p = players[player_index]
+        if timed_out[player_index] or not hasattr(p, 'wait_for_resume'):
+            return False
+        deadlines[player_index].cancel()
+        log.info("Player %d dropped; holding the game for %ss", player_index + 1, RESUME_GRACE)
+        players[1 - player_index].send(f"Opponent disconnected. Waiting up to {RESUME_GRACE} seconds for them to reconnect...")
+        players[1 - player_index].flush()  # now, not when they're next asked for input
+        spectate(f"Player {player_index + 1} disconnected. Waiting for them to reconnect...")
+        if not p.wait_for_resume():
+            return False
+        p.cork()  # the new connection, like the one it replaces
+        send_snapshot(p, game, player_index, focus[player_index])
+        players[1 - player_index].send("Opponent reconnected.")
+        players[1 - player_index].flush()
+        spectate(f"Player {player_index + 1} reconnected.")
+        deadlines[player_index].reschedule(INACTIVITY_TIMEOUT)
+        return True
 
     # Step 1: Manual ship placement (parallel threads)
     def prompt_placement(player_index):
-        w = wfiles[player_index]
-        r = rfiles[player_index]
+        p = players[player_index]
+        if game.ships_placed[player_index]:
+            return  # recovered match
 
-        send(w, f"Welcome Player {player_index + 1}! Let's place your ships.")
+        p.send(f"Welcome Player {player_index + 1}! Let's place your ships.")
+        started = time.monotonic()
         board = game.player_boards[player_index]
         
-        send(w, "Your board is empty. Here's what it looks like now:")
-        send_player_board(w, board)
-
-        for ship_name, ship_size in test_ships:
+        p.send("Your board is empty. Here's what it looks like now:")
+        grid, origin = view(board, hidden=True)
+        p.send_board(grid, own=True, origin=origin)
+        p.send("Or place them all in one line: FLEET, then a coordinate and H or V for each ship in the order "
+               "they are asked for (FLEET A1 H C3 V ...), or FLEET RANDOM.")
+
+        already = len(board.placed_ships)  # placed before a restart
+        for ship_index, (ship_name, ship_size) in enumerate(FLEET):
+            if ship_index < already or game.ships_placed[player_index]:
+                continue
             while True:
                 try:
-                    send(w, f"Place your {ship_name} (size {ship_size})")
-                    send(w, "Enter starting coordinate (e.g. A1):")
-                    coord = r.readline().strip()
+                    p.send(f"Place your {ship_name} (size {ship_size})")
+                    p.send("Enter starting coordinate (e.g. A1):")
+                    coord = p.recv()
+                    words = coord.split() if coord is not None else ()
+                    if words and words[0].upper() == "FLEET":
+                        if place_fleet(player_index, ship_index, words[1:]):
+                            break
+                        continue
 
-                    send(w, "Enter orientation (H for horizontal, V for vertical):")
-                    orient = r.readline().strip().upper()
+                    p.send("Enter orientation (H for horizontal, V for vertical):")
+                    orient = p.recv() if coord is not None else None
+                    if coord is None or orient is None:
+                        if wait_for_resume(player_index):
+                            continue  # ask for this ship again
+                        return  # disconnected; ships_placed stays False
+                    orient = orient.upper()
 
                     # Validate and place immediately
                     row, col = parse_coordinate(coord)
@@ -109,33 +246,68 @@ def run_two_player_game_online(rfile1, wfile1, rfile2, wfile2):
                     elif orient == 'V':
                         orientation = 1
                     else:
-                        send(w, "Invalid orientation. Please enter H or V.")
+                        p.send("Invalid orientation. Please enter H or V.")
                         continue
 
                     if not board.can_place_ship(row, col, ship_size, orientation):
-                        send(w, f"Cannot place {ship_name} at {coord} with orientation {orient}. Try again.")
+                        p.send(f"Cannot place {ship_name} at {coord} with orientation {orient}. Try again.")
                         continue
 
-                    occupied = board.do_place_ship(row, col, ship_size, orientation)
-                    board.placed_ships.append({
-                        'name': ship_name,
-                        'positions': occupied
-                    })
-                    send(w, f"{ship_name} placed successfully.")
-                    send_player_board(w, board)
+                    board.add_ship(ship_name, row, col, ship_size, orientation)
+                    if game.game_id is not None:
+                        journal.place(game.game_id, player_index, ship_index, row, col, orientation)
+                    if record is not None:
+                        record.place(player_index, ship_index, row, col, orientation)
+                    deadlines[player_index].reschedule(INACTIVITY_TIMEOUT)
+                    p.send(f"{ship_name} placed successfully.")
+                    grid, origin = view(board, (row, col), hidden=True)
+                    p.send_board(grid, own=True, origin=origin)
                     break  # Ship placed successfully
 
+                except OSError:
+                    return
                 except Exception as e:
-                    send(w, f"Error: {e}. Try again.")
+                    p.send(f"Error: {e}. Try again.")
 
         game.ships_placed[player_index] = True
-        send(w, "All ships placed successfully. Waiting for opponent...\n")
-
+        deadlines[player_index].cancel()
+        PLACEMENT_SECONDS.observe(time.monotonic() - started)
+        p.send("All ships placed successfully. Waiting for opponent...\n")
+
+
+    def place_fleet(player_index, first, args):
+        """FLEET: the ships from FLEET[first] on, all in one message (TwoPlayerGame.place_fleet). True if placed."""
+        p = players[player_index]
+        placed, result = game.place_fleet(player_index, args, FLEET[first:])
+        if not placed:
+            p.send(f"Fleet not placed ({len(result)} problem{'s' if len(result) > 1 else ''}):")
+            for error in result:
+                p.send(f"  {error}")
+            return False
+        last = first + len(result) - 1
+        for ship_index, (row, col, orientation) in enumerate(result, first):
+            if game.game_id is not None:
+                journal.place(game.game_id, player_index, ship_index, row, col, orientation, wait=ship_index == last)
+            if record is not None:
+                record.place(player_index, ship_index, row, col, orientation)
+        p.send(f"{len(result)} ships placed.")
+        grid, origin = view(game.player_boards[player_index], hidden=True)
+        p.send_board(grid, own=True, origin=origin)
+        return True
+
+    def place(player_index):
+        # Each placement step (result, board, next prompt) goes out in one write, when input is wanted
+        players[player_index].cork()
+        try:
+            prompt_placement(player_index)
+        finally:
+            players[player_index].uncork()
 
     # Launch placement in parallel threads
+    tracing.phase("placement")
     threads = []
     for i in [0, 1]:
-        t = threading.Thread(target=prompt_placement, args=(i,))
+        t = threading.Thread(target=tracing.bind(place, "match", "placement"), args=(i,))
         t.start()
         threads.append(t)
 
@@ -144,65 +316,212 @@ def run_two_player_game_online(rfile1, wfile1, rfile2, wfile2):
 
     if not all(game.ships_placed):
         # One player failed placement; end session
-        for w in wfiles:
-            send(w, "Game could not start due to ship placement error.")
+        for d in deadlines:
+            d.cancel()
+        if game.game_id is not None:
+            journal.end_game(game.game_id)
+        for i, p in enumerate(players):
+            if hasattr(p, 'end_match'):
+                p.end_match()
+            try:
+                if timed_out[i]:
+                    p.send(f"You did not place your ships within {INACTIVITY_TIMEOUT} seconds.")
+                p.send("Game could not start due to ship placement error.")
+            except OSError:
+                pass
+        game.broadcaster.close(b"Match abandoned during ship placement.\n")
+        ACTIVE_GAMES.dec()
+        retire_game(game)
         return
 
     # Step 2: Start game
-    for w in wfiles:
-        send(w, "Both players ready! Game begins.")
+    # Corked for the whole turn loop: a player's output leaves in one write per turn,
+    # when they're asked to fire (recv flushes) or, for the shooter, after the result
+    for p in players:
+        p.cork()
+        p.send("Both players ready! Game begins.")
+        if game.size > VIEWPORT:
+            p.send(f"The board is {game.size}x{game.size}: you see {VIEWPORT}x{VIEWPORT} of it, around your last "
+                   "shot. Type VIEW <coordinate> to look somewhere else.")
+    for p in players:
+        p.flush()  # now: the second player would otherwise hear nothing until the first one fires
+    spectate("Both players ready! Game begins.")
 
     # Turn loop
-    print("[DEBUG] Entering game loop... active =", game.active)
+    tracing.phase("turns")
+    log.debug("Entering game loop... active = %s", game.active)
+    ending = (DISCONNECT, NO_WINNER)  # (how, winner) for the replay
     while game.active:
         try:
             current = game.get_current_player_index()
             opponent = game.get_opponent_index()
-            r = rfiles[current]
-            w = wfiles[current]
-            opp_w = wfiles[opponent]
-
-            # Show opponent board
-            send_board(w, game.get_visible_board_for_player(current))
-            send(w, "Your turn! Enter coordinate to fire at (or 'quit'):")
-
-            move = r.readline()
-            if not move:
-                send(w, "Disconnected.")
-                send(opp_w, "Opponent disconnected. You win!")
+            p = players[current]
+            opp = players[opponent]
+
+            # Show opponent board (a snapshot once, then deltas, for binary clients; big boards a window)
+            p.send_target_board(*view(game.player_boards[opponent], focus[current]))
+            p.send("Your turn! Enter coordinate to fire at (or 'quit'):")
+
+            if not deadlines[current].active:  # re-prompts after invalid input keep the clock running
+                deadlines[current].reschedule(INACTIVITY_TIMEOUT)
+            move = p.recv()
+            received = time.perf_counter()
+            if move is None and timed_out[current]:
+                p.send(f"No move within {INACTIVITY_TIMEOUT} seconds. You forfeit.")
+                opp.send("Opponent timed out. You win!")
+                spectate(f"Player {current + 1} timed out. Player {opponent + 1} wins!")
+                ending = (TIMEOUT, opponent)
+                break
+            if move is None and wait_for_resume(current):
+                continue  # same player's turn again, on the new connection
+            if move is None:
+                opp.send("Opponent disconnected. You win!")
+                spectate(f"Player {current + 1} disconnected. Player {opponent + 1} wins!")
+                ending = (DISCONNECT, opponent)
                 break
 
-            move = move.strip()
             if move.lower() == 'quit':
-                send(w, "You quit. Goodbye!")
-                send(opp_w, "Opponent quit. You win!")
+                p.send("You quit. Goodbye!")
+                opp.send("Opponent quit. You win!")
+                spectate(f"Player {current + 1} quit. Player {opponent + 1} wins!")
+                ending = (QUIT, opponent)
                 break
 
+            if move[:5].upper() == "VIEW ":
+                # Look at another part of the opponent's board; still this player's turn
+                try:
+                    focus[current] = parse_coordinate(move[5:])
+                except ValueError as e:
+                    p.send(f"Invalid coordinate: {e}")
+                continue
+
             result, sunk, game_over, message = game.fire(move)
+            if result != 'invalid':
+                deadlines[current].cancel()  # only valid moves stop the clock
+                row, col = focus[current] = parse_coordinate(move)
+                if game.game_id is not None:
+                    journal.fire(game.game_id, current, row, col)  # durable before anyone hears of it
+                if record is not None:
+                    record.shot(row, col, result, sunk)
+
+            if result in ('hit', 'miss'):
+                cell = game.player_boards[opponent].cell(row, col)
+                p.send_cells([(row, col, cell)])
+                opp.send_cells([(row, col, cell)], own=True)
 
             opponent_message = message.replace(" You win!", "")
 
-            send(w, message)  # Full message to current player
-            send(opp_w, f"Opponent fired at {move}: {opponent_message}")  # Cleaned message
+            p.send_result(result, sunk, game_over, message)  # Full result to current player
+            p.flush()  # the shooter is waiting on it; the rest of the turn needn't delay it
+            TURN_SECONDS.observe(time.perf_counter() - received)
+            opp.send(f"Opponent fired at {move}: {opponent_message}")  # Cleaned message
+            if result != 'invalid':
+                # Encoded once, whatever the number of spectators
+                spectate(f"Player {current + 1} fired at {move}: {opponent_message}\n"
+                         + render_grid(*view(game.player_boards[opponent], (row, col))).rstrip('\n'))
 
             if game_over:
-                send(w, "You win!")
-                send(opp_w, "You lose!")
+                p.send("You win!")
+                opp.send("You lose!")
+                spectate(f"Player {current + 1} wins!")
+                ending = (WIN, current)
                 break
+        except OSError as e:
+            log.error("Connection error in game loop: %s", e)
+            break
         except Exception as e:
-            print("[ERROR] Exception in game loop:", e)
+            log.error("Exception in game loop: %s", e)
+        finally:
+            players[current].flush()
+
+    for p in players:
+        p.uncork()
+    game.broadcaster.close(b"Match over. Waiting for the next match...\n")
+    ACTIVE_GAMES.dec()
+    for d in deadlines:
+        d.cancel()
+    if game.game_id is not None:
+        journal.end_game(game.game_id)
+    if record is not None:
+        how, winner = ending
+        replays.add(record, winner, how)
 
     # Clean up (optional)
-    for w in wfiles:
+    for i, p in enumerate(players):
+        if hasattr(p, 'end_match'):
+            p.end_match()  # no more resuming into this game
+        if timed_out[i]:
+            p.close()  # input side is shut; the lobby will drop this player
+            continue
         try:
-            w.write("Game over. Returning to the lobby...\n")
-            w.flush()
+            p.send("Game over. Returning to the lobby...")
         except:
             pass
-    
+    retire_game(game)
+
+
+def spectator_snapshot(game):
+    """Text that brings a new (or lagging) spectator up to date on a match."""
+    parts = []
+    if game.active and all(game.ships_placed):
+        parts.append(f"[Spectating] Player {game.current_turn + 1} to move.\n")
+    elif game.active:
+        parts.append("[Spectating] Players are placing their ships.\n")
+    else:
+        parts.append("[Spectating] Match over.\n")
+    for i, board in enumerate(game.player_boards):
+        parts.append(f"Player {i + 1}'s board:\n")
+        parts.append(render_grid(*view(board)))
+    return ''.join(parts).encode()
+
+def retire_game(game):
+    """The match is over: freeze what late spectators are shown of it, and give the game back to the pool."""
+    final = spectator_snapshot(game)
+    game.broadcaster.snapshot = lambda: final
+    game_pool.release(game)
+
+def start_spectator_stream(game):
+    """Create the match's Broadcaster, make it the one new spectators join, and move idle spectators onto it."""
+    global latest_broadcaster
+    broadcaster = Broadcaster(spectator_hub, lambda: spectator_snapshot(game))
+    with spectator_lock:
+        latest_broadcaster = broadcaster
+    spectator_hub.adopt_orphans(broadcaster)
+    broadcaster.publish(b"A new match is starting.\n")
+    return broadcaster
+
+def spectator_accept_loop(listener):
+    """Spectators never get a thread: the broadcast hub owns their sockets."""
+    global latest_broadcaster
+    while True:
+        conn, addr = listener.accept()
+        log.info("Spectator joined: %s", addr)
+        with spectator_lock:
+            if latest_broadcaster is None:
+                # Nothing to watch yet: park on a finished stream until a match starts
+                latest_broadcaster = Broadcaster(spectator_hub, lambda: b"No match in progress. Waiting for the next match...\n")
+                latest_broadcaster.closed = True
+            spectator_hub.subscribe(conn, latest_broadcaster)
+
+def deliver_chat(frame):
+    """A chat frame to every player (on the chat thread; sends never block). Spectators get it from the hub."""
+    for seat in sessions.seats():
+        seat.send(frame)
+
+def lobby_input(ticket, data):
+    """What a player sent while queued (lobby watcher thread): CHAT lines go on, the rest is dropped."""
+    player = ticket.player
+    # The connection keeps a line (or packet) cut off at the end of data for the next read
+    connection = player.connection
+    connection.feed(data)
+    lines = connection.lines
+    while lines:
+        line = lines.popleft()
+        if line[:5].upper() == "CHAT ":
+            chat.post(player, line[5:])
 
 def handle_client(conn, addr):
-    print(f"[INFO] Client connected from {addr}")
+    log.info("Client connected from %s", addr)
     with conn:
         rfile = conn.makefile('r')
         wfile = conn.makefile('w')
@@ -224,41 +543,168 @@ def handle_client(conn, addr):
         try:
             run_single_player_game_online(rfile, wfile)
         except Exception as e:
-            print(f"[ERROR] Exception while handling client {addr}: {e}")
+            log.error("Exception while handling client %s: %s", addr, e)
 
-    print(f"[INFO] Client {addr} disconnected.")
+    log.info("Client %s disconnected.", addr)
     
 
-def main():
-    print(f"[INFO] Server listening on {HOST}:{PORT}")
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.bind((HOST, PORT))
-        s.listen()
-
-        while True:
-            conn, addr = s.accept()
-            print(f"[INFO] New client from {addr}")
-            threading.Thread(target=handle_incoming_client, args=(conn, addr), daemon=True).start()
-
-def lobby_loop(rfile, wfile, conn):
+def open_listener(port, reuse_port=False):
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        # Several worker processes bind the same port; the kernel balances accepts
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    s.bind((HOST, port))
+    s.listen(1024)
+    return s
+
+def accept_loop(listener, conn_cls):
+    while True:
+        conn, addr = listener.accept()
+        # Each step's output is flushed as a whole (protocol.Output); Nagle would only delay it
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # A fixed kernel send buffer (autotuning grows it to megabytes), so what a client
+        # leaves unread is bounded by this plus protocol.HIGH_WATER
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+        CONNECTIONS.inc()
+        log.info("New client from %s", addr)
+        threading.Thread(target=handle_incoming_client, args=(conn, addr, conn_cls), daemon=True).start()
+
+def open_journal():
+    """
+    Open the journal in JOURNAL_DIR and restart the matches it has in progress.
+    Their players rejoin with the session tokens they were given before.
+    """
+    global journal
+    journal = Journal(JOURNAL_DIR)
+    recovered = journal.recover(ships=FLEET, size=BOARD_SIZE)
+    journal.start()
+    for game, tokens in recovered.values():
+        seats = [sessions.restore(token) for token in tokens]
+        threading.Thread(target=run_recovered_game, args=(game, seats), daemon=True).start()
+    log.info("Journal in %s: %d matches recovered", JOURNAL_DIR, len(recovered))
+
+def open_replays():
+    global replays
+    replays = ReplayWriter(REPLAY_PATH, BOARD_SIZE, FLEET)
+
+    def flush():
+        replays.flush()
+        timeouts.schedule(REPLAY_FLUSH, flush)
+    timeouts.schedule(REPLAY_FLUSH, flush)
+    log.info("Recording finished matches to %s", REPLAY_PATH)
+
+def run_recovered_game(game, seats):
+    run_two_player_game_online(*seats, game=game)
+    for seat in seats:
+        threading.Thread(target=lobby_loop, args=(seat,), daemon=True).start()
+
+def main(reuse_port=False):
+    global HOUSE_BOT_WAIT
+    setup_logging(LOG_LEVEL)
+    raise_fd_limit()
+    sessions.on_chat = chat.post
+    sessions.watcher = lobby_watcher
+    lobby_watcher.on_input = lobby_input
+    chat.subscribe(deliver_chat)
+    chat.subscribe(spectator_hub.publish_chat)
+    chat.start()
+    lobby_watcher.start()
+    spectator_hub.start()
+    timeouts.start()
+    if not RECORDABLE and (JOURNAL_DIR is not None or REPLAY_PATH is not None):
+        log.warning("Journal and replays record boards up to 255x255 and 255 ships; not recording this %dx%d, "
+                    "%d-ship game", BOARD_SIZE, BOARD_SIZE, len(FLEET))
+    elif JOURNAL_DIR is not None:
+        open_journal()
+    if RECORDABLE and REPLAY_PATH is not None:
+        open_replays()
+    if HOUSE_BOT_WAIT is not None and BOARD_SIZE > HOUSE_BOT_MAX_SIZE:
+        log.warning("No house bot on boards over %dx%d", HOUSE_BOT_MAX_SIZE, HOUSE_BOT_MAX_SIZE)
+        HOUSE_BOT_WAIT = None
+    if TRACE_PATH is not None:
+        tracing.enable(TRACE_PATH, TRACE_EVERY)
+        log.info("Tracing one match in %d to %s", TRACE_EVERY, TRACE_PATH)
+    if PSK_PATH is not None:
+        global psk
+        psk = secure.PresharedKey.load(PSK_PATH)
+        log.info("Binary protocol encrypted with the key in %s", PSK_PATH)
+    listener = open_listener(PORT, reuse_port)
+    binary_listener = open_listener(BINARY_PORT, reuse_port)
+    spectator_listener = open_listener(SPECTATOR_PORT, reuse_port)
+    StatsServer(HOST, STATS_PORT).start()
+    log.info("Server listening on %s:%d (text), %s:%d (binary) and %s:%d (spectators); stats on %s:%d",
+             HOST, PORT, HOST, BINARY_PORT, HOST, SPECTATOR_PORT, HOST, STATS_PORT)
+    threading.Thread(target=accept_loop, args=(binary_listener, binary_connection), daemon=True).start()
+    threading.Thread(target=spectator_accept_loop, args=(spectator_listener,), daemon=True).start()
+    with listener:
+        accept_loop(listener, TextConnection)
+
+def lobby_loop(player):
+    """
+    Queue the client with the matchmaker. The client that completes a pair runs
+    the match on its own thread; the one that was waiting sleeps until that match
+    ends (or until the lobby watcher notices it hung up). Both then re-queue.
+    """
     try:
         while True:
-            wfile.write("Waiting for another player...\n")
-            wfile.flush()
-
-            with waiting_lock:
-                waiting_clients.append((rfile, wfile, conn))
-
-            while True:
-                with waiting_lock:
-                    if (rfile, wfile, conn) not in waiting_clients:
-                        break  # matched into a game
-                time.sleep(0.5)  # wait to be matched
+            if player.dropped:
+                # Lost during a match and not resumed in time
+                player.close()
+                return
+            player.send("Waiting for another player...")
+
+            queued = time.perf_counter_ns()
+            ticket = matchmaker.join(player)
+            if ticket.is_host:
+                stats = matchmaker.stats()
+                log.info("Starting a new game (waited %.3fs, avg %.3fs, %d still waiting)",
+                         ticket.opponent.time_to_match, stats['avg_time_to_match'], stats['waiting'])
+                trace = tracing.start_match()
+                if trace is not None:
+                    # How long the match took to come together: the waiting player's time in the queue
+                    trace.record(("matchmaking",), trace.t0 - int(ticket.opponent.time_to_match * 1e9), trace.t0)
+                try:
+                    with tracing.use(trace), tracing.span("match"):
+                        run_two_player_game_online(ticket.opponent.player, player)
+                finally:
+                    tracing.finish(trace)
+                    ticket.opponent.finish()
+            else:
+                lobby_watcher.watch(player.conn, ticket)
+                if not ticket.wait_finished(HOUSE_BOT_WAIT) and matchmaker.withdraw(ticket):
+                    # Nobody came: play the house bot, then queue again
+                    log.info("Starting a game against the house bot")
+                    player.send("No opponent found. You are playing the computer.")
+                    trace = tracing.start_match()
+                    if trace is not None:
+                        trace.record(("matchmaking",), queued, trace.t0)
+                    with tracing.use(trace), tracing.span("match"):
+                        run_two_player_game_online(player, AIConnection(size=BOARD_SIZE, ships=FLEET))
+                    tracing.finish(trace)
+                    continue
+                ticket.wait_finished()
+                if ticket.handed_off:
+                    # Moved to another worker process, which now runs this player
+                    lobby_watcher.forget(player.conn, player.close)
+                    return
+                if ticket.disconnected:
+                    log.info("Client disconnected during lobby wait")
+                    player.close()
+                    return
 
     except Exception as e:
-        print(f"[INFO] Client disconnected during lobby wait: {e}")
-        try: conn.close()
-        except: pass
+        log.info("Client disconnected during lobby wait: %s", e)
+        player.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # `python server.py --async` runs the asyncio engine instead of thread-per-connection;
+    # `python server.py --workers N` runs N threaded worker processes on the same ports
+    if "--async" in sys.argv:
+        from async_server import main as async_main
+        async_main()
+    elif "--workers" in sys.argv:
+        from workers import run_workers
+        run_workers(int(sys.argv[sys.argv.index("--workers") + 1]))
+    else:
+        main()
\ No newline at end of file
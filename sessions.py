@@ -0,0 +1,322 @@
+"""
+sessions.py
+
+Reconnection support. Every client gets a Seat when it connects: a stand-in
+for its connection that the lobby and the game use instead, so the socket
+underneath can be swapped when the player comes back.
+
+ - SessionStore.open() issues a resume token (sent to the client) for a new Seat;
+   adopt() seats a player moved in from another worker process under the token
+   it already has.
+ - A Seat whose connection fails stops raising: sends are dropped and recv()
+   returns None, so the game notices the loss on that player's next read,
+   whichever thread hit the error first.
+ - The game then calls Seat.wait_for_resume(): the seat is suspended, an
+   expiry timer goes on the server's TimerWheel, and the game thread waits.
+ - A client that reconnects and sends `RESUME <token>` is found with one dict
+   lookup and attached to the seat; the game thread wakes up and sends it a
+   snapshot of both boards, then carries on.
+ - A client may also reconnect before the server has noticed the old
+   connection is dead (a half-open socket after a network switch). If the seat
+   is in a match, the new connection takes over at once and the old one is
+   interrupted, which sends the game down the same path.
+ - Expiry is driven by the wheel, so sessions are evicted without ever
+   scanning the live ones.
+ - `CHAT <message>` lines never reach the game: they go to the store's on_chat
+   hook (chat.py). With a `watcher` (matchmaking.LobbyWatcher) on the store, a
+   seated player's socket is read on the watcher's thread for the whole match,
+   so chat goes out as soon as it arrives, whoever's turn it is; other lines
+   wait in the seat's input queue for Seat.recv(). Without one, recv() reads
+   the connection itself and passes chat on as it meets it.
+"""
+
+import itertools
+import queue
+import secrets
+import threading
+
+# Lines a seated player may send before the game reads them; more are dropped
+INPUT_BACKLOG = 64
+
+
+class Seat:
+    """
+    A player's place on the server, outliving any one connection. Has the
+    same interface as protocol.TextConnection / BinaryConnection.
+    """
+
+    def __init__(self, store, token, connection, name):
+        self.store = store
+        self.token = token
+        self.name = name  # shown in chat; the token is a secret
+        self.connection = connection
+        self.dropped = False
+        self.suspended = False
+        self.in_match = False
+        self._resumed = threading.Event()
+        self._expiry = None
+        self._takeover = False  # set by a takeover the game hasn't handled yet
+        self._replaced = None  # the connection it replaced, closed once the game has
+        self._input = queue.Queue()  # (connection, line) read by the store's watcher; line None at EOF
+        self._following = None  # the connection the watcher is reading for us
+
+    @property
+    def binary(self):
+        return self.connection.binary
+
+    @property
+    def conn(self):
+        return self.connection.conn
+
+    def _call(self, method, *args):
+        if self.dropped:
+            return
+        connection = self.connection
+        try:
+            getattr(connection, method)(*args)
+        except OSError:
+            if self.connection is connection:
+                self.dropped = True
+
+    def send(self, msg):
+        self._call('send', msg)
+
+    def send_board(self, grid, own=False, origin=None):
+        self._call('send_board', grid, own, origin)
+
+    def new_match(self):
+        self.in_match = True
+        self._call('new_match')
+        # What was typed before the match isn't for it; a hang-up still counts
+        stale = []
+        while not self._input.empty():
+            stale.append(self._input.get_nowait())
+        for source, line in stale:
+            if line is None:
+                self._input.put((source, line))
+        self._following = None  # the lobby may have watched the socket since
+        self._follow()
+
+    def end_match(self):
+        self.store.end_match(self)
+
+    def send_target_board(self, grid, origin=None):
+        self._call('send_target_board', grid, origin)
+
+    def send_cells(self, cells, own=False):
+        self._call('send_cells', cells, own)
+
+    def send_result(self, result, sunk, game_over, message):
+        self._call('send_result', result, sunk, game_over, message)
+
+    def cork(self):
+        self._call('cork')
+
+    def flush(self):
+        self._call('flush')
+
+    def uncork(self):
+        self._call('uncork')
+
+    def recv(self):
+        """
+        Like TextConnection.recv. Also returns None when another connection has
+        taken this seat over; wait_for_resume() then returns straight away.
+        Chat is passed on, not returned.
+        """
+        while True:
+            if self.dropped or self._takeover:
+                return None
+            connection = self.connection
+            try:
+                if self.store.watcher is None:
+                    line = connection.recv()
+                else:
+                    self._follow()
+                    connection.output.wait()  # flush, as connection.recv() does before it blocks
+                    source, line = self._input.get()
+                    if source is not connection:
+                        continue  # left over from a connection this seat has since replaced
+            except OSError:
+                line = None
+            if line is None:
+                if self.connection is connection:
+                    self.dropped = True
+                return None
+            on_chat = self.store.on_chat
+            if on_chat is None or line[:5].upper() != "CHAT ":
+                return line
+            on_chat(self, line[5:])
+
+    def _follow(self):
+        """Have the store's watcher read our connection, if it isn't already."""
+        watcher, connection = self.store.watcher, self.connection
+        if watcher is None or connection is None or self._following is connection:
+            return
+        self._following = connection
+        watcher.follow(connection.conn, lambda data: self._received(connection, data))
+
+    def _received(self, connection, data):
+        """On the watcher thread: chat goes straight to the room, game input to recv()."""
+        if not data:
+            self._input.put((connection, None))
+            return
+        try:
+            connection.feed(data)
+        except ValueError:
+            connection.interrupt()  # unparseable: the EOF this causes drops the seat
+            return
+        on_chat, lines = self.store.on_chat, connection.lines
+        while lines:
+            line = lines.popleft()
+            if on_chat is not None and line[:5].upper() == "CHAT ":
+                on_chat(self, line[5:])
+            elif self._input.qsize() < INPUT_BACKLOG:
+                self._input.put((connection, line))
+
+    def interrupt(self):
+        if self.connection is not None:
+            self.connection.interrupt()
+
+    def wait_for_resume(self):
+        """
+        Suspend this seat until its player reconnects or the grace window runs
+        out. Returns True if the seat has a live connection again.
+        """
+        self.store.suspend(self)
+        self._resumed.wait()
+        return not self.dropped
+
+    def close(self):
+        self.store.discard(self)
+        if self.connection is not None:
+            self.connection.close()
+
+
+class SessionStore:
+    """
+    Seats by resume token. Suspended seats expire `grace` seconds after they
+    were suspended, via a timers.TimerWheel.
+    """
+
+    def __init__(self, wheel, grace=60):
+        self.wheel = wheel
+        self.grace = grace
+        self.on_chat = None  # on_chat(seat, text) takes CHAT lines; without it they are returned like any other
+        self.watcher = None  # matchmaking.LobbyWatcher that reads seats' sockets during matches
+        self._seats = {}
+        self._numbers = itertools.count(1)
+        self._lock = threading.Lock()
+        self.resumed = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self._seats)
+
+    def seats(self):
+        """A snapshot of the seats, for sending to every player."""
+        with self._lock:
+            return list(self._seats.values())
+
+    def open(self, connection):
+        seat = Seat(self, secrets.token_urlsafe(16), connection, f"player{next(self._numbers)}")
+        with self._lock:
+            self._seats[seat.token] = seat
+        return seat
+
+    def adopt(self, connection, token=None, name=None):
+        """
+        A seat for a connection moved in from another worker process
+        (workers.py), keeping the token and chat name it was given there.
+        """
+        if token is None:
+            return self.open(connection)
+        seat = Seat(self, token, connection, name or f"player{next(self._numbers)}")
+        with self._lock:
+            self._seats[token] = seat
+        return seat
+
+    def restore(self, token):
+        """
+        A seat with no connection yet, for a game recovered after a restart
+        (journal.py). Its player gets it back with RESUME <token> as usual.
+        """
+        seat = Seat(self, token, None, f"player{next(self._numbers)}")
+        seat.dropped = True
+        with self._lock:
+            self._seats[token] = seat
+        return seat
+
+    def suspend(self, seat):
+        dead = None
+        with self._lock:
+            takeover, seat._takeover = seat._takeover, False
+            replaced, seat._replaced = seat._replaced, None
+            if not takeover:
+                seat.suspended = True
+                seat._resumed.clear()
+                seat._expiry = self.wheel.schedule(self.grace, self._expire, seat)
+                if seat.dropped:
+                    dead = seat.connection
+        if takeover:
+            # Already taken over by a new connection: nothing to wait for
+            if replaced is not None:
+                replaced.close()
+            seat._resumed.set()
+        elif dead is not None:
+            # Nothing more will be read from it (we're the seat's reader); a client
+            # cut off for not reading (protocol.Output) is reset by this
+            dead.close()
+
+    def resume(self, token, connection):
+        """
+        Attach connection to the seat with this token, if it is suspended or in
+        a match. Returns the seat, or None if the token is unknown or expired,
+        or its seat is sitting in the lobby.
+        """
+        with self._lock:
+            seat = self._seats.get(token)
+            if seat is None or not (seat.suspended or seat.in_match):
+                return None
+            old, seat.connection = seat.connection, connection
+            seat.dropped = False
+            self.resumed += 1
+            takeover = not seat.suspended
+            if takeover:
+                # The old connection may still look alive to us
+                seat._takeover = True
+                seat._replaced = old
+            else:
+                seat.suspended = False
+                seat._expiry.cancel()
+        seat._follow()
+        if takeover:
+            if old is not None:
+                old.interrupt()  # wake the game if it's blocked reading the old one
+        else:
+            if old is not None:
+                old.close()
+            seat._resumed.set()
+        return seat
+
+    def end_match(self, seat):
+        with self._lock:
+            seat.in_match = False
+            seat._takeover = False
+            replaced, seat._replaced = seat._replaced, None
+        if replaced is not None:
+            replaced.close()
+
+    def _expire(self, seat):
+        with self._lock:
+            if not seat.suspended:
+                return  # resumed just before the timer fired
+            seat.suspended = False
+            self._seats.pop(seat.token, None)
+            self.expired += 1
+        seat._resumed.set()
+
+    def discard(self, seat):
+        with self._lock:
+            if self._seats.get(seat.token) is seat:
+                del self._seats[seat.token]
@@ -0,0 +1,190 @@
+"""
+sparseboard.py
+
+Board backend for big boards (100x100, 1000x1000, ...) that stores only what is
+on them, keyed by flat cell index (row * size + col):
+  - ships:  cell -> index of the ship on it
+  - shots:  cell -> 'X' (hit) or 'o' (miss)
+  - afloat: per ship, how many of its cells have not been hit yet
+Memory grows with the fleet and the shots fired, not with the board's area;
+fire_at and all_ships_sunk are a dict lookup and a counter check.
+
+SparseBoard exposes the same API as battleship.Board (can_place_ship,
+add_ship, fire_at, all_ships_sunk, place_ships_randomly, reset, ...). cell() and
+window() read what is needed for a turn or a viewport (battleship.view);
+hidden_grid/display_grid build the whole grid and are for small boards only.
+TwoPlayerGame picks SparseBoard for boards bigger than battleship.DENSE_LIMIT.
+
+Run `python sparseboard.py` for memory and per-shot cost against Board.
+"""
+
+from itertools import repeat
+
+from battleship import Board, fleet
+
+
+class SparseBoard:
+    """
+    Sparse Board backend. Drop-in for Board in TwoPlayerGame(board_cls=SparseBoard).
+    Like BitBoard, out-of-range coordinates raise IndexError.
+    """
+    __slots__ = ('size', 'ships', 'shots', 'afloat', 'ship_names', 'remaining')
+
+    def __init__(self, size=10):
+        self.size = size
+        self.ships = {}
+        self.shots = {}
+        self.afloat = []
+        self.ship_names = []
+        self.remaining = 0  # ship cells not hit yet
+
+    # These only go through can_place_ship/add_ship and the grid properties
+    place_ships_randomly = Board.place_ships_randomly
+    place_ships_manually = Board.place_ships_manually
+    print_display_grid = Board.print_display_grid
+
+    def reset(self):
+        self.ships.clear()
+        self.shots.clear()
+        self.afloat.clear()
+        self.ship_names.clear()
+        self.remaining = 0
+
+    def _cells(self, row, col, ship_size, orientation):
+        """Flat cells of a placement, or None if it would leave the board."""
+        size = self.size
+        if row < 0 or col < 0:
+            return None
+        if orientation == 0:
+            if row >= size or col + ship_size > size:
+                return None
+            start = row * size + col
+            return range(start, start + ship_size)
+        if col >= size or row + ship_size > size:
+            return None
+        start = row * size + col
+        return range(start, start + ship_size * size, size)
+
+    def can_place_ship(self, row, col, ship_size, orientation):
+        cells = self._cells(row, col, ship_size, orientation)
+        if cells is None:
+            return False
+        ships = self.ships
+        return not any(cell in ships for cell in cells)
+
+    def do_place_ship(self, row, col, ship_size, orientation):
+        """
+        Mark the ship's cells under the next ship index and return them as (row, col) pairs.
+        """
+        index = len(self.afloat)
+        cells = self._cells(row, col, ship_size, orientation)
+        for cell in cells:
+            self.ships[cell] = index
+        return {divmod(cell, self.size) for cell in cells}
+
+    def add_ship(self, ship_name, row, col, ship_size, orientation):
+        self.do_place_ship(row, col, ship_size, orientation)
+        self.afloat.append(ship_size)
+        self.ship_names.append(ship_name)
+        self.remaining += ship_size
+
+    def fire_at(self, row, col):
+        """
+        Same contract as Board.fire_at: returns ('hit', None), ('hit', <ship_name>),
+        ('miss', None) or ('already_shot', None).
+        """
+        size = self.size
+        if not (0 <= row < size and 0 <= col < size):
+            raise IndexError("coordinate is off the board")
+        cell = row * size + col
+        if cell in self.shots:
+            return ('already_shot', None)
+        ship = self.ships.get(cell)
+        if ship is None:
+            self.shots[cell] = 'o'
+            return ('miss', None)
+        self.shots[cell] = 'X'
+        self.remaining -= 1
+        self.afloat[ship] -= 1
+        return ('hit', None if self.afloat[ship] else self.ship_names[ship])
+
+    def all_ships_sunk(self):
+        return self.remaining == 0
+
+    @property
+    def placed_ships(self):
+        """
+        Board-compatible view: one dict per ship with its not-yet-hit positions.
+        Read-only, and it walks every ship cell; use add_ship() to place ships.
+        """
+        ships = [{'name': name, 'positions': set()} for name in self.ship_names]
+        for cell, index in self.ships.items():
+            if cell not in self.shots:
+                ships[index]['positions'].add(divmod(cell, self.size))
+        return ships
+
+    def cell(self, row, col, hidden=False):
+        cell = row * self.size + col
+        shot = self.shots.get(cell)
+        if shot is not None:
+            return shot
+        return 'S' if hidden and cell in self.ships else '.'
+
+    def window(self, top, left, height, width, hidden=False):
+        size = self.size
+        right = min(left + width, size)
+        rows = range(top, min(top + height, size))
+        get = self.shots.get
+        if not hidden:
+            # The per-turn view: one C-level lookup per cell
+            return [list(map(get, range(row * size + left, row * size + right), repeat('.', right - left)))
+                    for row in rows]
+        ships = self.ships
+        return [[get(cell) or ('S' if cell in ships else '.') for cell in range(row * size + left, row * size + right)]
+                for row in rows]
+
+    @property
+    def hidden_grid(self):
+        return self.window(0, 0, self.size, self.size, hidden=True)
+
+    @property
+    def display_grid(self):
+        return self.window(0, 0, self.size, self.size)
+
+
+def _benchmark():
+    import random
+    import time
+    import tracemalloc
+    from battleship import VIEWPORT, view
+
+    for size, copies in ((10, 1), (100, 1), (100, 100), (1000, 1), (1000, 1000)):
+        ships = fleet(copies)
+        Board(size).place_ships_randomly(ships)  # placement tables are cached: build them before measuring
+        for cls in (Board, SparseBoard):
+            if cls is Board and size > 100:
+                continue  # a million-cell dense board per player is what this module avoids
+            tracemalloc.start()
+            board = cls(size)
+            board.place_ships_randomly(ships)
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+
+            rng = random.Random(1)
+            shots = [(rng.randrange(size), rng.randrange(size)) for _ in range(20000)]
+            start = time.perf_counter()
+            for row, col in shots:
+                board.fire_at(row, col)
+                board.all_ships_sunk()
+            per_shot = (time.perf_counter() - start) / len(shots)
+
+            start = time.perf_counter()
+            for row, col in shots[:2000]:
+                view(board, (row, col))
+            per_view = (time.perf_counter() - start) / 2000
+            print(f"{size:5}x{size:<5} {len(ships):5} ships {cls.__name__:>11}: {memory / 1024:9.0f} KiB  "
+                  f"{per_shot * 1e9:5.0f} ns/shot  {per_view * 1e6:6.1f} us per {min(size, VIEWPORT)}-square view")
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,61 @@
+"""
+The asyncio engine, driven over real sockets by two scripted clients.
+"""
+
+import asyncio
+
+import async_server
+
+TIMEOUT = 5
+
+
+async def _expect(reader, text):
+    """Read lines until one contains `text`; returns the lines read."""
+    lines = []
+    while True:
+        line = await asyncio.wait_for(reader.readline(), TIMEOUT)
+        assert line, f"connection closed before {text!r}; got {lines}"
+        lines.append(line.decode().rstrip('\n'))
+        if text in lines[-1]:
+            return lines
+
+
+async def _send(writer, line):
+    writer.write((line + '\n').encode())
+    await writer.drain()
+
+
+async def _off_board_placement():
+    server = await asyncio.start_server(async_server.handle_client, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    clients = []
+    try:
+        for _ in range(2):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            clients.append((reader, writer))
+            await _send(writer, "HELLO")
+            await _expect(reader, "Waiting for another player")
+        (reader1, writer1), (reader2, writer2) = clients
+
+        await _expect(reader1, "Enter starting coordinate")
+        await _send(writer1, "Z1")
+        await _expect(reader1, "Enter orientation")
+        await _send(writer1, "H")
+        lines = await _expect(reader1, "Enter starting coordinate")
+        assert any("off the board" in line for line in lines), lines
+        assert any("Place your" in line for line in lines), lines
+
+        # The placement dialogue is still alive: both players can finish and start the game
+        for reader, writer in clients:
+            await _send(writer, "FLEET RANDOM")
+        for reader, _ in clients:
+            await _expect(reader, "Both players ready! Game begins.")
+    finally:
+        for _, writer in clients:
+            writer.close()
+        server.close()
+        await server.wait_closed()
+
+
+def test_off_board_placement_is_reprompted():
+    asyncio.run(_off_board_placement())
@@ -0,0 +1,51 @@
+"""
+Replay the same random shots (repeats included) on the other board types and on
+the scalar Board, with fixed seeds, and compare every result.
+"""
+
+import random
+
+import pytest
+
+from battleship import SHIPS, Board, fleet
+from bitboard import BitBoard
+from placement import random_fleet
+from sparseboard import SparseBoard
+
+
+def _boards(board_cls, size, ships, fleets):
+    boards = []
+    for placements in fleets:
+        board = board_cls(size)
+        for (name, ship_size), (row, col, orientation) in zip(ships, placements):
+            board.add_ship(name, row, col, ship_size, orientation)
+        boards.append(board)
+    return boards
+
+
+@pytest.mark.parametrize("size, ships", [(10, SHIPS), (30, fleet(4))])
+def test_bitboard_matches_board(size, ships):
+    rng = random.Random(0)
+    fleets = [random_fleet(size, ships, rng) for _ in range(200)]
+    pairs = zip(_boards(BitBoard, size, ships, fleets), _boards(Board, size, ships, fleets))
+    for b, (bits, board) in enumerate(pairs):
+        for _ in range(size * size * 3 // 2):
+            row, col = rng.randrange(size), rng.randrange(size)
+            got, expected = bits.fire_at(row, col), board.fire_at(row, col)
+            assert got == expected, f"board {b} shot {row},{col}: {got} != {expected}"
+            assert bits.all_ships_sunk() == board.all_ships_sunk(), f"board {b}: game over mismatch"
+        assert bits.display_grid == board.display_grid
+
+
+def test_batchsim_matches_board():
+    pytest.importorskip("numpy")
+    import batchsim
+    assert batchsim.cross_check(n_boards=200, shots_per_board=150, seed=0) == 200 * 150
+
+
+@pytest.mark.parametrize("board_cls", [Board, BitBoard, SparseBoard])
+def test_off_board_placement_is_refused(board_cls):
+    board = board_cls(10)
+    for row, col, orientation in [(10, 0, 0), (0, 10, 1), (25, 3, 1), (3, 25, 0), (0, 8, 0), (8, 0, 1)]:
+        assert not board.can_place_ship(row, col, 3, orientation), (row, col, orientation)
+    assert board.can_place_ship(0, 7, 3, 0) and board.can_place_ship(7, 0, 3, 1)
@@ -0,0 +1,77 @@
+"""
+The FLEET command (TwoPlayerGame.place_fleet): all ships or none, with one
+error per ship that does not fit.
+"""
+
+import random
+
+import pytest
+
+from battleship import SHIPS, TwoPlayerGame
+
+VALID = "A1 H B1 H C1 H D1 H E1 H"
+
+
+def _snapshot(game, player):
+    board = game.player_boards[player]
+    return [list(row) for row in board.hidden_grid], len(board.placed_ships)
+
+
+def test_a_valid_fleet_is_placed():
+    game = TwoPlayerGame(size=10)
+    placed, fleet = game.place_fleet(0, VALID.split())
+    assert placed
+    assert fleet == [(row, 0, 0) for row in range(5)]
+    assert len(game.player_boards[0].placed_ships) == len(SHIPS)
+    assert game.ships_placed == [True, False]
+
+
+@pytest.mark.parametrize("fleet, errors", [
+    # Carrier runs off the right edge; Destroyer's row is past the last one
+    ("A8 H B1 H C1 H D1 H K1 H", ["Carrier at A8 H: off the board", "Destroyer at K1 H: off the board"]),
+    ("A1 H A1 V C1 H D1 H E1 H", ["Battleship at A1 V: overlaps the Carrier"]),
+    ("A1 H B1 X C1 H D1 Q E1 H", ["Battleship: orientation must be H or V, not 'X'",
+                                  "Submarine: orientation must be H or V, not 'Q'"]),
+    ("A1 H B1 H ?? H D1 H E1 H", ["Cruiser: expected a coordinate like B5, AB12 or 28,12, not '??'"]),
+    ("A1 H B1 H C1 H D1 H", ["Expected a coordinate and orientation for each of 5 ships, got 4"]),
+    ("A1 H B1 H C1", ["FLEET takes a coordinate and an orientation (H or V) for each ship, or RANDOM"]),
+])
+def test_a_bad_fleet_reports_each_problem_and_places_nothing(fleet, errors):
+    game = TwoPlayerGame(size=10)
+    before = _snapshot(game, 0)
+    placed, result = game.place_fleet(0, fleet.split())
+    assert not placed
+    assert result == errors
+    assert _snapshot(game, 0) == before
+    assert game.ships_placed == [False, False]
+
+
+def test_the_rest_of_a_fleet_must_miss_the_ships_already_placed():
+    game = TwoPlayerGame(size=10)
+    game.player_boards[0].add_ship("Carrier", 0, 0, 5, 0)
+    before = _snapshot(game, 0)
+    placed, result = game.place_fleet(0, "A2 V C1 H D1 H E1 H".split(), SHIPS[1:])
+    assert not placed
+    assert result == ["Battleship at A2 V: overlaps a ship already placed"]
+    assert _snapshot(game, 0) == before
+
+
+def test_fleet_random_fills_in_around_ships_already_placed():
+    random.seed(0)
+    for _ in range(50):
+        game = TwoPlayerGame(size=10)
+        game.player_boards[1].add_ship("Carrier", 4, 2, 5, 1)
+        placed, fleet = game.place_fleet(1, ["random"], SHIPS[1:])
+        assert placed and len(fleet) == len(SHIPS) - 1
+        board = game.player_boards[1]
+        assert sum(row.count('S') for row in board.hidden_grid) == sum(size for _, size in SHIPS)
+        assert game.ships_placed == [False, True]
+
+
+def test_fleet_random_that_cannot_fit_places_nothing():
+    game = TwoPlayerGame(size=3)
+    before = _snapshot(game, 0)
+    placed, result = game.place_fleet(0, ["RANDOM"])
+    assert not placed
+    assert len(result) == 1 and result[0].startswith("Cannot place a random fleet:")
+    assert _snapshot(game, 0) == before
@@ -0,0 +1,101 @@
+"""
+journal: crash recovery and segment removal.
+"""
+
+import os
+import random
+import secrets
+
+import pytest
+
+from battleship import SHIPS, TwoPlayerGame, format_coordinate
+from journal import FIRE, PLACE, RECORD, Journal
+from placement import random_fleet
+
+
+def _segments(directory):
+    return sorted(int(name.split('.')[0]) for name in os.listdir(directory) if name.endswith('.journal'))
+
+
+@pytest.mark.parametrize("tear", ["truncated", "garbled"])
+def test_recover_stops_at_a_torn_last_record(tmp_path, tear):
+    rng = random.Random(0)
+    journal = Journal(str(tmp_path), sync=False)
+    journal.start()
+    tokens = [secrets.token_urlsafe(16) for _ in range(2)]
+    game_id = journal.new_game(tokens)
+    game = TwoPlayerGame(size=10)
+    for player in (0, 1):
+        board = game.player_boards[player]
+        for index, ((name, size), (row, col, orientation)) in enumerate(zip(SHIPS, random_fleet(10, SHIPS, rng))):
+            board.add_ship(name, row, col, size, orientation)
+            journal.place(game_id, player, index, row, col, orientation)
+    shots = [[divmod(cell, 10) for cell in rng.sample(range(100), 100)] for _ in (0, 1)]
+    for turn in range(40):
+        player = game.current_turn
+        row, col = shots[player][turn // 2]
+        journal.fire(game_id, player, row, col)
+        game.fire(format_coordinate(row, col))
+    assert game.active
+    expected = [[list(row) for row in board.hidden_grid] for board in game.player_boards]
+    # The crash: the next shot's record only partly reaches the disk
+    journal.fire(game_id, game.current_turn, *shots[game.current_turn][20])
+    journal.close()
+
+    path = journal._path(_segments(str(tmp_path))[-1])
+    size = os.path.getsize(path)
+    if tear == "truncated":
+        os.truncate(path, size - RECORD.size // 2)
+    else:
+        with open(path, 'r+b') as f:
+            f.seek(size - RECORD.size // 2)
+            f.write(bytes(RECORD.size // 2))
+
+    recovered = Journal(str(tmp_path)).recover()
+    assert list(recovered) == [game_id]
+    restored, restored_tokens = recovered[game_id]
+    assert restored_tokens == tokens
+    assert restored.game_id == game_id
+    assert restored.ships_placed == [True, True]
+    assert restored.current_turn == game.current_turn
+    assert [board.hidden_grid for board in restored.player_boards] == expected
+
+
+def test_a_segment_goes_once_every_game_in_it_has_ended(tmp_path):
+    directory = str(tmp_path)
+    # Three records a segment. Each step below writes three records and waits for
+    # the last, so the roll after one step has happened by the time the next returns.
+    journal = Journal(directory, segment_bytes=3 * RECORD.size, sync=False)
+    journal.start()
+    tokens = [secrets.token_urlsafe(16) for _ in range(2)]
+    a = journal.new_game(tokens)  # segment 1
+    b = journal.new_game(tokens)  # segment 2
+    for i in range(3):  # segment 3
+        journal.fire(b, i & 1, 0, i)
+    assert _segments(directory)[0] == 1  # a is still being played
+
+    journal.end_game(a)  # segment 4, with two shots of b's
+    for i in range(2):
+        journal.fire(b, i & 1, 1, i)
+    for i in range(3):  # segment 5
+        journal.fire(b, i & 1, 2, i)
+    assert _segments(directory)[0] == 2  # a's is gone; b, still playing, has a record in segment 2
+
+    c = journal.new_game(tokens)  # segment 6
+    journal.end_game(b)  # segment 7
+    for i in range(2):
+        journal.fire(c, i & 1, 0, i)
+    journal.close()
+    assert _segments(directory)[0] == 6
+
+    assert list(Journal(directory).recover()) == [c]
+
+
+def test_records_for_a_game_never_opened_are_skipped(tmp_path):
+    journal = Journal(str(tmp_path), sync=False)
+    journal.start()
+    journal.append(7, PLACE, 0, 0, 0, 0, 0)
+    journal.append(7, FIRE, 1, 3, 4)
+    game_id = journal.new_game([secrets.token_urlsafe(16) for _ in range(2)])
+    journal.close()
+    assert list(Journal(str(tmp_path)).recover()) == [game_id]
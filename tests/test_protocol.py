@@ -0,0 +1,152 @@
+"""
+protocol: packet framing (PacketReader, BinaryConnection) and Output corking.
+"""
+
+import socket
+import struct
+import threading
+
+import pytest
+
+from protocol import (HEADER, MAGIC, MAX_PACKET, MAX_TEXT, PKT_FIRE, PKT_TEXT, BinaryConnection,
+                      PacketReader, PacketWriter, TextConnection, encode_packet, pack_fire, split_text)
+
+
+def _packets(reader):
+    """Every packet the reader can parse now, as (type, seq, payload bytes)."""
+    out = []
+    while (packet := reader.next_packet()) is not None:
+        ptype, seq, payload = packet
+        out.append((ptype, seq, bytes(payload)))
+    return out
+
+
+def _corrupt(packet, offset):
+    damaged = bytearray(packet)
+    damaged[offset] ^= 0x40
+    return bytes(damaged)
+
+
+def test_a_packet_split_across_feeds_is_put_back_together():
+    reader = PacketReader()
+    stream = encode_packet(PKT_TEXT, 0, b"hello") + encode_packet(PKT_FIRE, 1, pack_fire(1, 4))
+    reader.feed(stream[:HEADER.size + 3])  # the header and part of the payload
+    assert reader.next_packet() is None
+    reader.feed(stream[HEADER.size + 3:])
+    assert _packets(reader) == [(PKT_TEXT, 0, b"hello"), (PKT_FIRE, 1, bytes((1, 4)))]
+    assert reader.received == 2 and reader.corrupted == 0
+
+
+def test_a_packet_fed_byte_by_byte_comes_out_once():
+    reader = PacketReader()
+    packet = encode_packet(PKT_TEXT, 0, b"FLEET A1 H B1 H C1 H D1 H E1 H")
+    for i, byte in enumerate(packet):
+        reader.feed(bytes((byte,)))
+        got = _packets(reader)
+        assert got == ([] if i < len(packet) - 1 else [(PKT_TEXT, 0, b"FLEET A1 H B1 H C1 H D1 H E1 H")])
+
+
+@pytest.mark.parametrize("offset", [3, HEADER.size - 1, HEADER.size + 2])  # the CRC, the length, the payload
+def test_a_corrupted_packet_is_dropped_and_the_next_one_read(offset):
+    reader = PacketReader()
+    reader.feed(_corrupt(encode_packet(PKT_TEXT, 0, b"first"), offset))
+    # A damaged length (still under the limit) is only found out once that many bytes are in
+    for seq in range(5):
+        reader.feed(encode_packet(PKT_TEXT, seq, b"next"))
+    assert _packets(reader) == [(PKT_TEXT, seq, b"next") for seq in range(5)]
+    assert reader.corrupted == 1
+
+
+def test_a_length_over_the_limit_is_not_waited_for():
+    reader = PacketReader()
+    header = HEADER.pack(MAGIC, 0, 1, PKT_TEXT, 0, MAX_PACKET + 1)
+    # Only the header arrives: the reader must not sit waiting for MAX_PACKET + 1 bytes
+    reader.feed(header)
+    assert reader.next_packet() is None and reader.corrupted == 1
+    reader.feed(encode_packet(PKT_TEXT, 0, b"after"))
+    assert _packets(reader) == [(PKT_TEXT, 0, b"after")]
+
+
+def test_more_than_the_buffer_holds_raises_value_error():
+    reader = PacketReader()
+    with pytest.raises(ValueError):
+        reader.feed(bytes(HEADER.size + MAX_PACKET + 4097))
+
+
+def test_the_largest_packet_fits_and_one_past_it_is_refused():
+    reader = PacketReader()
+    reader.feed(encode_packet(PKT_TEXT, 0, bytes(MAX_PACKET)))
+    assert [(seq, len(payload)) for _, seq, payload in _packets(reader)] == [(0, MAX_PACKET)]
+    reader.feed(encode_packet(PKT_TEXT, 1, bytes(MAX_PACKET + 1)))
+    reader.feed(encode_packet(PKT_TEXT, 2, b"x"))
+    assert [(seq, len(payload)) for _, seq, payload in _packets(reader)] == [(2, 1)]
+    assert reader.corrupted == 1
+
+
+def test_replays_are_dropped_and_gaps_skipped():
+    reader = PacketReader()
+    for seq in (0, 1, 1, 0, 5, 6):
+        reader.feed(encode_packet(PKT_TEXT, seq, str(seq).encode()))
+    assert [seq for _, seq, _ in _packets(reader)] == [0, 1, 5, 6]
+    assert reader.out_of_sequence == 3  # two replays and one gap
+    assert reader.next_seq == 7
+
+
+def test_writer_and_reader_agree():
+    writer, reader = PacketWriter(None), PacketReader()
+    for text in (b"", b"a", "\u00e9t\u00e9".encode(), bytes(MAX_TEXT)):
+        reader.feed(writer.encode(PKT_TEXT, text))
+    assert [payload for _, _, payload in _packets(reader)] == [b"", b"a", "\u00e9t\u00e9".encode(), bytes(MAX_TEXT)]
+    assert struct.unpack_from('!I', encode_packet(PKT_TEXT, 0), 2) != (0,)
+
+
+def test_long_text_is_split_into_packets_the_reader_accepts():
+    server_end, client = socket.socketpair()
+    connection = BinaryConnection(server_end)
+    message = "\n".join(f"line {i} " + "\u00e9" * 40 for i in range(200))
+    connection.send(message)
+    connection.send("x" * (3 * MAX_TEXT))
+    server_end.close()
+    reader, texts = PacketReader(), []
+    while reader.recv_from(client):
+        texts += [payload for ptype, _, payload in _packets(reader) if ptype == PKT_TEXT]
+    client.close()
+    assert all(len(text) <= MAX_TEXT for text in texts) and len(texts) > 2
+    joined = b"".join(texts).decode()  # every piece is whole UTF-8
+    assert joined.replace("\n", "") == message.replace("\n", "") + "x" * (3 * MAX_TEXT)
+    assert list(split_text(b"short")) == [b"short"]
+
+
+def test_binary_connection_reads_packets_split_across_feeds():
+    server_end, client = socket.socketpair()
+    connection = BinaryConnection(server_end)
+    stream = encode_packet(PKT_FIRE, 0, pack_fire(1, 4)) + encode_packet(PKT_TEXT, 1, b"CHAT hi")
+    connection.feed(stream[:HEADER.size + 1])
+    assert not connection.lines
+    connection.feed(stream[HEADER.size + 1:])
+    assert list(connection.lines) == ["B5", "CHAT hi"]
+    server_end.close()
+    client.close()
+
+
+def _read_lines(sock, n):
+    reader = sock.makefile('r')
+    return [reader.readline().rstrip('\n') for _ in range(n)]
+
+
+def test_another_threads_send_takes_the_corked_output_with_it():
+    server_end, client = socket.socketpair()
+    client.settimeout(2)
+    connection = TextConnection(server_end)
+    connection.cork()
+    connection.send("Your turn is over.")  # queued until this thread flushes...
+    chat = threading.Thread(target=connection.send, args=("CHAT hello",))
+    chat.start()
+    chat.join()
+    # ...or until another thread sends: both arrive, in order, with no flush here
+    assert _read_lines(client, 2) == ["Your turn is over.", "CHAT hello"]
+    connection.send("later")
+    connection.uncork()
+    assert _read_lines(client, 1) == ["later"]
+    server_end.close()
+    client.close()
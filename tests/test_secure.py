@@ -0,0 +1,127 @@
+"""
+secure: the PSK handshake and session resumption, and packets that were
+tampered with or replayed.
+"""
+
+import secrets
+import socket
+import struct
+import threading
+import zlib
+
+import pytest
+
+import secure
+from protocol import HEADER, PKT_TEXT, PacketReader, PacketWriter
+from secure import HandshakeError, PresharedKey, Session
+
+TIMEOUT = 5
+
+
+def handshake(server_key, client_key, session=None):
+    """
+    Both sides over a socket pair. Returns (client result or exception, server
+    exception or None, client (reader, writer), server (reader, writer)).
+    """
+    a, b = socket.socketpair()
+    client = PacketReader(), PacketWriter(a)
+    server = PacketReader(), PacketWriter(b)
+    failed = []
+
+    def accept():
+        try:
+            secure.accept(b, *server, server_key, timeout=TIMEOUT)
+        except HandshakeError as e:
+            failed.append(e)
+
+    thread = threading.Thread(target=accept, daemon=True)
+    thread.start()
+    try:
+        result = secure.connect(a, *client, client_key, session, timeout=TIMEOUT)
+    except HandshakeError as e:
+        result = e
+        a.close()  # the server's read of the client's proof ends here
+    thread.join(TIMEOUT)
+    a.close()
+    b.close()
+    return result, (failed[0] if failed else None), client, server
+
+
+def exchange(writer, reader, payload):
+    """One packet from writer to reader, in memory; returns the wire bytes and what the reader made of it."""
+    wire = bytes(writer.encode(PKT_TEXT, payload))
+    reader.feed(wire)
+    packet = reader.next_packet()
+    return wire, None if packet is None else bytes(packet[2])
+
+
+def test_full_handshake_then_encrypted_packets_both_ways():
+    key = PresharedKey(secrets.token_bytes(32))
+    session, error, (c_reader, c_writer), (s_reader, s_writer) = handshake(key, key)
+    assert error is None and isinstance(session, Session) and not session.resumed
+
+    wire, got = exchange(c_writer, s_reader, b"FIRE B5")
+    assert got == b"FIRE B5" and b"FIRE B5" not in wire
+    assert exchange(s_writer, c_reader, b"MISS!")[1] == b"MISS!"
+
+
+def test_a_resumed_session_skips_the_dh_and_still_talks():
+    key = PresharedKey(secrets.token_bytes(32))
+    first, _, _, _ = handshake(key, key)
+    resumed, error, (c_reader, c_writer), (s_reader, s_writer) = handshake(key, key, Session.load(first.dump()))
+    assert error is None and resumed.resumed
+    assert exchange(c_writer, s_reader, b"hello again")[1] == b"hello again"
+
+
+def test_a_ticket_the_server_cannot_open_falls_back_to_a_full_handshake():
+    key = PresharedKey(secrets.token_bytes(32))
+    first, _, _, _ = handshake(key, key)
+    forged = Session(first.master, first.ticket[:-1] + bytes((first.ticket[-1] ^ 1,)))
+    session, error, (c_reader, c_writer), (s_reader, s_writer) = handshake(key, key, forged)
+    assert error is None and not session.resumed
+    assert exchange(c_writer, s_reader, b"ok")[1] == b"ok"
+
+
+def test_different_keys_fail_on_both_sides():
+    result, error, _, _ = handshake(PresharedKey(secrets.token_bytes(32)), PresharedKey(secrets.token_bytes(32)))
+    assert isinstance(result, HandshakeError)
+    assert isinstance(error, HandshakeError)
+
+
+def _reseal_crc(wire):
+    """A network attacker can fix the CRC; only the tag stands in the way."""
+    wire = bytearray(wire)
+    struct.pack_into('!I', wire, 2, zlib.crc32(wire[6:]))
+    return bytes(wire)
+
+
+@pytest.mark.parametrize("offset", [HEADER.size, HEADER.size + 3, -1, 7])  # ciphertext, tag, packet type
+def test_a_tampered_packet_is_dropped_as_forged(offset):
+    key = PresharedKey(secrets.token_bytes(32))
+    _, _, (_, c_writer), (s_reader, _) = handshake(key, key)
+    wire = bytearray(c_writer.encode(PKT_TEXT, b"FIRE B5"))
+    wire[offset] ^= 1
+    s_reader.feed(_reseal_crc(wire))
+    assert s_reader.next_packet() is None
+    assert s_reader.forged == 1
+    assert exchange(c_writer, s_reader, b"FIRE C6")[1] == b"FIRE C6"  # the connection carries on
+
+
+def test_a_replayed_packet_is_dropped():
+    key = PresharedKey(secrets.token_bytes(32))
+    _, _, (_, c_writer), (s_reader, _) = handshake(key, key)
+    wire, got = exchange(c_writer, s_reader, b"FIRE B5")
+    assert got == b"FIRE B5"
+    s_reader.feed(wire)
+    assert s_reader.next_packet() is None
+    assert s_reader.out_of_sequence == 1
+    assert exchange(c_writer, s_reader, b"FIRE C6")[1] == b"FIRE C6"
+
+
+def test_a_packet_from_another_session_is_forged():
+    key = PresharedKey(secrets.token_bytes(32))
+    _, _, (_, old_writer), _ = handshake(key, key)
+    _, _, _, (s_reader, _) = handshake(key, key)
+    old_writer.seq = s_reader.next_seq  # right sequence number, wrong keys
+    s_reader.feed(old_writer.encode(PKT_TEXT, b"FIRE B5"))
+    assert s_reader.next_packet() is None and s_reader.forged == 1
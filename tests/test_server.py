@@ -0,0 +1,90 @@
+"""
+A match on the threaded server (run_two_player_game_online) between two
+scripted clients on socket pairs.
+"""
+
+import socket
+import threading
+
+import pytest
+
+import server
+from protocol import TextConnection
+
+TIMEOUT = 5
+
+
+class Client:
+    def __init__(self, sock):
+        sock.settimeout(TIMEOUT)
+        self.sock = sock
+        self.reader = sock.makefile('r')
+
+    def send(self, line):
+        self.sock.sendall((line + '\n').encode())
+
+    def expect(self, text):
+        """Read lines until one contains `text`; returns the lines read."""
+        lines = []
+        while True:
+            line = self.reader.readline()
+            assert line, f"connection closed before {text!r}; got {lines}"
+            lines.append(line.rstrip('\n'))
+            if text in lines[-1]:
+                return lines
+
+
+@pytest.fixture
+def placing():
+    """A match at its first placement prompt: (connections, clients)."""
+    pairs = [socket.socketpair() for _ in range(2)]
+    connections = [TextConnection(server_end) for server_end, _ in pairs]
+    clients = [Client(client_end) for _, client_end in pairs]
+    game = threading.Thread(target=server.run_two_player_game_online, args=connections, daemon=True)
+    game.start()
+    for client in clients:
+        client.expect("Enter starting coordinate")
+    yield connections, clients
+    clients[0].send("quit")
+    game.join(TIMEOUT)
+    for server_end, client_end in pairs:
+        server_end.close()
+        client_end.close()
+
+
+@pytest.fixture
+def match(placing):
+    """Two placed fleets and a match on its first turn."""
+    connections, clients = placing
+    for client in clients:
+        client.send("FLEET RANDOM")
+    clients[0].expect("Your turn!")
+    return connections, clients
+
+
+def test_chat_reaches_the_waiting_player_mid_turn(match):
+    connections, clients = match
+    # What deliver_chat does, on the chat thread, while player 1 has yet to fire
+    chat = threading.Thread(target=connections[1].send, args=("[chat] Player 1: good luck",))
+    chat.start()
+    chat.join()
+    clients[1].expect("[chat] Player 1: good luck")
+
+
+def test_the_second_player_hears_the_game_start_before_the_first_shot(match):
+    connections, clients = match
+    clients[1].expect("Both players ready! Game begins.")
+
+
+def test_a_bad_fleet_is_reported_ship_by_ship_and_asked_for_again(placing):
+    connections, clients = placing
+    clients[0].send("FLEET A8 H B1 H C1 H D1 H K1 H")
+    lines = clients[0].expect("Enter starting coordinate")
+    assert lines[:3] == ["Fleet not placed (2 problems):",
+                         "  Carrier at A8 H: off the board",
+                         "  Destroyer at K1 H: off the board"]
+    assert "Place your Carrier (size 5)" in lines
+    for client in clients:
+        client.send("FLEET RANDOM")
+    clients[0].expect("5 ships placed.")
+    clients[1].expect("Both players ready! Game begins.")
@@ -0,0 +1,185 @@
+"""
+sessions: resuming a seat, expiry, and takeover of a half-open connection.
+The store's TimerWheel is never started; tests turn it by hand.
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+
+from sessions import SessionStore
+from timers import TimerWheel
+
+TIMEOUT = 5
+
+
+class FakeOutput:
+    def wait(self):
+        pass
+
+
+class FakeConnection:
+    """Enough of protocol.TextConnection for a Seat: lines typed by the test, sends recorded."""
+    binary = False
+
+    def __init__(self):
+        self.conn = object()
+        self.output = FakeOutput()
+        self.lines = deque()
+        self.sent = []
+        self.closed = False
+        self._typed = queue.Queue()
+
+    def type(self, line):
+        self._typed.put(line)
+
+    def hang_up(self):
+        self._typed.put(None)
+
+    def recv(self):
+        return self._typed.get(timeout=TIMEOUT)
+
+    def feed(self, data):
+        self.lines.extend(data.decode().splitlines())
+
+    def send(self, msg):
+        self.sent.append(msg)
+
+    def new_match(self):
+        pass
+
+    def interrupt(self):
+        self._typed.put(None)
+
+    def close(self):
+        self.closed = True
+        self._typed.put(None)
+
+
+class FakeWatcher:
+    """Stands in for matchmaking.LobbyWatcher: the test delivers socket data itself."""
+
+    def __init__(self):
+        self.readers = {}
+
+    def follow(self, conn, on_data):
+        self.readers[conn] = on_data
+
+
+def fire(timers):
+    for timer in timers:
+        timer.callback(*timer.args)
+
+
+def advance(wheel):
+    fire(wheel.advance())
+
+
+class Game:
+    """The game thread's side: Seat.wait_for_resume() on a thread of its own."""
+
+    def __init__(self, seat):
+        self.result = None
+        self._thread = threading.Thread(target=self._wait, args=(seat,), daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + TIMEOUT
+        while not seat.suspended and not seat._resumed.is_set():
+            assert time.monotonic() < deadline, "the seat was never suspended"
+            time.sleep(0.001)
+
+    def _wait(self, seat):
+        self.result = seat.wait_for_resume()
+
+    def join(self):
+        self._thread.join(TIMEOUT)
+        assert not self._thread.is_alive(), "wait_for_resume() never returned"
+        return self.result
+
+
+def seated(grace=0):
+    store = SessionStore(TimerWheel(), grace=grace)
+    first = FakeConnection()
+    seat = store.open(first)
+    seat.new_match()
+    return store, seat, first
+
+
+def test_a_dropped_seat_resumes_on_a_new_connection():
+    store, seat, first = seated(grace=1)
+    first.hang_up()
+    assert seat.recv() is None and seat.dropped
+
+    game = Game(seat)
+    advance(store.wheel)  # well inside the grace window
+    second = FakeConnection()
+    assert store.resume(seat.token, second) is seat
+    assert game.join() is True
+    assert first.closed and seat.connection is second
+    second.type("B2")
+    assert seat.recv() == "B2"
+    assert store.resumed == 1 and store.expired == 0
+
+
+def test_a_seat_not_resumed_in_time_expires():
+    store, seat, first = seated()
+    first.hang_up()
+    seat.recv()
+    game = Game(seat)
+    advance(store.wheel)
+    assert game.join() is False
+    assert store.expired == 1 and len(store) == 0
+    assert store.resume(seat.token, FakeConnection()) is None
+
+
+def test_a_resume_just_before_the_expiry_timer_fires_wins():
+    store, seat, first = seated()
+    first.hang_up()
+    seat.recv()
+    game = Game(seat)
+    due = store.wheel.advance()  # the wheel has taken the timer off, but not run it yet
+    assert due
+    second = FakeConnection()
+    assert store.resume(seat.token, second) is seat
+    fire(due)
+    assert game.join() is True
+    assert store.expired == 0 and len(store) == 1 and seat.connection is second
+
+
+def test_a_reconnect_takes_over_a_half_open_seat():
+    store, seat, first = seated()
+    second = FakeConnection()
+    # The old connection never reported an error; the game is blocked reading it
+    read = []
+    reader = threading.Thread(target=lambda: read.append(seat.recv()), daemon=True)
+    reader.start()
+    assert store.resume(seat.token, second) is seat
+    reader.join(TIMEOUT)
+    assert read == [None] and not seat.dropped
+
+    assert Game(seat).join() is True  # nothing to wait for
+    assert first.closed and seat.connection is second
+    second.type("C3")
+    assert seat.recv() == "C3"
+
+
+def test_a_seat_in_the_lobby_cannot_be_taken_over():
+    store, seat, first = seated()
+    seat.end_match()
+    assert store.resume(seat.token, FakeConnection()) is None
+    assert seat.connection is first
+
+
+def test_input_from_a_replaced_connection_is_not_read():
+    store, seat, first = seated()
+    watcher = store.watcher = FakeWatcher()
+    seat.new_match()
+    second = FakeConnection()
+    store.resume(seat.token, second)
+    assert seat.recv() is None  # the takeover
+    assert Game(seat).join() is True
+
+    # The watcher still had a line from the old socket when the new one spoke
+    watcher.readers[first.conn](b"A1\n")
+    watcher.readers[second.conn](b"B2\n")
+    assert seat.recv() == "B2"
@@ -0,0 +1,65 @@
+"""
+A client that never reads must not hold up anyone else, and is cut off once
+nothing has gone out to it for its write deadline (protocol.Output).
+"""
+
+import socket
+import threading
+import time
+
+from protocol import SlowConsumer, TextConnection
+
+DEADLINE = 2.0
+
+
+def _socketpair(buffer=4096):
+    server_end, client_end = socket.socketpair()
+    server_end.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, buffer)
+    client_end.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, buffer)
+    return server_end, client_end
+
+
+def _echo(sock):
+    """The well-behaved client: answers every line it is sent."""
+    reader = sock.makefile('rb')
+    for line in reader:
+        sock.sendall(b"pong " + line)
+
+
+def test_stalled_client_does_not_slow_the_others_and_is_cut_off():
+    stalled_end, stalled_client = _socketpair()  # stalled_client never reads
+    normal_end, normal_client = _socketpair()
+    stalled = TextConnection(stalled_end)
+    stalled.output.deadline = DEADLINE
+    normal = TextConnection(normal_end)
+    threading.Thread(target=_echo, args=(normal_client,), daemon=True).start()
+
+    chunk = "x" * 511  # slow enough to stay under the high-water mark: the deadline cuts it off
+    round_trips, slowest_send = [], 0.0
+    cut_off_at = None
+    start = time.monotonic()
+    try:
+        while time.monotonic() - start < DEADLINE * 2:
+            # One step of a server thread that serves both: a send to each, then the normal client's answer
+            if cut_off_at is None:
+                sent = time.monotonic()
+                try:
+                    stalled.send(chunk)
+                except SlowConsumer:
+                    cut_off_at = time.monotonic()
+                slowest_send = max(slowest_send, time.monotonic() - sent)
+            sent = time.monotonic()
+            normal.send(f"ping {len(round_trips)}")
+            assert normal.recv() == f"pong ping {len(round_trips)}"
+            round_trips.append(time.monotonic() - sent)
+            time.sleep(0.01)
+    finally:
+        for sock in (stalled_end, stalled_client, normal_end, normal_client):
+            sock.close()
+
+    assert slowest_send < 0.25, "a send to the stalled client blocked"
+    assert max(round_trips) < 0.5, "the stalled client held up the other one"
+    assert cut_off_at is not None, "the stalled client was never cut off"
+    assert stalled.output.failed is not None
+    # Its buffers fill within moments; from then on nothing goes out for DEADLINE seconds
+    assert DEADLINE <= cut_off_at - start < DEADLINE + 1.5
@@ -0,0 +1,390 @@
+"""
+tracing.py
+
+Opt-in profiling spans for matches: where the time of a slow match goes
+(matchmaking, ship placement, board formatting, TwoPlayerGame.fire, the
+journal, waiting on the client...).
+
+  - enable(path, every) turns it on; one match in `every` is traced. The
+    server does that for `--trace FILE [--trace-every N]`.
+  - A traced match runs inside use(trace): spans opened on that thread
+    (span(), phase(), and the instrumented methods below) are recorded into
+    the trace, nested by thread-local stack. bind() carries a trace into the
+    placement threads.
+  - Off (the default), span() is one flag check, phase() one thread-local
+    lookup, and use(None) does nothing. The instrumented methods (Board.fire_at,
+    TwoPlayerGame.fire, send_board, ...) are only wrapped by enable(), so
+    untraced code never pays for them.
+  - Spans of a match are buffered on its Trace and written in one go when
+    the match ends, as compact binary records:
+      b'S' <HH  stack id, name length; then the name ("match;turns;game.fire")
+      b'M' <II  match number, span count; then per span <Hqq stack id,
+                start (ns since the match started), duration (ns)
+    A stack is named once per file, before its first use.
+
+Run `python tracing.py FILE` for a per-phase breakdown of the traced matches,
+`python tracing.py FILE --collapsed` for collapsed stacks (self time in
+microseconds) to feed flamegraph.pl or speedscope, `--match N` for a single
+match, and `python tracing.py --benchmark` for the cost of a span.
+"""
+
+import functools
+import importlib
+import itertools
+import struct
+import sys
+import threading
+import time
+
+MAGIC = b'BSTR'
+STACK = struct.Struct('<cHH')
+MATCH = struct.Struct('<cII')
+SPAN = struct.Struct('<Hqq')
+
+# (module, class, method, span name): wrapped by enable()
+INSTRUMENTED = [
+    ('battleship', 'Board', 'can_place_ship', 'board.can_place_ship'),
+    ('battleship', 'Board', 'add_ship', 'board.add_ship'),
+    ('battleship', 'Board', 'fire_at', 'board.fire_at'),
+    ('battleship', 'TwoPlayerGame', 'fire', 'game.fire'),
+    ('battleship', 'TwoPlayerGame', 'get_visible_board_for_player', 'game.visible_board'),
+    ('protocol', 'TextConnection', 'send', 'send'),
+    ('protocol', 'TextConnection', 'send_board', 'send_board'),
+    ('protocol', 'BinaryConnection', 'send', 'send'),
+    ('protocol', 'BinaryConnection', 'send_board', 'send_board'),
+    ('sessions', 'Seat', 'recv', 'client.wait'),
+    ('ai', 'AIConnection', 'recv', 'bot.move'),
+    ('journal', 'Journal', 'place', 'journal.append'),
+    ('journal', 'Journal', 'fire', 'journal.append'),
+    ('broadcast', 'Broadcaster', 'publish', 'spectate'),
+]
+
+ENABLED = False
+_every = 1
+_matches = itertools.count()
+_file = None
+_lock = threading.Lock()  # stack ids and the file
+
+
+class _Local(threading.local):
+    trace = None  # class defaults: a miss on a thread that never traced costs no AttributeError
+    stack = None
+    phase = None
+
+
+_local = _Local()
+
+# Stacks are interned: (parent id, name) -> id; id 0 is the empty stack
+_ids = {}
+_paths = ['']
+_unwritten = []
+
+
+def _stack_id(parent, name):
+    key = (parent, name)
+    stack = _ids.get(key)
+    if stack is None:
+        with _lock:
+            stack = _ids.get(key)
+            if stack is None:
+                stack = len(_paths)
+                _paths.append(_paths[parent] + ';' + name if parent else name)
+                _unwritten.append(stack)
+                _ids[key] = stack
+    return stack
+
+
+class Trace:
+    """The spans of one sampled match."""
+
+    def __init__(self, number):
+        self.number = number
+        self.t0 = time.perf_counter_ns()
+        self.spans = []  # (stack id, start, duration)
+
+    def record(self, names, start_ns, end_ns):
+        """Add a span timed by the caller (perf_counter_ns values), e.g. one that began before the trace."""
+        stack = 0
+        for name in names:
+            stack = _stack_id(stack, name)
+        self.spans.append((stack, start_ns - self.t0, end_ns - start_ns))
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'stack', 'depth', 'start')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        stack = _local.stack
+        self.depth = len(stack)
+        self.stack = _stack_id(stack[-1] if stack else 0, self.name)
+        stack.append(self.stack)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter_ns() - self.start
+        phase = _local.phase
+        if phase is not None and phase is not self and phase.depth > self.depth:
+            phase.__exit__()  # a phase opened inside this span ends with it
+        if _local.phase is self:
+            _local.phase = None
+        del _local.stack[self.depth:]
+        self.trace.spans.append((self.stack, self.start - self.trace.t0, duration))
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL = _NullSpan()
+
+
+def current():
+    """The trace this thread is recording into, or None."""
+    return _local.trace
+
+
+def span(name):
+    """with span("name"): time a block as a child of the innermost open span."""
+    if not ENABLED:
+        return NULL
+    trace = _local.trace
+    return NULL if trace is None else _Span(trace, name)
+
+
+def phase(name):
+    """
+    End the current phase span (if any) and start one called `name` (if not
+    None). For sequential phases of a long function, without re-indenting it
+    under a `with` per phase; an open phase also ends with its enclosing span.
+    """
+    if _local.trace is None:
+        return
+    if _local.phase is not None:
+        _local.phase.__exit__()
+    if name is not None:
+        _local.phase = _Span(_local.trace, name).__enter__()
+
+
+class _Use:
+    def __init__(self, trace, parents):
+        self.trace = trace
+        self.parents = parents
+
+    def __enter__(self):
+        self.saved = (_local.trace, _local.stack, _local.phase)
+        stack = []
+        for name in self.parents:
+            stack.append(_stack_id(stack[-1] if stack else 0, name))
+        _local.trace, _local.stack, _local.phase = self.trace, stack, None
+        return self.trace
+
+    def __exit__(self, *exc):
+        _local.trace, _local.stack, _local.phase = self.saved
+
+
+def use(trace, *parents):
+    """with use(trace): record this thread's spans into trace, nested under `parents`. A no-op for None."""
+    return NULL if trace is None else _Use(trace, parents)
+
+
+def bind(func, *parents):
+    """func, made to run under this thread's current trace (if any) on whichever thread calls it."""
+    trace = current()
+    if trace is None:
+        return func
+
+    @functools.wraps(func)
+    def bound(*args, **kwargs):
+        with _Use(trace, parents):
+            return func(*args, **kwargs)
+    return bound
+
+
+def start_match():
+    """A Trace for the next match if it is sampled, else None."""
+    if not ENABLED:
+        return None
+    number = next(_matches)
+    return Trace(number) if number % _every == 0 else None
+
+
+def finish(trace):
+    """Write a match's spans to the trace file. A no-op for None."""
+    if trace is None:
+        return
+    out = bytearray()
+    with _lock:
+        for stack in _unwritten:
+            name = _paths[stack].encode()
+            out += STACK.pack(b'S', stack, len(name)) + name
+        _unwritten.clear()
+        out += MATCH.pack(b'M', trace.number, len(trace.spans))
+        for s in trace.spans:
+            out += SPAN.pack(*s)
+        _file.write(out)
+        _file.flush()
+
+
+def _instrument(cls, method, name):
+    original = cls.__dict__[method]
+
+    @functools.wraps(original)
+    def traced(*args, **kwargs):
+        trace = _local.trace
+        if trace is None:
+            return original(*args, **kwargs)
+        with _Span(trace, name):
+            return original(*args, **kwargs)
+    setattr(cls, method, traced)
+
+
+def enable(path, every=1):
+    """Trace one match in `every` into the file at path (appended to)."""
+    global ENABLED, _every, _file
+    if ENABLED:
+        return
+    _file = open(path, 'ab')
+    if _file.tell() == 0:
+        _file.write(MAGIC)
+    else:
+        # Stack ids are per process: name every stack again in this run's part of the file
+        _unwritten[:] = range(1, len(_paths))
+    _every = max(1, every)
+    for module, cls, method, name in INSTRUMENTED:
+        _instrument(getattr(importlib.import_module(module), cls), method, name)
+    ENABLED = True
+
+
+def read(path):
+    """Yield (match number, [(stack name, start ns, duration ns)]) from a trace file."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:4] != MAGIC:
+        raise ValueError(f"{path} is not a trace file")
+    names = {}
+    pos = 4
+    while pos < len(data):
+        kind = data[pos:pos + 1]
+        if kind == b'S':
+            _, stack, length = STACK.unpack_from(data, pos)
+            pos += STACK.size
+            names[stack] = data[pos:pos + length].decode()
+            pos += length
+        elif kind == b'M':
+            _, number, count = MATCH.unpack_from(data, pos)
+            pos += MATCH.size
+            end = pos + count * SPAN.size
+            if end > len(data):
+                return  # cut off mid-write
+            yield number, [(names[stack], start, duration)
+                           for stack, start, duration in SPAN.iter_unpack(data[pos:end])]
+            pos = end
+        else:
+            raise ValueError(f"{path}: bad record at offset {pos}")
+
+
+def aggregate(matches):
+    """{stack name: [calls, total ns, max ns]} over (number, spans) pairs."""
+    totals = {}
+    for _, spans in matches:
+        for name, _, duration in spans:
+            entry = totals.get(name)
+            if entry is None:
+                totals[name] = [1, duration, duration]
+            else:
+                entry[0] += 1
+                entry[1] += duration
+                if duration > entry[2]:
+                    entry[2] = duration
+    return totals
+
+
+def self_times(totals):
+    """{stack name: total ns minus that of its direct children}, floored at 0 (placement threads overlap)."""
+    times = {name: entry[1] for name, entry in totals.items()}
+    for name, entry in totals.items():
+        parent = name.rpartition(';')[0]
+        if parent in times:
+            times[parent] -= entry[1]
+    return {name: max(0, t) for name, t in times.items()}
+
+
+def report(matches, out=sys.stdout):
+    matches = list(matches)
+    totals = aggregate(matches)
+    match_total = totals.get('match', [0, 0, 0])[1]
+    out.write(f"{len(matches)} matches traced, {sum(len(s) for _, s in matches):,} spans\n\n")
+    out.write(f"{'phase':40} {'calls':>8} {'total ms':>11} {'mean us':>10} {'max ms':>9} {'of match':>8}\n")
+    for name in sorted(totals, key=lambda n: n.split(';')):
+        calls, total, longest = totals[name]
+        depth = name.count(';')
+        label = '  ' * depth + name.rpartition(';')[2]
+        share = f"{total / match_total:7.1%}" if match_total else ''
+        out.write(f"{label:40} {calls:8,} {total / 1e6:11.1f} {total / calls / 1e3:10.1f} "
+                  f"{longest / 1e6:9.1f} {share:>8}\n")
+
+
+def collapsed(matches, out=sys.stdout):
+    for name, ns in sorted(self_times(aggregate(matches)).items()):
+        if ns >= 1000:
+            out.write(f"{name} {ns // 1000}\n")
+
+
+def _benchmark(n=1_000_000):
+    class Work:
+        def op(self):
+            pass
+    work = Work()
+
+    def per_call(f):
+        start = time.perf_counter()
+        for _ in range(n):
+            f()
+        return (time.perf_counter() - start) / n * 1e9
+
+    def spans():
+        with span("x"):
+            pass
+    base = per_call(work.op)
+    print(f"plain method call:             {base:6.0f} ns")
+    print(f"with span(), disabled:         {per_call(spans):6.0f} ns")
+
+    global ENABLED
+    ENABLED = True
+    _instrument(Work, 'op', 'op')
+    print(f"instrumented, untraced match:  {per_call(work.op):6.0f} ns")
+    trace = Trace(0)
+    with use(trace, 'match'):
+        print(f"instrumented, traced match:    {per_call(work.op):6.0f} ns")
+        print(f"with span(), traced match:     {per_call(spans):6.0f} ns")
+    ENABLED = False
+    print(f"{len(trace.spans):,} spans recorded")
+
+
+def main(argv):
+    if not argv or argv[0] == '--benchmark':
+        _benchmark()
+        return
+    path = argv[0]
+    only = int(argv[argv.index('--match') + 1]) if '--match' in argv else None
+    matches = ((number, spans) for number, spans in read(path) if only is None or number == only)
+    try:
+        if '--collapsed' in argv:
+            collapsed(matches)
+        else:
+            report(matches)
+    except BrokenPipeError:
+        pass
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
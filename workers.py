@@ -0,0 +1,453 @@
+"""
+workers.py
+
+Multi-process server: N forked worker processes accept on the same ports with
+SO_REUSEPORT (the kernel spreads new connections across them), and each worker
+runs the normal threaded server (server.lobby_loop / run_two_player_game_online)
+for the clients it accepted. Matches therefore run on all cores instead of
+sharing one GIL.
+
+The lobby stays a single FIFO across workers: the parent process is a
+Coordinator that owns the global queue, and each worker's server.matchmaker is
+a RemoteMatchmaker that forwards join/leave to it over a Unix SOCK_SEQPACKET
+socketpair (one JSON message per packet).
+
+When two players on different workers are paired, the waiting player's socket
+is moved to the host's worker: its worker sends the file descriptor to the
+coordinator with SCM_RIGHTS, the coordinator forwards it, and the host wraps it
+in a fresh TextConnection/BinaryConnection; a binary one carries on from the
+old one's sequence numbers and session keys (BinaryConnection.state()). The
+host's SessionStore gives it a Seat under the resume token and chat name it
+had, so it is journaled, can resume and chats like any other player there. The
+player then stays on that worker. Anything the player typed while queued is
+discarded, as in the single-process lobby.
+
+Each worker has its own spectator hub, so a spectator sees the latest match of
+whichever worker accepted it.
+
+Run with `python server.py --workers N` (Linux/BSD; needs SO_REUSEPORT and
+socket.send_fds). `python workers.py [--workers 1 2 4]` runs a games/s benchmark.
+"""
+
+import itertools
+import json
+import multiprocessing
+import os
+import selectors
+import socket
+import threading
+from collections import OrderedDict
+
+from logs import log
+from matchmaking import Matchmaker, Ticket
+
+MAX_MESSAGE = 4096
+
+
+def send_message(chan, msg, fds=()):
+    data = json.dumps(msg).encode()
+    if fds:
+        socket.send_fds(chan, [data], list(fds))
+    else:
+        chan.send(data)
+
+
+def recv_message(chan):
+    """Returns (msg, fds); msg is None once the other end has gone away."""
+    data, fds, _, _ = socket.recv_fds(chan, MAX_MESSAGE, 1)
+    if not data:
+        for fd in fds:
+            os.close(fd)
+        return None, []
+    return json.loads(data), fds
+
+
+class Coordinator:
+    """
+    The global lobby, run in the parent process. Workers are identified by their
+    index in `channels`; a queued player is (worker, ticket_id).
+
+    Messages from workers:
+      join {ticket}             enqueue, or pair with the oldest waiter
+      leave {ticket}            waiter hung up (ignored if already paired)
+      handoff {ticket, gone}    reply to a handoff request, carrying the socket fd
+                                (and kind, state, token, name: see RemoteMatchmaker._hand_off)
+    Messages to workers:
+      wait {ticket}             nobody to play yet
+      host {ticket, opponent}   pair with a waiter on the same worker
+      host {ticket, kind, state, token, name} + fd
+                                pair with a waiter moved over from another worker
+      handoff {ticket}          send us the socket of this waiting ticket
+    """
+
+    def __init__(self, channels):
+        self.channels = channels
+        self._queue = OrderedDict()  # (worker, ticket) -> None, oldest first
+        self._handoffs = {}  # (waiter worker, waiter ticket) -> (host worker, host ticket)
+        self.matches = 0
+        self.moved = 0
+
+    def run(self):
+        selector = selectors.DefaultSelector()
+        for worker, chan in enumerate(self.channels):
+            selector.register(chan, selectors.EVENT_READ, worker)
+        while selector.get_map():
+            for key, _ in selector.select():
+                worker = key.data
+                try:
+                    msg, fds = recv_message(key.fileobj)
+                except (ConnectionError, OSError):
+                    msg, fds = None, []
+                if msg is None:
+                    selector.unregister(key.fileobj)
+                    self._drop_worker(worker)
+                    continue
+                self._dispatch(worker, msg, fds)
+
+    def _dispatch(self, worker, msg, fds):
+        op = msg['op']
+        if op == 'join':
+            self._join(worker, msg['ticket'])
+        elif op == 'leave':
+            self._queue.pop((worker, msg['ticket']), None)
+        elif op == 'handoff':
+            host = self._handoffs.pop((worker, msg['ticket']), None)
+            if host is None:
+                for fd in fds:
+                    os.close(fd)
+                return
+            if msg.get('gone') or not fds:
+                self._join(*host)  # waiter vanished first: pair the host with someone else
+                return
+            host_worker, host_ticket = host
+            try:
+                send_message(self.channels[host_worker],
+                             {'op': 'host', 'ticket': host_ticket, 'kind': msg['kind'], 'state': msg.get('state'),
+                              'token': msg.get('token'), 'name': msg.get('name')}, fds)
+                self.matches += 1
+                self.moved += 1
+            except OSError:
+                pass
+            finally:
+                for fd in fds:
+                    os.close(fd)
+
+    def _join(self, worker, ticket):
+        if not self._queue:
+            self._queue[(worker, ticket)] = None
+            self._send(worker, {'op': 'wait', 'ticket': ticket})
+            return
+        (waiter_worker, waiter_ticket), _ = self._queue.popitem(last=False)
+        if waiter_worker == worker:
+            self.matches += 1
+            self._send(worker, {'op': 'host', 'ticket': ticket, 'opponent': waiter_ticket})
+        else:
+            self._handoffs[(waiter_worker, waiter_ticket)] = (worker, ticket)
+            self._send(waiter_worker, {'op': 'handoff', 'ticket': waiter_ticket})
+
+    def _send(self, worker, msg):
+        try:
+            send_message(self.channels[worker], msg)
+        except OSError:
+            pass
+
+    def _drop_worker(self, worker):
+        """A worker died: forget its waiters and re-pair hosts that were waiting on them."""
+        for key in [k for k in self._queue if k[0] == worker]:
+            del self._queue[key]
+        for waiter, host in list(self._handoffs.items()):
+            if waiter[0] == worker:
+                del self._handoffs[waiter]
+                if host[0] != worker:
+                    self._join(*host)
+
+
+class MovedTicket(Ticket):
+    """
+    Opponent ticket for a player whose socket was moved here from another worker.
+    Nobody on this worker is waiting on it, so when the host finishes the match
+    the player gets a lobby thread of its own here.
+    """
+
+    def __init__(self, player, on_adopt):
+        super().__init__(player)
+        self._on_adopt = on_adopt
+
+    def finish(self, disconnected=False):
+        super().finish(disconnected)
+        threading.Thread(target=self._on_adopt, args=(self.player,), daemon=True).start()
+
+
+class RemoteMatchmaker(Matchmaker):
+    """
+    Worker-side Matchmaker: same interface as matchmaking.Matchmaker, so
+    server.lobby_loop and LobbyWatcher use it unchanged, but pairing is decided
+    by the Coordinator. join() blocks for one round trip to the coordinator.
+
+    _queue holds this worker's waiting tickets (as in Matchmaker); `matches` and
+    the time-to-match stats count the matches hosted by this worker.
+    """
+
+    def __init__(self, chan, conn_classes, sessions, on_adopt):
+        super().__init__()
+        self.chan = chan
+        self.conn_classes = conn_classes  # {'text': TextConnection, 'binary': BinaryConnection}
+        self.sessions = sessions  # sessions.SessionStore that seats moved-in players
+        self.on_adopt = on_adopt  # called with a moved-in player after its first match here
+        self._ids = itertools.count()
+        self._by_id = {}
+        self._replies = {}  # ticket id -> [threading.Event, reply msg, fds]
+        self._send_lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self._run, name="coordinator-link", daemon=True).start()
+
+    def join(self, player):
+        while True:
+            ticket = self.ticket_cls(player)
+            ticket.id = next(self._ids)
+            reply = self._replies[ticket.id] = [threading.Event(), None, []]
+            with self._lock:
+                # Queued locally before asking, so a handoff request that
+                # follows our 'wait' reply always finds the ticket
+                self._queue[ticket] = None
+                self._by_id[ticket.id] = ticket
+            self._send({'op': 'join', 'ticket': ticket.id})
+            reply[0].wait()
+            del self._replies[ticket.id]
+            msg, fds = reply[1], reply[2]
+            if msg['op'] == 'wait':
+                return ticket
+
+            with self._lock:
+                del self._queue[ticket]
+                del self._by_id[ticket.id]
+                if fds:
+                    log.info("Opponent moved in from another worker")
+                    sock = socket.socket(fileno=fds[0])
+                    connection = self.conn_classes[msg['kind']](sock)
+                    if msg.get('state') is not None:
+                        connection.restore(msg['state'])
+                    seat = self.sessions.adopt(connection, msg.get('token'), msg.get('name'))
+                    opponent = MovedTicket(seat, self.on_adopt)
+                    self._pair(opponent, ticket)
+                    return ticket
+                opponent = self._by_id.pop(msg['opponent'], None)
+                if opponent is not None:
+                    del self._queue[opponent]
+                    self._pair(opponent, ticket)
+                    return ticket
+            # Our opponent hung up here before the coordinator heard about it: queue again
+
+    def leave(self, ticket):
+        with self._lock:
+            if ticket not in self._queue:
+                return False
+            self._forget(ticket)
+        ticket.finish(disconnected=True)
+        return True
+
+    def withdraw(self, ticket):
+        with self._lock:
+            if ticket not in self._queue:
+                return False
+            self._forget(ticket)
+        return True
+
+    def evict_if(self, ticket, is_gone):
+        with self._lock:
+            if ticket not in self._queue:
+                return False
+            if not is_gone():
+                return True
+            self._forget(ticket)
+        ticket.finish(disconnected=True)
+        return False
+
+    def _forget(self, ticket):
+        del self._queue[ticket]
+        del self._by_id[ticket.id]
+        self._send({'op': 'leave', 'ticket': ticket.id})
+
+    def _send(self, msg, fds=()):
+        with self._send_lock:
+            send_message(self.chan, msg, fds)
+
+    def _run(self):
+        while True:
+            msg, fds = recv_message(self.chan)
+            if msg is None:
+                os._exit(1)  # coordinator is gone; the supervisor exits with it
+            # One bad message must not take the link down: every later join would hang
+            try:
+                if msg['op'] == 'handoff':
+                    self._hand_off(msg['ticket'])
+                else:
+                    reply = self._replies[msg['ticket']]
+                    reply[1], reply[2] = msg, fds
+                    reply[0].set()
+            except Exception as e:
+                log.error("Coordinator message %s failed: %s", msg.get('op'), e)
+
+    def _hand_off(self, ticket_id):
+        """Send a waiting player's socket to the coordinator and release it here."""
+        with self._lock:
+            ticket = self._by_id.pop(ticket_id, None)
+            if ticket is not None:
+                del self._queue[ticket]
+        if ticket is None:
+            self._send({'op': 'handoff', 'ticket': ticket_id, 'gone': True})
+            return
+        player = ticket.player
+        # A Seat, or a bare connection if whoever queued it didn't seat it
+        connection = getattr(player, 'connection', player)
+        try:
+            kind = 'binary' if connection.binary else 'text'
+            # Sequence numbers (and the keys of an encrypted connection) go with the socket,
+            # and so does the seat's resume token: the seat is taken up again on the host
+            state = connection.state() if connection.binary else None
+            self._send({'op': 'handoff', 'ticket': ticket_id, 'kind': kind, 'state': state,
+                        'token': getattr(player, 'token', None), 'name': getattr(player, 'name', None)},
+                       [connection.conn.fileno()])
+        except Exception as e:
+            # The coordinator's host is waiting on this reply: always send one
+            log.error("Handoff of ticket %s failed: %s", ticket_id, e)
+            self._send({'op': 'handoff', 'ticket': ticket_id, 'gone': True})
+            ticket.finish(disconnected=True)
+            return
+        ticket.handed_off = True
+        ticket.finish()
+
+
+def worker_main(index, chan, inherited):
+    """Entry point of one forked worker: the threaded server with a RemoteMatchmaker."""
+    # Coordinator ends of earlier workers' channels came with the fork; holding
+    # them would keep those workers from seeing EOF if the coordinator dies
+    for sock in inherited:
+        sock.close()
+    import server
+    from broadcast import BroadcastHub
+    from logs import setup as setup_logging
+    from matchmaking import LobbyWatcher
+    from protocol import TextConnection
+
+    # server's module-level lobby and hub may have been created before the fork;
+    # their selectors would be shared with the other workers, so make our own
+    server.matchmaker = RemoteMatchmaker(chan, {'text': TextConnection, 'binary': server.binary_connection},
+                                         server.sessions, server.lobby_loop)
+    server.lobby_watcher = LobbyWatcher(server.matchmaker)
+    server.spectator_hub = BroadcastHub(chat=server.chat)
+    if server.JOURNAL_DIR is not None:
+        # One journal per worker: its matches (and their sessions) live in this process
+        server.JOURNAL_DIR = os.path.join(server.JOURNAL_DIR, f"worker-{index}")
+    if server.REPLAY_PATH is not None:
+        server.REPLAY_PATH = f"{server.REPLAY_PATH}.worker-{index}"  # `replay.py stats` takes them all
+    if server.TRACE_PATH is not None:
+        server.TRACE_PATH = f"{server.TRACE_PATH}.worker-{index}"
+    server.STATS_PORT += 1 + index  # each worker has its own metrics: STATS_PORT + 1 + index
+    server.matchmaker.start()
+    setup_logging(server.LOG_LEVEL)
+    log.info("Worker %d started (pid %d)", index, os.getpid())
+    try:
+        server.main(reuse_port=True)
+    except KeyboardInterrupt:
+        pass  # Ctrl+C reaches the whole process group; the coordinator reports it
+
+
+def run_workers(n):
+    """Fork n workers and run the coordinator in this process until they exit."""
+    import signal
+    from config import raise_fd_limit, LOG_LEVEL
+    from logs import setup as setup_logging
+    raise_fd_limit()
+    ctx = multiprocessing.get_context('fork')
+    channels, procs = [], []
+    for i in range(n):
+        parent_end, child_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        proc = ctx.Process(target=worker_main, args=(i, child_end, list(channels)),
+                           name=f"worker-{i}", daemon=True)
+        proc.start()
+        child_end.close()
+        channels.append(parent_end)
+        procs.append(proc)
+    setup_logging(LOG_LEVEL)  # after forking: each worker starts its own log thread
+    # `kill <pid>` should take the workers down with the coordinator
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    coordinator = Coordinator(channels)
+    try:
+        coordinator.run()
+    except KeyboardInterrupt:
+        log.info("Server shutting down.")
+    finally:
+        for proc in procs:
+            proc.terminate()
+
+
+def _bot(host, port, games, done):
+    """Scripted text client: places the fleet in rows A-E (one FLEET line) and fires row by row."""
+    from battleship import SHIPS
+    from client import Client, Handler
+
+    class RowBot(Handler):
+        placements = "FLEET " + " ".join(f"{chr(65 + i)}1 H" for i in range(len(SHIPS)))
+        shots = None
+        played = 0
+
+        def on_text(self, client, line):
+            if line.startswith("Welcome Player"):
+                self.shots = iter(f"{chr(65 + r)}{c}" for r in range(10) for c in range(1, 11))
+            elif line.startswith("Enter starting"):
+                client.send(self.placements)
+            elif line.startswith("Your turn"):
+                client.send(next(self.shots))
+            elif line.startswith("Game over."):
+                self.played += 1
+                if self.played == games:
+                    client.stop()
+
+    sock = socket.create_connection((host, port))
+    bot = RowBot()
+    client = Client(sock, handler=bot)
+    client.send("HELLO")
+    client.run()
+    done.put(bot.played)
+    sock.close()
+
+
+def _benchmark(worker_counts, pairs=32, games=5):
+    """Completed games per second with 2 * pairs bot clients, for each worker count."""
+    import subprocess
+    import sys
+    import time
+    from config import HOST, PORT
+
+    bot_procs = max(1, os.cpu_count() or 1)
+    for n in worker_counts:
+        server_proc = subprocess.Popen([sys.executable, "server.py", "--workers", str(n)],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        time.sleep(1.0)
+        ctx = multiprocessing.get_context('fork')
+        done = ctx.Queue()
+        start = time.perf_counter()
+        bots = [ctx.Process(target=_bot, args=(HOST, PORT, games, done)) for _ in range(pairs * 2)]
+        for bot in bots:
+            bot.start()
+        played = sum(done.get() for _ in bots)
+        elapsed = time.perf_counter() - start
+        for bot in bots:
+            bot.join()
+        server_proc.terminate()
+        server_proc.wait()
+        print(f"{n:2d} worker(s): {played // 2:5d} games in {elapsed:6.2f}s  "
+              f"{played / 2 / elapsed:7.1f} games/s  ({bot_procs} core(s) available)")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="games/s with 1..N worker processes")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--pairs", type=int, default=32)
+    parser.add_argument("--games", type=int, default=5)
+    args = parser.parse_args()
+    _benchmark(args.workers, args.pairs, args.games)